@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Scale benchmarks for the checkers, run against moto.
+
+Each benchmark seeds a fresh mocked account, runs one checker entry point and records
+wall time, peak traced memory and the number of AWS API calls per operation. Results
+are written as JSON so runs of different versions can be compared:
+
+    python3 -m benchmarks.bench_checkers --instances 10000 --profiles 50 --buckets 5000 --db-instances 2000
+"""
+import argparse
+import json
+import logging
+import platform
+import time
+import tracemalloc
+from collections import Counter
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+import boto3
+from moto import mock_aws
+from code.helpers import configure_client_pool, get_client_pool, set_client_pool
+from code.rate_limiter import DEFAULT_RATES, get_rate_limiter, set_rate
+from code.ec2_check_remove_ssm_policy import ENGINE_INSTANCE, ENGINE_POLICY, check_remove_ssm_policy
+from code.rds_check_remove_public_access import check_remove_public_access
+from code.s3_check_remove_public_access import main as s3_main
+
+# Configure logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# Constants for the mocked environment
+REGION = 'us-east-1'
+AMI = 'ami-061392db613a6357b'
+DEFAULT_OUTPUT = 'bench_output.json'
+
+ROLE_POLICY_DOC = json.dumps({
+    'Version': '2012-10-17',
+    'Statement': [{
+        'Effect': 'Allow',
+        'Principal': {'Service': 'ec2.amazonaws.com'},
+        'Action': 'sts:AssumeRole'
+    }]
+})
+
+SSM_POLICY_DOC = json.dumps({
+    'Version': '2012-10-17',
+    'Statement': [{'Effect': 'Allow', 'Action': ['ssm:UpdateInstanceInformation'], 'Resource': '*'}]
+})
+
+
+def seed_ec2(instances: int, profiles: int) -> None:
+    """
+    Creates EC2 instances spread over instance profiles; every other profile's role has the SSM policy.
+
+    :param instances: Number of EC2 instances
+    :param profiles: Number of instance profiles
+    """
+    iam = boto3.client('iam', region_name=REGION)
+    ec2 = boto3.client('ec2', region_name=REGION)
+    policy_arn = iam.create_policy(PolicyName='AmazonSSMManagedInstanceCore',
+                                   PolicyDocument=SSM_POLICY_DOC)['Policy']['Arn']
+    profile_arns = []
+    for index in range(max(1, profiles)):
+        name = f'bench-profile-{index}'
+        profile_arns.append(iam.create_instance_profile(InstanceProfileName=name)['InstanceProfile']['Arn'])
+        iam.create_role(RoleName=name, AssumeRolePolicyDocument=ROLE_POLICY_DOC)
+        iam.add_role_to_instance_profile(InstanceProfileName=name, RoleName=name)
+        if index % 2 == 0:
+            iam.attach_role_policy(RoleName=name, PolicyArn=policy_arn)
+
+    # moto only attaches the profile to the first instance of a launch, so launch one at a time
+    for index in range(instances):
+        ec2.run_instances(ImageId=AMI, MinCount=1, MaxCount=1,
+                          IamInstanceProfile={'Arn': profile_arns[index % len(profile_arns)]})
+
+
+def seed_s3(buckets: int) -> None:
+    """
+    Creates S3 buckets; every third bucket has a public bucket policy.
+
+    :param buckets: Number of S3 buckets
+    """
+    s3 = boto3.client('s3', region_name=REGION)
+    for index in range(buckets):
+        name = f'bench-bucket-{index}'
+        s3.create_bucket(Bucket=name)
+        if index % 3 == 0:
+            s3.put_bucket_policy(Bucket=name, Policy=json.dumps({
+                'Version': '2012-10-17',
+                'Statement': [{
+                    'Effect': 'Allow',
+                    'Principal': '*',
+                    'Action': 's3:GetObject',
+                    'Resource': f'arn:aws:s3:::{name}/*'
+                }]
+            }))
+
+
+def seed_rds(db_instances: int) -> None:
+    """
+    Creates RDS instances; every other instance is publicly accessible.
+
+    :param db_instances: Number of RDS instances
+    """
+    rds = boto3.client('rds', region_name=REGION)
+    for index in range(db_instances):
+        rds.create_db_instance(
+            DBInstanceIdentifier=f'bench-db-{index}',
+            AllocatedStorage=20,
+            DBInstanceClass='db.t4g.micro',
+            Engine='mysql',
+            MasterUsername='admin',
+            MasterUserPassword='password',
+            PubliclyAccessible=index % 2 == 0
+        )
+
+
+def measure(seed: Callable[[], None], run: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Seeds a fresh mocked account and measures one checker run in it.
+
+    :param seed: Function creating the mocked resources
+    :param run: Checker entry point to measure
+    :return: Wall time, peak memory, API calls per operation and the checker status
+    """
+    with mock_aws():
+        seed()
+
+        # Fresh clients, so the counter sees every call the checker makes
+        previous_pool = get_client_pool()
+        pool = configure_client_pool()
+        api_calls: Counter = Counter()
+
+        def count_call(event_name: str, model, **kwargs: Any) -> None:
+            api_calls[f"{event_name.split('.')[1]}.{model.name}"] += 1
+
+        pool.session.events.register('before-call', count_call)
+
+        try:
+            tracemalloc.start()
+            start = time.perf_counter()
+            result = run()
+            wall_time = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            # The pool's clients talk to this mocked account, so the caller's pool is put back
+            set_client_pool(previous_pool)
+
+    return {
+        "status": result['status'],
+        "reason": result['reason'],
+        "wall_time": round(wall_time, 4),
+        "peak_memory_bytes": peak,
+        "total_api_calls": sum(api_calls.values()),
+        "api_calls": dict(sorted(api_calls.items())),
+    }
+
+
+def run_benchmarks(instances: int, profiles: int, buckets: int, db_instances: int,
+                   only: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Runs every benchmark, or the selected ones.
+
+    :param instances: Number of EC2 instances
+    :param profiles: Number of instance profiles
+    :param buckets: Number of S3 buckets
+    :param db_instances: Number of RDS instances
+    :param only: Names of the benchmarks to run, all if omitted
+    :return: Measurements keyed by benchmark name
+    """
+    benchmarks = {
+        "ec2_instance_engine": (partial(seed_ec2, instances, profiles),
+                                partial(check_remove_ssm_policy, REGION, engine=ENGINE_INSTANCE)),
+        "ec2_policy_engine": (partial(seed_ec2, instances, profiles),
+                              partial(check_remove_ssm_policy, REGION, engine=ENGINE_POLICY)),
+        "s3": (partial(seed_s3, buckets), partial(s3_main, REGION)),
+        "rds": (partial(seed_rds, db_instances), partial(check_remove_public_access, REGION)),
+    }
+    results = {}
+    for name, (seed, run) in benchmarks.items():
+        if only and name not in only:
+            continue
+        logger.warning(f"Running benchmark {name}")
+        results[name] = measure(seed, run)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Runs the benchmarks and writes the results to a JSON file.
+
+    :param argv: Command line arguments
+    :return: Benchmark report
+    """
+    parser = argparse.ArgumentParser(description="Scale benchmarks for the AWS policy checkers")
+    parser.add_argument('--instances', type=int, default=1000, help="number of EC2 instances")
+    parser.add_argument('--profiles', type=int, default=50, help="number of instance profiles")
+    parser.add_argument('--buckets', type=int, default=500, help="number of S3 buckets")
+    parser.add_argument('--db-instances', type=int, default=200, help="number of RDS instances")
+    parser.add_argument('--only', action='append', help="benchmark to run, may be repeated")
+    parser.add_argument('--label', default='', help="label stored with the results, e.g. a version")
+    parser.add_argument('--keep-rate-limits', action='store_true',
+                        help="keep the default API rate limits instead of lifting them for moto")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="path of the JSON results file")
+    args = parser.parse_args(argv)
+
+    # moto does not throttle, so the limiter would only measure its own waits
+    previous_rates = {}
+    if not args.keep_rate_limits:
+        for service in DEFAULT_RATES:
+            previous_rates[service] = get_rate_limiter(service).max_rate
+            set_rate(service, 1e9)
+
+    try:
+        results = run_benchmarks(args.instances, args.profiles, args.buckets, args.db_instances, args.only)
+    finally:
+        for service, rate in previous_rates.items():
+            set_rate(service, rate)
+
+    report = {
+        "label": args.label,
+        "python": platform.python_version(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "params": {
+            "instances": args.instances,
+            "profiles": args.profiles,
+            "buckets": args.buckets,
+            "db_instances": args.db_instances,
+        },
+        "results": results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.warning(f"Benchmark results written to {args.output}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
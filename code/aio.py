@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio API for embedding the checks in async services.
+
+boto3 clients are blocking, so every API call runs on one bounded thread pool shared by all
+scans of the process, one call at a time, instead of one thread per scan. Within a scan,
+discovery pages are fetched while earlier resources are evaluated and remediated, up to a
+number of resources in flight. Scans can be cancelled or given a timeout like any other
+coroutine, and stream their findings as an async iterator.
+"""
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Set
+import boto3
+from . import helpers
+from .engine import Check, CheckContext, finish_check, get_check, process_resource
+from .ec2_check_remove_ssm_policy import ENGINE_INSTANCE
+from .findings import VERDICT_ERROR, FindingSink, make_finding
+from .helpers import DbInstanceRecord, InstanceRecord, handle_failure, handle_success
+from .iam_authorization import PolicyMatcher
+from .metrics import get_metrics
+from .rds_check_remove_public_access import DEFAULT_POLL_INTERVAL
+from .s3_check_remove_public_access import REMEDIATION_POLICY
+from .state_store import StateStore
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Number of threads running blocking API calls for every scan of the process; matches the client connection pool
+DEFAULT_IO_WORKERS = 32
+
+# Number of resources evaluated and remediated at the same time by one scan
+DEFAULT_CONCURRENCY = 16
+
+# Marks the end of an iterator or of a scan's findings
+_DONE = object()
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def configure_executor(max_workers: int = DEFAULT_IO_WORKERS) -> None:
+    """
+    Replaces the thread pool running the blocking API calls, e.g. to size it for many concurrent scans.
+
+    Calls already running finish on the previous pool.
+
+    :param max_workers: Number of threads
+    """
+    global _executor
+    with _executor_lock:
+        previous, _executor = _executor, ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aio")
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool running the blocking API calls, creating it on first use.
+
+    :return: Thread pool
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_IO_WORKERS, thread_name_prefix="aio")
+        return _executor
+
+
+async def call(function: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Runs a blocking function on the shared thread pool without blocking the event loop.
+
+    :param function: Blocking function, e.g. a helper making an API call
+    :param args: Positional arguments
+    :param kwargs: Keyword arguments
+    :return: Return value of the function
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(function, *args, **kwargs))
+
+
+async def iterate(iterator: Iterator[Any]) -> AsyncIterator[Any]:
+    """
+    Iterates over a blocking iterator, e.g. a paginated describe helper, one item per thread hop.
+
+    :param iterator: Blocking iterator
+    :return: Async iterator over the same items
+    """
+    while True:
+        item = await call(next, iterator, _DONE)
+        if item is _DONE:
+            return
+        yield item
+
+
+def wrap(function: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Builds the async variant of a blocking helper.
+
+    :param function: Blocking helper
+    :return: Coroutine function taking the same arguments
+    """
+    @functools.wraps(function)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return await call(function, *args, **kwargs)
+    return wrapper
+
+
+def wrap_iterator(function: Callable[..., Iterator[Any]]) -> Callable[..., AsyncIterator[Any]]:
+    """
+    Builds the async variant of a blocking generator helper, e.g. one yielding describe pages.
+
+    :param function: Blocking generator helper
+    :return: Async generator function taking the same arguments
+    """
+    @functools.wraps(function)
+    async def wrapper(*args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        async for item in iterate(function(*args, **kwargs)):
+            yield item
+    return wrapper
+
+
+# Async variants of the helper layer; paginated helpers fetch one page per thread hop
+describe_instance_record_pages = wrap_iterator(helpers.describe_instance_record_pages)
+describe_db_instance_record_pages = wrap_iterator(helpers.describe_db_instance_record_pages)
+describe_instance_records_by_id = wrap(helpers.describe_instance_records_by_id)
+describe_db_instance_records_by_id = wrap(helpers.describe_db_instance_records_by_id)
+list_buckets = wrap(helpers.list_buckets)
+get_bucket_policy = wrap(helpers.get_bucket_policy)
+delete_bucket_policy = wrap(helpers.delete_bucket_policy)
+put_bucket_policy = wrap(helpers.put_bucket_policy)
+get_instance_profile = wrap(helpers.get_instance_profile)
+list_attached_policies = wrap(helpers.list_attached_policies)
+detach_policy = wrap(helpers.detach_policy)
+modify_db_instance = wrap(helpers.modify_db_instance)
+
+
+async def describe_instance_records(ec2_client: boto3.client, page_size: int = helpers.DEFAULT_PAGE_SIZE,
+                                    filters: Optional[List[Dict[str, Any]]] = None) -> AsyncIterator[InstanceRecord]:
+    """
+    Describes EC2 instances page by page, yielding each record as its page arrives.
+
+    :param ec2_client: Initialized EC2 client
+    :param page_size: Number of instances requested per page
+    :param filters: DescribeInstances filters, e.g. from instance_filters(); every instance if omitted
+    :return: Async iterator over EC2 instance records
+    """
+    async for _, records in describe_instance_record_pages(ec2_client, page_size, filters=filters):
+        for record in records:
+            yield record
+
+
+async def describe_db_instance_records(rds_client: boto3.client, page_size: int = helpers.DEFAULT_DB_PAGE_SIZE
+                                       ) -> AsyncIterator[DbInstanceRecord]:
+    """
+    Describes RDS instances page by page, yielding each record as its page arrives.
+
+    :param rds_client: Initialized RDS client
+    :param page_size: Number of instances requested per page
+    :return: Async iterator over DB instance records
+    """
+    async for _, records in describe_db_instance_record_pages(rds_client, page_size):
+        for record in records:
+            yield record
+
+
+async def stream_check(check: Check, remediate: bool = True, concurrency: int = DEFAULT_CONCURRENCY,
+                       state_store: Optional[StateStore] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Runs a check and yields its findings as the resources are processed.
+
+    Discovery fetches the next page while the resources found so far are evaluated and
+    remediated, e.g. instance profiles are looked up while instances are still being paged.
+    Closing the iterator or cancelling its consumer stops discovery and drops the findings
+    still in flight; calls already running on the thread pool finish in the background.
+
+    :param check: Check instance
+    :param remediate: Perform the remediation actions, or only report them
+    :param concurrency: Maximum number of resources processed at the same time
+    :param state_store: Store of previous verdicts; unchanged resources are skipped
+    :return: Async iterator over findings, one per resource
+    """
+    # Bounded, so a slow consumer holds up processing and, through the slots, discovery
+    findings: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=max(1, concurrency))
+    slots = asyncio.Semaphore(max(1, concurrency))
+    tasks: Set["asyncio.Task[None]"] = set()
+
+    async def process(resource: Any) -> None:
+        try:
+            try:
+                finding = await call(process_resource, check, resource, remediate, state_store)
+            except Exception as e:
+                finding = make_finding(check.name, check.context.region, check.resource_id(resource), VERDICT_ERROR,
+                                       status="Error", reason=f"Unexpected error: {e}")
+            await findings.put(finding)
+        finally:
+            slots.release()
+
+    async def discover() -> None:
+        try:
+            async for _, resources in iterate(check.pages()):
+                for resource in resources:
+                    await slots.acquire()
+                    task = asyncio.ensure_future(process(resource))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        except Exception as e:
+            logger.error(f"Error discovering {check.name} resources: {e}")
+            await findings.put(make_finding(check.name, check.context.region, None, VERDICT_ERROR, status="Error",
+                                            reason=f"Discovery failed: {e}"))
+        if tasks:
+            await asyncio.gather(*tasks)
+        for finding in await call(finish_check, check):
+            await findings.put(finding)
+        await findings.put(_DONE)
+
+    discovery = asyncio.ensure_future(discover())
+    try:
+        while True:
+            finding = await findings.get()
+            if finding is _DONE:
+                break
+            yield finding
+        if state_store is not None:
+            await call(state_store.commit)
+    finally:
+        discovery.cancel()
+        for task in list(tasks):
+            task.cancel()
+
+
+async def run_check(name: str, region: str = "us-east-1", credentials: Optional[Dict[str, str]] = None,
+                    remediate: bool = True, concurrency: int = DEFAULT_CONCURRENCY,
+                    state_store: Optional[StateStore] = None, sink: Optional[FindingSink] = None,
+                    timeout: Optional[float] = None, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Runs a registered check and summarizes its findings, like the engine's run_check.
+
+    :param name: Check name
+    :param region: AWS region to run the check in
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+    :param remediate: Perform the remediation actions, or only report them
+    :param concurrency: Maximum number of resources processed at the same time
+    :param state_store: Store of previous verdicts; unchanged resources are skipped
+    :param sink: Receives each finding as it is produced; the findings are then left out of the summary
+    :param timeout: Seconds after which the scan is stopped and reported as an error, no limit if omitted
+    :param options: Options of the check, e.g. {"engine": "policy"} for EC2 or {"remediation": "block"} for S3
+    :return: Summary with verdict counts, and the findings under "findings" unless a sink was given
+    """
+    start = time.perf_counter()
+    baseline = get_metrics().snapshot()
+    check = get_check(name)(CheckContext(region, credentials, options))
+    findings: List[Dict[str, Any]] = []
+    verdicts: Dict[str, int] = {}
+    errors = 0
+
+    async def collect() -> None:
+        nonlocal errors
+        async for finding in stream_check(check, remediate, concurrency, state_store):
+            verdicts[finding["verdict"]] = verdicts.get(finding["verdict"], 0) + 1
+            errors += finding["status"] != "Success"
+            if sink is not None:
+                sink(finding)
+            else:
+                findings.append(finding)
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(collect(), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+
+    message = f"Checked {sum(verdicts.values())} {name} resource/-s"
+    if verdicts:
+        message += ": " + ", ".join(f"{count} {verdict}" for verdict, count in sorted(verdicts.items()))
+    if timed_out:
+        message = f"Timed out after {timeout} seconds. {message}"
+    details = {"verdicts": verdicts, "metrics": get_metrics().since(baseline),
+               "duration": round(time.perf_counter() - start, 3), **check.stats()}
+    if sink is None:
+        details["findings"] = findings
+    if errors or timed_out:
+        return handle_failure(message, **details)
+    return handle_success(message, **details)
+
+
+async def ec2_check_remove_ssm_policy(region: str = "us-east-1", credentials: Optional[Dict[str, str]] = None,
+                                      engine: str = ENGINE_INSTANCE, matcher: Optional[PolicyMatcher] = None,
+                                      profiled_only: bool = False, page_size: int = helpers.DEFAULT_PAGE_SIZE,
+                                      **options: Any) -> Dict[str, Any]:
+    """
+    Detaches the SSM policy from the roles of EC2 instance profiles, like ec2_check_remove_ssm_policy.
+
+    :param region: AWS region where the EC2 instances are located
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+    :param engine: ENGINE_INSTANCE, ENGINE_POLICY or ENGINE_ACCOUNT, as for check_remove_ssm_policy
+    :param matcher: Forbidden policies of the account engine, the SSM policy by name if omitted
+    :param profiled_only: Have the API leave out instances without an instance profile
+    :param page_size: Number of instances fetched per DescribeInstances page
+    :param options: Options of run_check, e.g. remediate, state_store, sink or timeout
+    :return: Summary with verdict counts
+    """
+    return await run_check("ec2", region, credentials, options={
+        "engine": engine, "matcher": matcher, "profiled_only": profiled_only, "page_size": page_size}, **options)
+
+
+async def rds_check_remove_public_access(region: str = "us-east-1", credentials: Optional[Dict[str, str]] = None,
+                                         wait: float = 0.0, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                                         **options: Any) -> Dict[str, Any]:
+    """
+    Disables public access on RDS instances and reports public Multi-AZ DB clusters, like rds_check_remove_public_access.
+
+    :param region: AWS region where the RDS instances are located
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+    :param wait: Seconds to wait for the modifications to take effect; they are polled once if 0
+    :param poll_interval: Seconds between two polls of the pending instances
+    :param options: Options of run_check, e.g. remediate, state_store, sink or timeout
+    :return: Summary with verdict counts and the modification tracking
+    """
+    return await run_check("rds", region, credentials, options={"wait": wait, "poll_interval": poll_interval},
+                           **options)
+
+
+async def s3_check_remove_public_access(region: str = "us-east-1", credentials: Optional[Dict[str, str]] = None,
+                                        remediation: str = REMEDIATION_POLICY, bucket_region: Optional[str] = None,
+                                        **options: Any) -> Dict[str, Any]:
+    """
+    Removes public access from S3 buckets, fetching the policies concurrently, like s3_check_remove_public_access.
+
+    :param region: AWS region of the client listing the buckets
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+    :param remediation: REMEDIATION_POLICY to remove the public statements, or REMEDIATION_BLOCK to
+        enable the bucket's Public Access Block instead
+    :param bucket_region: Only check buckets located in this region, if given
+    :param options: Options of run_check, e.g. remediate, state_store, sink or timeout
+    :return: Summary with verdict counts
+    """
+    return await run_check("s3", region, credentials, options={"remediation": remediation,
+                                                               "bucket_region": bucket_region}, **options)
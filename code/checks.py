@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from botocore.exceptions import ClientError
+from .engine import Check, register_check
+from .helpers import (ANY_INSTANCE_PROFILE_ARN, DEFAULT_PAGE_SIZE, DbClusterRecord, DbInstanceRecord, IamCache,
+                      InstanceRecord, S3ClientRouter, describe_instance_records, describe_instance_record_pages,
+                      describe_instance_records_by_id, instance_filters, describe_db_instance_records,
+                      describe_db_instance_record_pages, describe_db_instance_records_by_id,
+                      describe_db_cluster_records, check_public_access, modify_db_instance, list_buckets,
+                      get_bucket_policy, restricts_public_buckets)
+from .ec2_check_remove_ssm_policy import (ENGINE_ACCOUNT, ENGINE_INSTANCE, ENGINES, SSM_POLICY_NAME,
+                                          forbidden_policy_profiles, instance_fingerprint, profile_actions,
+                                          remove_role_policy, ssm_policy_actions, ssm_policy_profiles)
+from .iam_authorization import AuthorizationDetails, PolicyMatcher
+from .policy_evaluator import PolicyEvaluator
+from .rds_check_remove_public_access import (DEFAULT_POLL_INTERVAL, ModificationTracker, db_instance_actions,
+                                             public_cluster_findings)
+from .s3_check_remove_public_access import (REMEDIATION_BLOCK, REMEDIATION_POLICY, get_account_block, policy_actions,
+                                            public_access_block_actions, remediate_bucket)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Number of buckets per page when a bucket sweep is resumed by name
+BUCKET_PAGE_SIZE = 1000
+
+
+@register_check
+class Ec2SsmPolicyCheck(Check):
+    """
+    Detaches the SSM policy from the roles of EC2 instance profiles.
+
+    Context options: "engine" (ENGINE_INSTANCE by default), "matcher" (forbidden policies of the
+    account engine, or "forbid_policy" and "forbid_action" lists to build it from; the SSM policy by
+    name if omitted), "profiled_only" (have the API leave out instances without an instance profile)
+    and "page_size" (instances per DescribeInstances page).
+    """
+
+    name = "ec2"
+
+    def __init__(self, context) -> None:
+        """
+        :param context: Per-run state of the check; the IAM cache and the profile policies are shared across the run
+        :raises ValueError: If the engine option is not one of ENGINES.
+        """
+        super().__init__(context)
+        self.iam_cache: IamCache = context.shared('iam_cache', lambda: IamCache(context.client('iam')))
+        self.engine: str = context.options.get('engine', ENGINE_INSTANCE)
+        if self.engine not in ENGINES:
+            raise ValueError(f"Unknown engine {self.engine!r}, expected one of {', '.join(ENGINES)}")
+        self.matcher: PolicyMatcher = context.options.get('matcher') or PolicyMatcher([SSM_POLICY_NAME])
+        if context.options.get('forbid_policy') or context.options.get('forbid_action'):
+            self.matcher = PolicyMatcher.from_values(context.options.get('forbid_policy') or [],
+                                                     context.options.get('forbid_action') or [])
+        profiled_only = context.options.get('profiled_only', False)
+        self.filters = instance_filters(profile_arns=[ANY_INSTANCE_PROFILE_ARN] if profiled_only else ())
+        self.page_size: int = context.options.get('page_size', DEFAULT_PAGE_SIZE)
+
+    def discover(self) -> Iterator[InstanceRecord]:
+        """Yields active EC2 instances page by page."""
+        return describe_instance_records(self.context.client('ec2'), self.page_size, self.filters)
+
+    def pages(self, token: Optional[str] = None) -> Iterator[Tuple[Optional[str], List[InstanceRecord]]]:
+        """Yields active EC2 instances page by page, resuming from a DescribeInstances token."""
+        return describe_instance_record_pages(self.context.client('ec2'), self.page_size, token, self.filters)
+
+    def lookup(self, resource_ids: List[str]) -> List[InstanceRecord]:
+        """Describes the given EC2 instances in batches."""
+        return describe_instance_records_by_id(self.context.client('ec2'), resource_ids)
+
+    def resource_id(self, resource: InstanceRecord) -> str:
+        """Returns the EC2 instance ID."""
+        return resource.instance_id
+
+    def fingerprint(self, resource: InstanceRecord) -> Optional[Dict[str, Any]]:
+        """
+        Returns the instance profile ARN and the policies attached to the profile's roles.
+
+        The policy and account engines look IAM up once per run, so their instances are not fingerprinted.
+        """
+        if self.engine != ENGINE_INSTANCE:
+            return None
+        return instance_fingerprint(self.iam_cache, resource)
+
+    def profiles(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Returns the actions of every instance profile, looked up once per run by the policy or account engine."""
+        def load() -> Dict[str, Any]:
+            iam_client = self.iam_cache.iam_client
+            if self.engine == ENGINE_ACCOUNT:
+                details = AuthorizationDetails.load(iam_client, self.matcher.needs_documents)
+                return {"profiles": forbidden_policy_profiles(details, self.matcher), "authorization": details.stats()}
+            return {"profiles": ssm_policy_profiles(iam_client)}
+        return self.context.shared(f'{self.engine}_profiles', load)["profiles"]
+
+    def evaluate(self, resource: InstanceRecord) -> List[Dict[str, Any]]:
+        """Returns a detach or delete action for every forbidden policy of the instance profile's roles."""
+        if self.engine == ENGINE_INSTANCE:
+            return ssm_policy_actions(self.iam_cache, resource)
+        return profile_actions(self.profiles(), resource)
+
+    def remediate(self, resource: InstanceRecord, action: Dict[str, Any]) -> bool:
+        """Removes the policy, unless another instance sharing the role already did."""
+        return remove_role_policy(self.iam_cache, action)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the IAM cache hit and miss counts, and the size of the account engine's IAM indexes."""
+        stats = {"cache": self.iam_cache.stats()}
+        if self.engine == ENGINE_ACCOUNT and 'account_profiles' in self.context.cache:
+            stats["authorization"] = self.context.cache['account_profiles']["authorization"]
+        return stats
+
+
+@register_check
+class RdsPublicAccessCheck(Check):
+    """
+    Disables public access on RDS instances, and reports the publicly accessible Multi-AZ DB clusters.
+
+    Context options: "wait" (seconds to wait for the modifications to take effect once every
+    instance was processed; they are polled once if 0) and "poll_interval".
+    """
+
+    name = "rds"
+
+    def __init__(self, context) -> None:
+        """
+        :param context: Per-run state of the check; the modification tracker is shared across the run
+        """
+        super().__init__(context)
+        self.tracker: ModificationTracker = context.shared('rds_tracker',
+                                                           lambda: ModificationTracker(context.client('rds')))
+        self.clusters: List[DbClusterRecord] = []
+
+    def discover(self) -> Iterator[DbInstanceRecord]:
+        """Yields RDS instances page by page, once the DB clusters were listed."""
+        self.clusters = list(describe_db_cluster_records(self.context.client('rds')))
+        yield from describe_db_instance_records(self.context.client('rds'))
+
+    def pages(self, token: Optional[str] = None) -> Iterator[Tuple[Optional[str], List[DbInstanceRecord]]]:
+        """Yields RDS instances page by page, resuming from a DescribeDBInstances marker, after the DB clusters."""
+        self.clusters = list(describe_db_cluster_records(self.context.client('rds')))
+        yield from describe_db_instance_record_pages(self.context.client('rds'), token=token)
+
+    def lookup(self, resource_ids: List[str]) -> List[DbInstanceRecord]:
+        """Describes the given RDS instances in batches."""
+        return describe_db_instance_records_by_id(self.context.client('rds'), resource_ids)
+
+    def resource_id(self, resource: DbInstanceRecord) -> str:
+        """Returns the DB instance identifier."""
+        return resource.identifier
+
+    def fingerprint(self, resource: DbInstanceRecord) -> Optional[Dict[str, Any]]:
+        """Returns whether the instance is, or is about to be, publicly accessible."""
+        return {'public': check_public_access(resource)}
+
+    def remediated_fingerprint(self, resource: DbInstanceRecord) -> Optional[Dict[str, Any]]:
+        """Returns the attributes of an instance that was made private."""
+        return {'public': False}
+
+    def evaluate(self, resource: DbInstanceRecord) -> List[Dict[str, Any]]:
+        """Returns a modify action if the instance is publicly accessible."""
+        return db_instance_actions(resource)
+
+    def remediate(self, resource: DbInstanceRecord, action: Dict[str, Any]) -> bool:
+        """Disables public access on the instance and tracks it until it is private."""
+        modify_db_instance(self.context.client('rds'), action['db_instance_identifier'])
+        self.tracker.add(action['db_instance_identifier'])
+        return True
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """Polls the modified instances until they are private or the wait has passed, then reports public clusters."""
+        if self.tracker.pending:
+            self.tracker.wait(self.context.options.get('wait', 0.0),
+                              self.context.options.get('poll_interval', DEFAULT_POLL_INTERVAL))
+        return public_cluster_findings(self.context.region, self.clusters)
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the time each modified instance took to become private and those still pending."""
+        stats = {"time_to_private": dict(self.tracker.time_to_private), "pending": sorted(self.tracker.pending),
+                 "polls": self.tracker.polls}
+        public_clusters = [cluster.identifier for cluster in self.clusters if cluster.publicly_accessible]
+        if public_clusters:
+            stats["public_clusters"] = public_clusters
+        return stats
+
+
+@register_check
+class S3PublicPolicyCheck(Check):
+    """
+    Removes public statements from S3 bucket policies, using a client in each bucket's home region.
+
+    Context options: "remediation" (REMEDIATION_POLICY by default, REMEDIATION_BLOCK to enable the
+    bucket's Public Access Block instead) and "bucket_region" (only check the buckets of this region).
+    No bucket is checked individually while the account's Public Access Block restricts public policies.
+    """
+
+    name = "s3"
+    regional = False
+
+    def __init__(self, context) -> None:
+        """
+        :param context: Per-run state of the check; the bucket router and policy evaluator are shared across the run
+        """
+        super().__init__(context)
+        self.router: S3ClientRouter = context.shared('s3_router', lambda: S3ClientRouter(context.client('s3'), context.credentials))
+        self.evaluator: PolicyEvaluator = context.shared('policy_evaluator', PolicyEvaluator)
+        self.remediation: str = context.options.get('remediation', REMEDIATION_POLICY)
+        self.bucket_region: Optional[str] = context.options.get('bucket_region')
+        self.avoided_calls = 0
+        self._lock = threading.Lock()
+
+    def account_restricted(self) -> bool:
+        """Returns whether the account's Public Access Block restricts public bucket policies, read once per run."""
+        return self.context.shared('account_block', lambda: restricts_public_buckets(
+            get_account_block(self.context.region, self.context.credentials)
+        ))
+
+    def list_buckets(self) -> List[str]:
+        """Lists the bucket names, recording the region of each when only one region's buckets are listed."""
+        names = list_buckets(self.context.client('s3'), self.bucket_region)
+        if self.bucket_region:
+            for name in names:
+                self.router.set_bucket_region(name, self.bucket_region)
+        return names
+
+    def discover(self) -> Iterator[str]:
+        """Yields bucket names."""
+        return iter(self.list_buckets())
+
+    def pages(self, token: Optional[str] = None) -> Iterator[Tuple[Optional[str], List[str]]]:
+        """Yields bucket names in name order, each page under the name of its first bucket."""
+        names = sorted(name for name in self.list_buckets() if token is None or name >= token)
+        for start in range(0, len(names), BUCKET_PAGE_SIZE):
+            page = names[start:start + BUCKET_PAGE_SIZE]
+            yield page[0], page
+
+    def lookup(self, resource_ids: List[str]) -> List[str]:
+        """Returns the bucket names as they are; a bucket that no longer exists fails its own evaluation."""
+        return list(resource_ids)
+
+    def resource_id(self, resource: str) -> str:
+        """Returns the bucket name."""
+        return resource
+
+    def evaluate(self, resource: str) -> List[Dict[str, Any]]:
+        """Returns an action rewriting or deleting a public bucket policy, or enabling the Public Access Block."""
+        if self.account_restricted():
+            # The bucket would have needed a policy lookup, and a location lookup unless its region is known
+            with self._lock:
+                self.avoided_calls += 1 if self.bucket_region else 2
+            return []
+        s3_client = self.router.get_client(resource)
+        if self.remediation == REMEDIATION_BLOCK:
+            attributes, actions = public_access_block_actions(s3_client, resource)
+            if attributes['public'] and not actions:
+                # The bucket's own block restricts it, so only the PutBucketPublicAccessBlock is skipped
+                with self._lock:
+                    self.avoided_calls += 1
+            return actions
+        try:
+            policy = get_bucket_policy(s3_client, resource)['Policy']
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchBucketPolicy':
+                return []
+            raise
+        return self.evaluate_policy(resource, policy)
+
+    def evaluate_policy(self, resource: str, policy: Optional[str]) -> List[Dict[str, Any]]:
+        """Returns the actions a bucket policy needs, given its JSON document or None if the bucket has none."""
+        return policy_actions(self.evaluator, resource, policy)
+
+    def remediate(self, resource: str, action: Dict[str, Any]) -> bool:
+        """Performs the action through a client in the bucket's region."""
+        remediate_bucket(self.router.get_client(action['bucket']), action)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns the policy verdict cache hit and miss counts, and the calls Public Access Blocks made unnecessary."""
+        return {"cache": self.evaluator.stats(), "avoided_calls": self.avoided_calls}
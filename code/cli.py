@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+Command line entry point running one or all checkers in a single process.
+
+Only the standard library is imported at module load; boto3 and the checker modules are
+imported when a check actually runs, so --help and no-op runs start quickly.
+"""
+import argparse
+import json
+import logging
+import sys
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Checks run by the "all" command, in order
+CHECK_NAMES = ("ec2", "rds", "s3")
+
+
+def _check_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Collects the options of the engine's checks from the command line.
+
+    :param args: Parsed command line arguments
+    :return: Check options, as taken by the engine's CheckContext
+    """
+    return {"engine": args.engine, "forbid_policy": args.forbid_policy, "forbid_action": args.forbid_action,
+            "profiled_only": args.profiled_only, "page_size": args.page_size, "wait": args.rds_wait,
+            "remediation": args.s3_remediation}
+
+
+def _checker(name: str, args: argparse.Namespace, state_store, sink=None) -> Callable[[str], Dict[str, Any]]:
+    """
+    Imports a checker module and returns its entry point bound to the command line options.
+
+    :param name: Check name, one of CHECK_NAMES
+    :param args: Parsed command line arguments
+    :param state_store: Store of previous verdicts, or None
+    :param sink: Receives each finding as it is produced, or None
+    :return: Checker entry point taking a region name and optional credentials
+    """
+    if args.pipeline:
+        from .engine import get_check, run_check as run_pipeline_check
+        checker = partial(run_pipeline_check, name, max_workers=args.max_workers,
+                          remediate=not args.dry_run, state_store=state_store, sink=sink,
+                          options=_check_options(args))
+        if get_check(name).regional or not (args.all_regions or len(args.region or []) > 1):
+            return checker
+        # Account-wide resources, like S3 buckets, would be listed in full by every region, so one region checks them
+        from .helpers import handle_success
+        home = (args.region or ["us-east-1"])[0]
+
+        def run_once(region: str, credentials: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+            if region != home:
+                return handle_success(f"{name} resources are checked in {home}", verdicts={})
+            return checker(region, credentials)
+        return run_once
+    if name == "ec2":
+        from .ec2_check_remove_ssm_policy import check_remove_ssm_policy
+        matcher = None
+        if args.forbid_policy or args.forbid_action:
+            from .iam_authorization import PolicyMatcher
+            matcher = PolicyMatcher.from_values(args.forbid_policy or [], args.forbid_action or [])
+        return partial(check_remove_ssm_policy, page_size=args.page_size,
+                       state_store=state_store, engine=args.engine, sink=sink, matcher=matcher,
+                       profiled_only=args.profiled_only)
+    if name == "rds":
+        from .rds_check_remove_public_access import check_remove_public_access
+        return partial(check_remove_public_access, state_store=state_store, sink=sink,
+                       max_workers=args.max_workers, wait=args.rds_wait)
+
+    from .s3_check_remove_public_access import main as s3_main
+    if args.all_regions or len(args.region or []) > 1:
+        # Each region only checks its own buckets, so none is checked twice
+        return lambda region, credentials=None: s3_main(region, bucket_region=region, max_workers=args.max_workers,
+                                                        state_store=state_store, remediation=args.s3_remediation,
+                                                        credentials=credentials, sink=sink)
+    return partial(s3_main, max_workers=args.max_workers, state_store=state_store, remediation=args.s3_remediation,
+                   sink=sink)
+
+
+def run_check(name: str, args: argparse.Namespace, state_store=None, sink=None) -> Dict[str, Any]:
+    """
+    Runs one check in one region, or fanned out across several regions.
+
+    :param name: Check name, one of CHECK_NAMES
+    :param args: Parsed command line arguments
+    :param state_store: Store of previous verdicts, or None
+    :param sink: Receives each finding as it is produced, or None
+    :return: Checker result, or aggregated report for several regions
+    """
+    checker = _checker(name, args, state_store, sink)
+    regions = args.region or ["us-east-1"]
+    if not args.all_regions and len(regions) == 1:
+        return checker(regions[0])
+
+    from .multi_region import ALL_REGIONS, scan_regions
+    return scan_regions(checker, ALL_REGIONS if args.all_regions else regions, args.max_workers)
+
+
+def run_accounts(names: List[str], args: argparse.Namespace, state_store=None, sink=None) -> Dict[str, Any]:
+    """
+    Runs checks in every account given on the command line, assuming the same role in each.
+
+    :param names: Check names, each one of CHECK_NAMES
+    :param args: Parsed command line arguments
+    :param state_store: Store of previous verdicts, or None
+    :param sink: Receives each finding as it is produced, or None
+    :return: Aggregated report keyed by account, region and check
+    """
+    from .multi_account import ALL_REGIONS, scan_accounts
+    checkers = {name: _checker(name, args, state_store, sink) for name in names}
+    regions = ALL_REGIONS if args.all_regions else (args.region or ["us-east-1"])
+    return scan_accounts(args.account, args.role_name, checkers, regions,
+                         max_accounts=args.max_accounts, max_workers=args.max_workers)
+
+
+def run_events(args: argparse.Namespace, sink=None) -> Dict[str, Any]:
+    """
+    Checks only the resources named by CloudTrail events read from a file, stdin or an SQS queue.
+
+    :param args: Parsed command line arguments
+    :param sink: Receives each finding as it is produced, or None
+    :return: Event, target and batch counts with the verdict counts per check
+    """
+    from .events import SqsSource, read_messages, run_events as run_event_batches
+    region = (args.region or ["us-east-1"])[0]
+    options = dict(region=region, window=args.window, max_batch=args.max_batch, remediate=not args.dry_run, sink=sink)
+    if args.queue_url:
+        return run_event_batches(SqsSource(args.queue_url, region, stop_when_empty=args.drain), **options)
+    if args.file == "-":
+        return run_event_batches(read_messages(sys.stdin), **options)
+    with open(args.file) as stream:
+        return run_event_batches(read_messages(stream), **options)
+
+
+def _service_limit(value: str) -> Tuple[str, int]:
+    """
+    Parses a per-service concurrency limit given as SERVICE=N.
+
+    :param value: Command line value
+    :return: Tuple of service name and limit
+    :raises argparse.ArgumentTypeError: If the value is malformed.
+    """
+    service, _, limit = value.partition('=')
+    if not service or not limit.isdigit() or int(limit) < 1:
+        raise argparse.ArgumentTypeError(f"expected SERVICE=N with N >= 1, got {value!r}")
+    return service, int(limit)
+
+
+def run_plan(args: argparse.Namespace, sink=None) -> Dict[str, Any]:
+    """
+    Collects the actions the checks need into a plan file, without remediating.
+
+    :param args: Parsed command line arguments
+    :param sink: Receives each finding as it is produced, or None
+    :return: Verdict counts per check and plan statistics
+    """
+    from .plan import build_plan
+    plan, result = build_plan(args.check, args.region or ["us-east-1"], max_workers=args.max_workers, sink=sink)
+    plan.save(args.plan)
+    return result
+
+
+def run_apply(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Applies a plan file, resuming from its result log.
+
+    :param args: Parsed command line arguments
+    :return: Counts of outcomes
+    """
+    from .plan import Plan, PlanExecutor, apply_plan
+    executor = PlanExecutor(max_workers=args.max_workers, service_limits=dict(args.service_limit or []),
+                            max_attempts=args.max_attempts)
+    return apply_plan(Plan.load(args.plan), args.log or f"{args.plan}.log", executor)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the command line parser.
+
+    :return: Argument parser
+    """
+    parser = argparse.ArgumentParser(
+        prog="aws-policy-checker",
+        description="Check AWS resources for risky access and remediate it."
+    )
+    parser.add_argument('--log-level', default='INFO', help="logging level (default: INFO)")
+    parser.add_argument('--metrics-file', help="write API metrics to this file (.prom for Prometheus, JSON otherwise)")
+    parser.add_argument('--state-db', help="SQLite file used to skip resources unchanged since the last run")
+    parser.add_argument('--full-rescan', action='store_true', help="check every resource even with --state-db")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="run the checks through the concurrent discover/evaluate/remediate engine")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="with --pipeline or events, report actions without performing them; rejected otherwise")
+    parser.add_argument('--findings', metavar='PATH',
+                        help="stream one JSON finding per resource to this file, '-' for stdout;"
+                             " the summary then goes to stderr")
+    parser.add_argument('--account', action='append',
+                        help="account to scan by assuming --role-name in it, may be repeated")
+    parser.add_argument('--role-name', help="role assumed in every --account")
+    parser.add_argument('--max-accounts', type=int, default=8, help="maximum concurrent accounts")
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--region', action='append',
+                        help="region to scan, may be repeated (default: us-east-1)")
+    common.add_argument('--all-regions', action='store_true', help="scan every enabled region")
+    common.add_argument('--max-workers', type=int, default=8,
+                        help="size of each worker pool: concurrent regions (or region and check pairs per "
+                             "account), S3 buckets, RDS modifications, and resources per check with --pipeline")
+    common.add_argument('--page-size', type=int, default=1000, help="EC2 instances per DescribeInstances page")
+    common.add_argument('--engine', choices=("instance", "policy", "account"), default="instance",
+                        help="EC2 engine: walk from instances to policies, from the SSM policy to its roles,"
+                             " or match every role policy retrieved in one account-wide IAM sweep")
+    common.add_argument('--forbid-policy', action='append', metavar='NAME_OR_ARN',
+                        help="with --engine account, policy to remove from instance roles, may be repeated"
+                             " (default: the SSM policy)")
+    common.add_argument('--forbid-action', action='append', metavar='PATTERN',
+                        help="with --engine account, remove role policies allowing this action, e.g. 'ssm:*'")
+    common.add_argument('--profiled-only', action='store_true',
+                        help="EC2: have the API return only instances with an instance profile")
+    common.add_argument('--rds-wait', type=float, default=0.0,
+                        help="seconds to wait for RDS modifications to take effect (default: poll once)")
+    common.add_argument('--s3-remediation', choices=("policy", "block"), default="policy",
+                        help="S3 remediation: remove public policy statements, or enable the bucket's Public Access Block")
+
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.add_parser('ec2', parents=[common], help="detach the SSM policy from EC2 instance roles")
+    commands.add_parser('rds', parents=[common], help="disable public access on RDS instances")
+    commands.add_parser('s3', parents=[common], help="remove public bucket policies")
+    commands.add_parser('all', parents=[common], help="run every check")
+
+    capture = commands.add_parser('capture', help="record the discovery results into a snapshot file")
+    capture.add_argument('snapshot', help="path of the snapshot file")
+    capture.add_argument('--region', default="us-east-1",
+                         help="region to capture; a snapshot holds one region (default: us-east-1)")
+
+    evaluate = commands.add_parser('evaluate', help="evaluate a snapshot file offline, without remediating")
+    evaluate.add_argument('snapshot', help="path of the snapshot file")
+    evaluate.add_argument('--check', action='append', choices=CHECK_NAMES, help="check to run, may be repeated")
+
+    plan = commands.add_parser('plan', help="collect the actions the checks need into a plan file, without remediating")
+    plan.add_argument('plan', help="path of the plan file")
+    plan.add_argument('--check', action='append', choices=CHECK_NAMES, help="check to run, may be repeated")
+    plan.add_argument('--region', action='append', help="region to check, may be repeated (default: us-east-1)")
+    plan.add_argument('--max-workers', type=int, default=8, help="maximum concurrent resources per check")
+
+    apply = commands.add_parser('apply', help="perform the actions of a plan file")
+    apply.add_argument('plan', help="path of the plan file")
+    apply.add_argument('--log', help="result log; actions it records as done are skipped (default: PLAN.log)")
+    apply.add_argument('--max-workers', type=int, default=8, help="maximum concurrent actions")
+    apply.add_argument('--service-limit', action='append', type=_service_limit, metavar='SERVICE=N',
+                       help="maximum concurrent actions of one service, e.g. iam=2, may be repeated")
+    apply.add_argument('--max-attempts', type=int, default=3, help="attempts per action")
+
+    events = commands.add_parser('events', help="check only the resources named by CloudTrail events")
+    events.add_argument('--region', action='append', help="region of events that do not name one (default: us-east-1)")
+    source = events.add_mutually_exclusive_group()
+    source.add_argument('--file', default="-", help="file of CloudTrail records or EventBridge events, '-' for stdin")
+    source.add_argument('--queue-url', help="SQS queue receiving the events")
+    events.add_argument('--drain', action='store_true', help="with --queue-url, stop once the queue is empty")
+    events.add_argument('--window', type=float, default=5.0, help="seconds events are batched and deduplicated")
+    events.add_argument('--max-batch', type=int, default=100, help="maximum distinct resources per batch")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Runs the checks selected on the command line and prints the results as JSON.
+
+    :param argv: Command line arguments
+    :return: Exit code, 0 if every check succeeded
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return 0
+
+    if args.account and not args.role_name:
+        parser.error("--account requires --role-name")
+    if args.account and args.command in ('events', 'capture', 'evaluate', 'plan', 'apply'):
+        parser.error(f"{args.command} does not support --account")
+    # The standalone checkers always remediate, so a dry run is only possible through the engine
+    if args.dry_run and not args.pipeline and args.command in CHECK_NAMES + ('all',):
+        parser.error("--dry-run requires --pipeline for the ec2, rds, s3 and all commands")
+
+    logging.basicConfig(level=args.log_level.upper(), stream=sys.stderr)
+
+    state_store = None
+    if args.state_db:
+        from .state_store import StateStore
+        state_store = StateStore(args.state_db, full_rescan=args.full_rescan)
+
+    sink = None
+    if args.findings:
+        from .findings import NdjsonWriter
+        sink = NdjsonWriter(args.findings)
+
+    names = CHECK_NAMES if args.command == 'all' else (args.command,)
+    try:
+        if args.command == 'events':
+            results = {'events': run_events(args, sink)}
+            output = results['events']
+        elif args.command == 'plan':
+            results = {'plan': run_plan(args, sink)}
+            output = results['plan']
+        elif args.command == 'apply':
+            results = {'apply': run_apply(args)}
+            output = results['apply']
+        elif args.command == 'capture':
+            from .snapshot import capture
+            results = {'capture': capture(args.snapshot, args.region)}
+            output = results['capture']
+        elif args.command == 'evaluate':
+            from .snapshot import evaluate
+            results = {'evaluate': evaluate(args.snapshot, args.check, sink)}
+            output = results['evaluate']
+        elif args.account:
+            results = {'accounts': run_accounts(list(names), args, state_store, sink)}
+            output = results['accounts']
+        else:
+            results = {name: run_check(name, args, state_store, sink) for name in names}
+            output = results if args.command == 'all' else results[args.command]
+    finally:
+        if state_store is not None:
+            state_store.close()
+        if sink is not None:
+            sink.close()
+
+    if args.metrics_file:
+        from .metrics import get_metrics
+        get_metrics().write(args.metrics_file)
+
+    # Keep stdout pure NDJSON when the findings are streamed there
+    summary_stream = sys.stderr if args.findings == "-" else sys.stdout
+    json.dump(output, summary_stream, indent=2, default=str)
+    summary_stream.write("\n")
+    return 0 if all(result['status'] == "Success" for result in results.values()) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,37 +1,90 @@
 # -*- coding: utf-8 -*-
 import logging
-from typing import Tuple
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
 import boto3
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError
-from .helpers import initialize_clients, describe_instances, get_instance_profile, list_attached_policies, detach_policy,handle_error, handle_success
+from .helpers import (ANY_INSTANCE_PROFILE_ARN, DEFAULT_PAGE_SIZE, IamCache, InstanceRecord, initialize_clients,
+                      describe_instance_records, instance_filters, find_policy_arns, list_policy_roles,
+                      list_role_instance_profiles, handle_error, handle_success)
+from .iam_authorization import AuthorizationDetails, PolicyMatcher
+from .findings import VERDICT_SKIPPED, FindingSink, account_sink, make_finding
+from .metrics import get_metrics
+from .state_store import VERDICT_COMPLIANT, VERDICT_REMEDIATED, StateStore, fingerprint
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def check_remove_ssm_policy(region: str = "us-east-1") -> str:
+# Name of the policy removed from the roles of EC2 instances
+SSM_POLICY_NAME = 'AmazonSSMManagedInstanceCore'
+
+# Engines: walk from each instance to its policies, from the policy to the roles carrying it,
+# or match every role policy of the account, retrieved in one sweep
+ENGINE_INSTANCE = "instance"
+ENGINE_POLICY = "policy"
+ENGINE_ACCOUNT = "account"
+ENGINES = (ENGINE_INSTANCE, ENGINE_POLICY, ENGINE_ACCOUNT)
+
+def check_remove_ssm_policy(region: str = "us-east-1", page_size: int = DEFAULT_PAGE_SIZE,
+                            state_store: Optional[StateStore] = None, engine: str = ENGINE_INSTANCE,
+                            credentials: Optional[Dict[str, str]] = None, sink: Optional[FindingSink] = None,
+                            matcher: Optional[PolicyMatcher] = None, profiled_only: bool = False) -> str:
     """
     Check all EC2 instances for assigned SSM policy on their IAM roles and remove it if found.
 
     :param region: AWS region where the EC2 instances are located
-    :return: Result message
+    :param page_size: Number of instances fetched per DescribeInstances page
+    :param state_store: Store of previous verdicts; instances whose profile and role policies are unchanged
+        are skipped. Only used by the instance engine.
+    :param engine: ENGINE_INSTANCE to look up the policies of every instance's role, ENGINE_POLICY
+        to look up the roles carrying the SSM policy once and match instances against them, or
+        ENGINE_ACCOUNT to retrieve every role policy in one sweep and remove those the matcher forbids
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+    :param sink: Receives one finding per instance as it is processed
+    :param matcher: Forbidden policies of the account engine, the SSM policy by name if omitted
+    :param profiled_only: Have the API leave out instances without an instance profile; they get no finding
+    :return: Result message, an error if the engine is not one of ENGINES
     :raises NoCredentialsError: If AWS credentials are not found.
     :raises PartialCredentialsError: If incomplete AWS credentials are provided.
     """
+    if engine not in ENGINES:
+        return handle_error(ValueError(f"{engine!r}, expected one of {', '.join(ENGINES)}"), "Unknown engine ")
+    baseline = get_metrics().snapshot()
     try:
-        ec2_client, iam_client = initialize_clients(region)
-        response = describe_instances(ec2_client)
-
-        # Iterate over all instances
-        ssm_instances = 0
-        for reservation in response['Reservations']:
-            for instance in reservation['Instances']:
-                ssm_instances += process_instance(iam_client, instance)
-        
-        if ssm_instances > 0: 
-            return handle_success(f"Detached SSM policy from roles of {ssm_instances} instance/-s") 
+        ec2_client, iam_client = initialize_clients(region, credentials)
+
+        iam_cache = IamCache(iam_client)
+        sink = account_sink(sink, credentials)
+        details = {}
+        # Terminated instances, and with profiled_only those without a profile, are filtered out by the API
+        filters = instance_filters(profile_arns=[ANY_INSTANCE_PROFILE_ARN] if profiled_only else ())
+
+        if engine == ENGINE_ACCOUNT:
+            ssm_instances, details["authorization"] = process_authorization_details(
+                ec2_client, iam_cache, matcher or PolicyMatcher([SSM_POLICY_NAME]), page_size, sink, filters
+            )
+            details["cache"] = iam_cache.stats()
+            details["metrics"] = get_metrics().since(baseline)
+            if ssm_instances > 0:
+                return handle_success(f"{describe_removals(*iam_cache.removed_policies())} from the roles of "
+                                      f"{ssm_instances} instance/-s", **details)
+            return handle_success("No instances with forbidden policies", **details)
+        if engine == ENGINE_POLICY:
+            ssm_instances = process_ssm_policy_roles(ec2_client, iam_cache, page_size, sink, filters)
+        else:
+            ssm_instances, skipped = process_instances(ec2_client, iam_cache, region, page_size, state_store, sink,
+                                                       filters)
+            if state_store is not None:
+                details["skipped"] = skipped
+        details["cache"] = iam_cache.stats()
+        details["metrics"] = get_metrics().since(baseline)
+
+        if ssm_instances > 0:
+            return handle_success(f"{describe_removals(*iam_cache.removed_policies())} from the roles of "
+                                  f"{ssm_instances} instance/-s", **details)
         else:
-            return handle_success("No instances with SSM policy")
+            return handle_success("No instances with SSM policy", **details)
     
     except (NoCredentialsError, PartialCredentialsError) as e:
         return handle_error(e, "Error: ")
@@ -39,32 +92,303 @@ def check_remove_ssm_policy(region: str = "us-east-1") -> str:
         return handle_error(e, "Unexpected error: ")
 
 
-def process_instance(iam_client, instance: dict) -> int:
+def describe_removals(detached: List[str], deleted: List[str]) -> str:
+    """
+    Describes the policies removed from roles, for result messages and finding reasons.
+
+    :param detached: Names of the detached managed policies
+    :param deleted: Names of the deleted inline policies
+    :return: Description such as "Detached policy/-ies AmazonSSMManagedInstanceCore"
+    """
+    if detached and deleted:
+        return f"Detached policy/-ies {', '.join(detached)} and deleted inline policy/-ies {', '.join(deleted)}"
+    if deleted:
+        return f"Deleted inline policy/-ies {', '.join(deleted)}"
+    return f"Detached policy/-ies {', '.join(detached)}"
+
+
+def instance_finding(region: str, instance: InstanceRecord, verdict: str, actions: List[Dict[str, Any]],
+                     start: float, reason: str = "") -> Dict[str, Any]:
+    """
+    Builds the finding of one processed EC2 instance.
+
+    :param region: AWS region where the EC2 instance is located
+    :param instance: EC2 instance record
+    :param verdict: Result of the check
+    :param actions: Detach and inline policy delete actions taken
+    :param start: Performance counter value when processing of the instance started
+    :param reason: Explanation of the verdict, derived from the actions if omitted
+    :return: Finding dictionary
+    """
+    if actions and not reason:
+        detached = sorted({action['policy_arn'].rsplit('/', 1)[-1] for action in actions
+                           if action['action'] == "detach_role_policy"})
+        deleted = sorted({action['policy_name'] for action in actions if action['action'] == "delete_role_policy"})
+        roles = {action['role_name'] for action in actions}
+        reason = f"{describe_removals(detached, deleted)} from {len(roles)} role/-s"
+    elif not reason:
+        reason = "No SSM policy to detach"
+    return make_finding('ec2', region, instance.instance_id, verdict, actions, reason=reason,
+                        duration=time.perf_counter() - start)
+
+
+def instance_fingerprint(iam_cache: IamCache, instance: InstanceRecord) -> Dict[str, Any]:
+    """
+    Builds the state store attributes of an EC2 instance: its profile and the policies of the profile's roles.
+
+    :param iam_cache: IAM lookup cache of the run
+    :param instance: EC2 instance record
+    :return: Attributes whose change makes the instance be checked again
+    """
+    policies = iam_cache.profile_policy_arns(instance.profile_name) if instance.profile_arn else []
+    return {'profile': instance.profile_arn, 'policies': policies}
+
+
+def process_instances(ec2_client, iam_cache: IamCache, region: str, page_size: int = DEFAULT_PAGE_SIZE,
+                      state_store: Optional[StateStore] = None, sink: Optional[FindingSink] = None,
+                      filters: Optional[List[Dict[str, Any]]] = None) -> Tuple[int, int]:
+    """
+    Process every EC2 instance in a region, one page at a time.
+
+    :param ec2_client: Initialized EC2 client
+    :param iam_cache: IAM lookup cache of the run
+    :param region: AWS region where the EC2 instances are located
+    :param page_size: Number of instances fetched per DescribeInstances page
+    :param state_store: Store of previous verdicts; instances whose profile and role policies are unchanged
+        are skipped
+    :param sink: Receives one finding per instance as it is processed
+    :param filters: DescribeInstances filters, active instances only if omitted
+    :return: Tuple of the number of instances from which SSM policy was detached and of skipped instances
+    """
+    ssm_instances = 0
+    skipped = 0
+    filters = instance_filters() if filters is None else filters
+    for instance in describe_instance_records(ec2_client, page_size, filters):
+        start = time.perf_counter()
+        resource_id = f"{region}/{instance.instance_id}"
+        resource_fingerprint = None
+        if state_store is not None:
+            # A policy attached to the role again after the last check changes the fingerprint
+            resource_fingerprint = fingerprint(instance_fingerprint(iam_cache, instance))
+            if state_store.is_unchanged('ec2', resource_id, resource_fingerprint):
+                skipped += 1
+                if sink is not None:
+                    sink(instance_finding(region, instance, VERDICT_SKIPPED, [], start, "Unchanged since last check"))
+                continue
+
+        actions = detach_instance_ssm_policy(iam_cache, instance)
+        verdict = VERDICT_REMEDIATED if actions else VERDICT_COMPLIANT
+        if state_store is not None:
+            if actions:
+                resource_fingerprint = fingerprint(instance_fingerprint(iam_cache, instance))
+            state_store.record('ec2', resource_id, resource_fingerprint, verdict)
+        if sink is not None:
+            sink(instance_finding(region, instance, verdict, actions, start))
+        ssm_instances += 1 if actions else 0
+
+    if state_store is not None:
+        state_store.commit()
+    return ssm_instances, skipped
+
+
+def process_instance(iam_client, instance: Union[Dict[str, Any], InstanceRecord],
+                     iam_cache: Optional[IamCache] = None) -> int:
     """
     Process an EC2 instance to check and detach SSM policy if attached.
 
     :param iam_client: Initialized IAM client
-    :param instance: EC2 instance information
+    :param instance: EC2 instance information or record
+    :param iam_cache: IAM lookup cache shared across instances of the same run
     :return: Number of instances from which SSM policy was detached
     """
-    ssm_detached_count = 0
+    if iam_cache is None:
+        iam_cache = IamCache(iam_client)
+    if isinstance(instance, dict):
+        instance = InstanceRecord.from_instance(instance)
+    return 1 if detach_instance_ssm_policy(iam_cache, instance) else 0
 
-    if 'IamInstanceProfile' in instance:
-        profile_name = instance['IamInstanceProfile']['Arn'].split('/')[-1]
-        instance_profile = get_instance_profile(iam_client, profile_name)
+
+def ssm_policy_actions(iam_cache: IamCache, instance: InstanceRecord) -> List[Dict[str, Any]]:
+    """
+    Decide which roles of an EC2 instance's profile need the SSM policy detached.
+
+    :param iam_cache: IAM lookup cache shared across instances of the same run
+    :param instance: EC2 instance record
+    :return: Detach actions, one per role carrying the policy
+    """
+    actions = []
+    if instance.profile_arn:
+        instance_profile = iam_cache.get_instance_profile(instance.profile_name)
 
         # Iterate over roles in the instance profile
         for role in instance_profile['InstanceProfile']['Roles']:
             role_name = role['RoleName']
-            attached_policies = list_attached_policies(iam_client, role_name)
+            if role_name in iam_cache.detached_roles:
+                continue
+            attached_policies = iam_cache.list_attached_policies(role_name)
 
-            # Check for SSM policy and detach if found
+            # Check for SSM policy
             for policy in attached_policies['AttachedPolicies']:
-                if policy['PolicyName'] == 'AmazonSSMManagedInstanceCore':
-                    detach_policy(iam_client, role_name, policy['PolicyArn'])
-                    ssm_detached_count += 1
+                if policy['PolicyName'] == SSM_POLICY_NAME:
+                    actions.append({"action": "detach_role_policy", "role_name": role_name,
+                                    "policy_arn": policy['PolicyArn']})
+
+    return actions
+
+
+def remove_role_policy(iam_cache: IamCache, action: Dict[str, Any]) -> bool:
+    """
+    Performs a detach or inline policy delete action, once per role and policy in the same run.
+
+    :param iam_cache: IAM cache of the run
+    :param action: Action returned by one of the engines
+    :return: True if the policy was removed, False if it was already removed in this run
+    """
+    if action['action'] == "delete_role_policy":
+        return iam_cache.delete_inline_policy(action['role_name'], action['policy_name'])
+    return iam_cache.detach_policy(action['role_name'], action['policy_arn'])
 
-    return ssm_detached_count
+
+def detach_instance_ssm_policy(iam_cache: IamCache, instance: InstanceRecord) -> List[Dict[str, Any]]:
+    """
+    Detach SSM policy from the roles of an EC2 instance's profile.
+
+    :param iam_cache: IAM lookup cache shared across instances of the same run
+    :param instance: EC2 instance record
+    :return: Detach actions taken, one per role
+    """
+    return [action for action in ssm_policy_actions(iam_cache, instance) if remove_role_policy(iam_cache, action)]
+
+
+def ssm_policy_profiles(iam_client) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Maps the instance profiles of every role carrying the SSM policy to the detach actions they lead to.
+
+    :param iam_client: Initialized IAM client
+    :return: Detach actions by instance profile name
+    """
+    profile_actions: Dict[str, List[Dict[str, Any]]] = {}
+    for policy_arn in find_policy_arns(iam_client, SSM_POLICY_NAME):
+        for role_name in list_policy_roles(iam_client, policy_arn):
+            for profile_name in list_role_instance_profiles(iam_client, role_name):
+                profile_actions.setdefault(profile_name, []).append(
+                    {"action": "detach_role_policy", "role_name": role_name, "policy_arn": policy_arn}
+                )
+    return profile_actions
+
+
+def forbidden_policy_profiles(details: AuthorizationDetails,
+                              matcher: PolicyMatcher) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Maps every instance profile to the actions removing the forbidden policies of its roles.
+
+    :param details: Account-wide IAM indexes
+    :param matcher: Forbidden policy names, ARNs and action patterns
+    :return: Detach or inline policy delete actions by instance profile name, each role evaluated once
+    """
+    role_actions: Dict[str, List[Dict[str, Any]]] = {}
+    profile_actions: Dict[str, List[Dict[str, Any]]] = {}
+    for profile_name, role_names in details.profile_roles.items():
+        for role_name in role_names:
+            if role_name not in role_actions:
+                role_actions[role_name] = [
+                    {"action": "detach_role_policy", "role_name": role_name, "policy_arn": policy['policy_arn'],
+                     "match": policy['match']} if 'policy_arn' in policy else
+                    {"action": "delete_role_policy", "role_name": role_name, "policy_name": policy['policy_name'],
+                     "match": policy['match']}
+                    for policy in details.forbidden_policies(role_name, matcher)
+                ]
+            profile_actions.setdefault(profile_name, []).extend(role_actions[role_name])
+    return profile_actions
+
+
+def profile_actions(profiles: Dict[str, List[Dict[str, Any]]], instance: InstanceRecord) -> List[Dict[str, Any]]:
+    """
+    Looks up the actions an EC2 instance's profile leads to.
+
+    :param profiles: Actions by instance profile name, as built by the policy or account engine
+    :param instance: EC2 instance record
+    :return: Actions, empty for instances without a profile
+    """
+    return list(profiles.get(instance.profile_name, [])) if instance.profile_arn else []
+
+
+def process_ssm_policy_roles(ec2_client, iam_cache: IamCache, page_size: int = DEFAULT_PAGE_SIZE,
+                             sink: Optional[FindingSink] = None, filters: Optional[List[Dict[str, Any]]] = None) -> int:
+    """
+    Detach SSM policy starting from the roles it is attached to.
+
+    The roles carrying the policy and their instance profiles are listed once, so the
+    number of IAM calls does not grow with the number of instances.
+
+    :param ec2_client: Initialized EC2 client
+    :param iam_cache: IAM lookup cache of the run
+    :param page_size: Number of instances fetched per DescribeInstances page
+    :param sink: Receives one finding per instance as it is processed
+    :param filters: DescribeInstances filters, active instances only if omitted
+    :return: Number of instances from which SSM policy was detached
+    """
+    profiles = ssm_policy_profiles(iam_cache.iam_client)
+
+    # No role carries the policy, so instances only need to be listed for their compliant findings
+    if not profiles and sink is None:
+        return 0
+    return remove_profile_policies(ec2_client, iam_cache, profiles, page_size, sink, filters)
+
+def process_authorization_details(ec2_client, iam_cache: IamCache, matcher: PolicyMatcher,
+                                  page_size: int = DEFAULT_PAGE_SIZE,
+                                  sink: Optional[FindingSink] = None,
+                                  filters: Optional[List[Dict[str, Any]]] = None) -> Tuple[int, Dict[str, int]]:
+    """
+    Remove forbidden policies from the roles of EC2 instance profiles, using one account-wide IAM sweep.
+
+    Roles, instance profiles, attached and inline policies are retrieved together with
+    GetAccountAuthorizationDetails, so the only other IAM calls are the removals.
+
+    :param ec2_client: Initialized EC2 client
+    :param iam_cache: IAM cache of the run, used to remove each policy once
+    :param matcher: Forbidden policy names, ARNs and action patterns
+    :param page_size: Number of instances fetched per DescribeInstances page
+    :param sink: Receives one finding per instance as it is processed
+    :param filters: DescribeInstances filters, active instances only if omitted
+    :return: Number of instances whose roles had policies removed, and the size of the IAM indexes
+    """
+    details = AuthorizationDetails.load(iam_cache.iam_client, matcher.needs_documents)
+    profiles = forbidden_policy_profiles(details, matcher)
+
+    # No profile holds a forbidden policy, so instances only need to be listed for their compliant findings
+    if not any(profiles.values()) and sink is None:
+        return 0, details.stats()
+    instances = remove_profile_policies(ec2_client, iam_cache, profiles, page_size, sink, filters, forbidden=True)
+    return instances, details.stats()
+
+def remove_profile_policies(ec2_client, iam_cache: IamCache, profiles: Dict[str, List[Dict[str, Any]]],
+                            page_size: int = DEFAULT_PAGE_SIZE, sink: Optional[FindingSink] = None,
+                            filters: Optional[List[Dict[str, Any]]] = None, forbidden: bool = False) -> int:
+    """
+    Performs the actions of every EC2 instance's profile, as mapped by the policy or account engine.
+
+    :param ec2_client: Initialized EC2 client
+    :param iam_cache: IAM cache of the run, used to remove each policy once
+    :param profiles: Actions by instance profile name
+    :param page_size: Number of instances fetched per DescribeInstances page
+    :param sink: Receives one finding per instance as it is processed
+    :param filters: DescribeInstances filters, active instances only if omitted
+    :param forbidden: Whether the actions remove the forbidden policies of the account engine, for the reasons
+    :return: Number of instances whose roles had policies removed
+    """
+    region = ec2_client.meta.region_name
+    instances = 0
+    filters = instance_filters() if filters is None else filters
+    for instance in describe_instance_records(ec2_client, page_size, filters):
+        start = time.perf_counter()
+        actions = [action for action in profile_actions(profiles, instance) if remove_role_policy(iam_cache, action)]
+        instances += 1 if actions else 0
+        if sink is not None:
+            reason = "No forbidden policy to remove" if forbidden and not actions else ""
+            sink(instance_finding(region, instance, VERDICT_REMEDIATED if actions else VERDICT_COMPLIANT,
+                                  actions, start, reason))
+    return instances
 
 if __name__ == '__main__':
     result = check_remove_ssm_policy()
@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type
+from .findings import VERDICT_ERROR, VERDICT_NON_COMPLIANT, VERDICT_SKIPPED, FindingSink, make_finding
+from .helpers import get_client, handle_failure, handle_success
+from .metrics import get_metrics
+from .state_store import VERDICT_COMPLIANT, VERDICT_REMEDIATED, StateStore, fingerprint
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Number of resource workers evaluating and remediating at the same time
+DEFAULT_MAX_WORKERS = 8
+
+# Number of discovered resources or findings buffered between stages before the producer blocks
+DEFAULT_QUEUE_SIZE = 256
+
+# Seconds a blocked stage waits before checking whether the pipeline was stopped
+_POLL_INTERVAL = 0.1
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+class CheckContext:
+    """
+    Per-run state shared by the stages of a check: region, credentials, clients and caches.
+    """
+
+    def __init__(self, region: str, credentials: Optional[Dict[str, str]] = None,
+                 options: Optional[Dict[str, Any]] = None) -> None:
+        """
+        :param region: AWS region the check runs in
+        :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+        :param options: Options of the checks, e.g. the EC2 engine or the S3 remediation, defaults if omitted
+        """
+        self.region = region
+        self.credentials = credentials
+        self.options: Dict[str, Any] = dict(options or {})
+        self.cache: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def client(self, service: str, region: Optional[str] = None):
+        """
+        Returns a pooled client for the run's credentials.
+
+        :param service: AWS service name
+        :param region: AWS region name, the run's region if omitted
+        :return: Client for the service
+        """
+        return get_client(service, region or self.region, self.credentials)
+
+    def shared(self, key: str, factory: Callable[[], Any]) -> Any:
+        """
+        Returns a per-run object, creating it on first use, e.g. a lookup cache.
+
+        :param key: Name of the object
+        :param factory: Callable creating the object
+        :return: Shared object
+        """
+        with self._lock:
+            if key not in self.cache:
+                self.cache[key] = factory()
+            return self.cache[key]
+
+
+class Check:
+    """
+    Base class of the checks run by the pipeline engine.
+
+    A check discovers resources, evaluates each into a list of remediation actions and
+    remediates them one action at a time. Actions are plain dictionaries with an "action"
+    key naming the API call they stand for.
+    """
+
+    name = ""
+
+    # Whether resource identifiers are only unique within a region, like EC2 instance IDs
+    regional = True
+
+    def __init__(self, context: CheckContext) -> None:
+        """
+        :param context: Per-run state of the check
+        """
+        self.context = context
+
+    def discover(self) -> Iterator[Any]:
+        """
+        Yields the resources to check.
+
+        :return: Iterator over resources
+        """
+        raise NotImplementedError
+
+    def pages(self, token: Optional[str] = None) -> Iterator[Tuple[Optional[str], List[Any]]]:
+        """
+        Yields the resources to check page by page, each page with the token that yields it again.
+
+        Checks whose discovery cannot resume from a token yield all resources as a single page.
+
+        :param token: Token of the page to start from, the first page if omitted
+        :return: Iterator over tuples of page token and resources
+        """
+        yield None, list(self.discover())
+
+    def lookup(self, resource_ids: List[str]) -> List[Any]:
+        """
+        Returns the resources with the given identifiers, leaving out those that no longer exist.
+
+        Checks that can describe resources by identifier override this; the default discovers
+        every resource and picks the requested ones.
+
+        :param resource_ids: Resource identifiers
+        :return: Resources
+        """
+        wanted = set(resource_ids)
+        return [resource for resource in self.discover() if self.resource_id(resource) in wanted]
+
+    def resource_id(self, resource: Any) -> str:
+        """
+        Returns the identifier of a resource.
+
+        :param resource: Discovered resource
+        :return: Resource identifier
+        """
+        raise NotImplementedError
+
+    def fingerprint(self, resource: Any) -> Optional[Dict[str, Any]]:
+        """
+        Returns the security-relevant attributes of a resource known at discovery time.
+
+        :param resource: Discovered resource
+        :return: Attributes, or None if unchanged resources cannot be skipped
+        """
+        return None
+
+    def remediated_fingerprint(self, resource: Any) -> Optional[Dict[str, Any]]:
+        """
+        Returns the security-relevant attributes of a resource after remediation.
+
+        :param resource: Discovered resource
+        :return: Attributes, the discovery-time attributes by default
+        """
+        return self.fingerprint(resource)
+
+    def evaluate(self, resource: Any) -> List[Dict[str, Any]]:
+        """
+        Decides which remediation actions a resource needs.
+
+        :param resource: Discovered resource
+        :return: Actions, empty if the resource is compliant
+        """
+        raise NotImplementedError
+
+    def remediate(self, resource: Any, action: Dict[str, Any]) -> bool:
+        """
+        Performs one remediation action.
+
+        :param resource: Discovered resource
+        :param action: Action returned by evaluate
+        :return: True if the action changed something, False if it was already done
+        """
+        raise NotImplementedError
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """
+        Completes the run once every resource was processed, e.g. waits for submitted changes to take effect.
+
+        :return: Findings the per-resource stages do not produce, e.g. of resources that are only reported
+        """
+        return []
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns check-specific statistics included in the run summary, e.g. cache hit counts.
+
+        :return: Dictionary of statistics
+        """
+        return {}
+
+
+CHECKS: Dict[str, Type[Check]] = {}
+
+
+def register_check(check_class: Type[Check]) -> Type[Check]:
+    """
+    Class decorator adding a check to the registry under its name.
+
+    :param check_class: Check class
+    :return: The check class
+    """
+    CHECKS[check_class.name] = check_class
+    return check_class
+
+
+def get_check(name: str) -> Type[Check]:
+    """
+    Returns a registered check by name, loading the built-in checks on first use.
+
+    :param name: Check name
+    :return: Check class
+    :raises KeyError: If no check is registered under the name.
+    """
+    from . import checks  # noqa: F401 - registers the built-in checks
+    return CHECKS[name]
+
+
+def _put(target: "queue.Queue[Any]", item: Any, stop: threading.Event) -> bool:
+    """
+    Puts an item on a bounded queue, blocking until there is room or the pipeline stops.
+
+    :param target: Queue to put the item on
+    :param item: Item to put
+    :param stop: Event set when the pipeline stops
+    :return: True if the item was put, False if the pipeline stopped
+    """
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def process_resource(check: Check, resource: Any, remediate: bool = True,
+                     state_store: Optional[StateStore] = None) -> Dict[str, Any]:
+    """
+    Runs the evaluate and remediate stages for one resource.
+
+    :param check: Check instance
+    :param resource: Discovered resource
+    :param remediate: Perform the remediation actions, or only report them
+    :param state_store: Store of previous verdicts; unchanged resources are skipped
+    :return: Finding for the resource
+    """
+    start = time.perf_counter()
+    account_id = (check.context.credentials or {}).get('AccountId')
+    finding = make_finding(check.name, check.context.region, None, VERDICT_COMPLIANT, account=account_id)
+    try:
+        # Both may call the API, e.g. to fingerprint the EC2 instance profile's policies
+        resource_id = check.resource_id(resource)
+        finding["resource_id"] = resource_id
+        attributes = check.fingerprint(resource) if state_store is not None else None
+        state_id = resource_id
+        if check.regional:
+            state_id = f"{check.context.region}/{resource_id}"
+            # Regional identifiers are only unique within an account, too
+            if account_id:
+                state_id = f"{account_id}/{state_id}"
+        if attributes is not None and state_store.is_unchanged(check.name, state_id, fingerprint(attributes)):
+            finding.update(verdict=VERDICT_SKIPPED, reason="Unchanged since last check")
+        else:
+            actions = check.evaluate(resource)
+            finding["actions"] = actions
+            if actions and remediate:
+                changed = [check.remediate(resource, action) for action in actions]
+                finding["verdict"] = VERDICT_REMEDIATED if any(changed) else VERDICT_COMPLIANT
+                finding["reason"] = f"Performed {sum(changed)} of {len(actions)} action/-s"
+                attributes = check.remediated_fingerprint(resource) if attributes is not None else None
+            elif actions:
+                finding.update(verdict=VERDICT_NON_COMPLIANT, reason=f"Needs {len(actions)} action/-s")
+            if attributes is not None:
+                state_store.record(check.name, state_id, fingerprint(attributes), finding["verdict"])
+    except Exception as e:
+        logger.error(f"Error checking {finding['resource_id']}: {e}")
+        finding.update(verdict=VERDICT_ERROR, status="Error", reason=f"Unexpected error: {e}")
+    finding["duration"] = round(time.perf_counter() - start, 6)
+    return finding
+
+
+def finish_check(check: Check) -> List[Dict[str, Any]]:
+    """
+    Runs the finishing stage of a check, turning its failure into an error finding.
+
+    :param check: Check instance whose resources were all processed
+    :return: Findings of the finishing stage
+    """
+    try:
+        return check.finish()
+    except Exception as e:
+        logger.error(f"Error finishing the {check.name} check: {e}")
+        return [make_finding(check.name, check.context.region, None, VERDICT_ERROR, status="Error",
+                             reason=f"Finishing failed: {e}")]
+
+
+def run_pipeline(check: Check, max_workers: int = DEFAULT_MAX_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+                 remediate: bool = True, state_store: Optional[StateStore] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Runs a check as a concurrent discover -> evaluate/remediate pipeline and yields its findings.
+
+    Discovery runs on its own thread while a pool of workers evaluates and remediates the
+    resources found so far. Both hand-offs go through bounded queues, so discovery pauses
+    when workers fall behind and workers pause when the caller stops consuming findings.
+
+    :param check: Check instance
+    :param max_workers: Number of resource workers
+    :param queue_size: Maximum number of resources or findings buffered between stages
+    :param remediate: Perform the remediation actions, or only report them
+    :param state_store: Store of previous verdicts; unchanged resources are skipped
+    :return: Iterator over findings, one per resource
+    """
+    resources: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+    findings: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    workers = max(1, max_workers)
+
+    def discover() -> None:
+        try:
+            for resource in check.discover():
+                if not _put(resources, resource, stop):
+                    return
+        except Exception as e:
+            logger.error(f"Error discovering {check.name} resources: {e}")
+            _put(findings, make_finding(check.name, check.context.region, None, VERDICT_ERROR, status="Error",
+                                        reason=f"Discovery failed: {e}"), stop)
+        finally:
+            for _ in range(workers):
+                _put(resources, _DONE, stop)
+
+    def work() -> None:
+        while not stop.is_set():
+            try:
+                resource = resources.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if resource is _DONE:
+                break
+            if not _put(findings, process_resource(check, resource, remediate, state_store), stop):
+                return
+        _put(findings, _DONE, stop)
+
+    threads = [threading.Thread(target=discover, name=f"{check.name}-discover", daemon=True)]
+    threads += [threading.Thread(target=work, name=f"{check.name}-worker-{index}", daemon=True)
+                for index in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        remaining = workers
+        while remaining:
+            finding = findings.get()
+            if finding is _DONE:
+                remaining -= 1
+                continue
+            yield finding
+        yield from finish_check(check)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if state_store is not None:
+            state_store.commit()
+
+
+def run_check(name: str, region: str = "us-east-1", credentials: Optional[Dict[str, str]] = None,
+              max_workers: int = DEFAULT_MAX_WORKERS, remediate: bool = True,
+              state_store: Optional[StateStore] = None, sink: Optional[FindingSink] = None,
+              options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Runs a registered check through the pipeline engine and summarizes its findings.
+
+    :param name: Check name
+    :param region: AWS region to run the check in
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+    :param max_workers: Number of resource workers
+    :param remediate: Perform the remediation actions, or only report them
+    :param state_store: Store of previous verdicts; unchanged resources are skipped
+    :param sink: Receives each finding as it is produced; the findings are then left out of the summary
+    :param options: Options of the check, e.g. {"engine": "policy"} for EC2 or {"remediation": "block"} for S3
+    :return: Summary with verdict counts, and the findings under "findings" unless a sink was given
+    """
+    baseline = get_metrics().snapshot()
+    check = get_check(name)(CheckContext(region, credentials, options))
+    findings = []
+    verdicts: Dict[str, int] = {}
+    errors = 0
+    for finding in run_pipeline(check, max_workers, remediate=remediate, state_store=state_store):
+        verdicts[finding["verdict"]] = verdicts.get(finding["verdict"], 0) + 1
+        errors += finding["status"] != "Success"
+        if sink is not None:
+            sink(finding)
+        else:
+            findings.append(finding)
+
+    message = f"Checked {sum(verdicts.values())} {name} resource/-s"
+    if verdicts:
+        message += ": " + ", ".join(f"{count} {verdict}" for verdict, count in sorted(verdicts.items()))
+    details = {"verdicts": verdicts, "metrics": get_metrics().since(baseline), **check.stats()}
+    if sink is None:
+        details["findings"] = findings
+    if errors:
+        return handle_failure(message, **details)
+    return handle_success(message, **details)
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import queue
+import threading
+import time
+from typing import IO, Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+from .engine import CheckContext, finish_check, get_check, process_resource
+from .findings import VERDICT_ERROR, VERDICT_SKIPPED, FindingSink, make_finding
+from .helpers import (describe_instance_records, get_client, handle_failure, handle_success, instance_filters,
+                      list_role_instance_profiles)
+from .ec2_check_remove_ssm_policy import SSM_POLICY_NAME
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# CloudTrail events that may make a bucket public, by the check that reviews them
+S3_EVENTS = frozenset({"CreateBucket", "PutBucketPolicy", "PutBucketPublicAccessBlock", "DeleteBucketPublicAccessBlock"})
+
+# CloudTrail events that may make a DB instance public
+RDS_EVENTS = frozenset({"CreateDBInstance", "ModifyDBInstance", "CreateDBInstanceReadReplica",
+                        "RestoreDBInstanceFromDBSnapshot", "RestoreDBInstanceToPointInTime"})
+
+# CloudTrail events that give EC2 instances a new instance profile
+EC2_EVENTS = frozenset({"RunInstances", "AssociateIamInstanceProfile", "ReplaceIamInstanceProfileAssociation"})
+
+# CloudTrail events that may give the instances of a role's profiles the SSM policy
+ROLE_EVENTS = frozenset({"AttachRolePolicy", "AddRoleToInstanceProfile"})
+
+# Pseudo-check of role targets, resolved to the EC2 instances using the role before checking
+ROLE_TARGET = "role"
+
+# Seconds events are collected after the first one of a batch arrives
+DEFAULT_WINDOW = 5.0
+
+# Maximum number of distinct resources checked in one batch
+DEFAULT_MAX_BATCH = 100
+
+# Seconds an SQS receive call waits for messages (long polling, API allows 0-20)
+DEFAULT_SQS_WAIT = 10
+
+# Maximum number of messages per SQS receive and delete call
+SQS_BATCH_SIZE = 10
+
+# Marks the end of the message stream
+_DONE = object()
+
+
+class Target(NamedTuple):
+    """
+    A resource named by an event, checked at most once per batch.
+    """
+    check: str
+    region: Optional[str]
+    resource_id: str
+
+
+def unwrap_records(document: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Extracts CloudTrail records from a CloudTrail log file, an EventBridge event or a bare record.
+
+    :param document: Parsed JSON document
+    :return: CloudTrail records
+    """
+    if isinstance(document.get('Records'), list):
+        return document['Records']
+    if isinstance(document.get('detail'), dict):
+        # EventBridge keeps the region outside of the CloudTrail record
+        return [{'awsRegion': document.get('region'), **document['detail']}]
+    return [document]
+
+
+def _find_values(value: Any, key: str) -> Iterator[str]:
+    """
+    Yields every value stored under a key anywhere in nested request or response elements.
+
+    :param value: Parsed JSON value
+    :param key: Key to look for
+    :return: Iterator over the values found
+    """
+    if isinstance(value, dict):
+        for name, item in value.items():
+            if name == key and isinstance(item, str):
+                yield item
+            else:
+                yield from _find_values(item, key)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _find_values(item, key)
+
+
+def event_targets(record: Dict[str, Any]) -> List[Target]:
+    """
+    Maps a CloudTrail record to the resources it may have made non-compliant.
+
+    :param record: CloudTrail record
+    :return: Targets, empty if the event is irrelevant or the call failed
+    """
+    name = record.get('eventName')
+    if record.get('errorCode'):
+        # A failed call changed nothing
+        return []
+    region = record.get('awsRegion')
+    parameters = record.get('requestParameters') or {}
+
+    if name in S3_EVENTS:
+        bucket = parameters.get('bucketName')
+        return [Target("s3", region, bucket)] if bucket else []
+    if name in RDS_EVENTS:
+        identifier = parameters.get('dBInstanceIdentifier')
+        return [Target("rds", region, identifier)] if identifier else []
+    if name in EC2_EVENTS:
+        elements = [parameters, record.get('responseElements') or {}]
+        instance_ids = set(_find_values(elements, 'instanceId')) | set(_find_values(elements, 'InstanceId'))
+        return [Target("ec2", region, instance_id) for instance_id in sorted(instance_ids)]
+    if name in ROLE_EVENTS:
+        if name == "AttachRolePolicy" and not parameters.get('policyArn', '').endswith(f"/{SSM_POLICY_NAME}"):
+            return []
+        role_name = parameters.get('roleName')
+        return [Target(ROLE_TARGET, region, role_name)] if role_name else []
+    return []
+
+
+def read_messages(stream: IO[str]) -> Iterator[Tuple[List[Dict[str, Any]], None]]:
+    """
+    Reads events from a file or stdin, either one JSON document per line or a single JSON document.
+
+    :param stream: Open text stream
+    :return: Iterator over tuples of the records of a document and None, as file messages need no acknowledgement
+    :raises ValueError: If the input is neither of the two, e.g. several pretty-printed documents.
+    """
+    for number, line in enumerate(iter(stream.readline, ''), 1):
+        if not line.strip():
+            continue
+        try:
+            document = json.loads(line)
+        except ValueError:
+            # A pretty-printed document spans several lines
+            try:
+                document = json.loads(line + stream.read())
+            except ValueError as e:
+                raise ValueError(f"line {number} starts neither a JSON document per line nor a single document: {e}")
+        yield unwrap_records(document), None
+
+
+class SqsSource:
+    """
+    Receives events from an SQS queue with long polling.
+
+    Messages are deleted only once the batch holding them has been processed without errors
+    for the resources they name, so events of a run that fails are delivered again.
+    """
+
+    def __init__(self, queue_url: str, region: str = "us-east-1", wait_seconds: int = DEFAULT_SQS_WAIT,
+                 stop_when_empty: bool = False) -> None:
+        """
+        :param queue_url: URL of the SQS queue
+        :param region: AWS region of the queue
+        :param wait_seconds: Seconds each receive call waits for messages
+        :param stop_when_empty: Stop once a receive call returns no messages, instead of polling forever
+        """
+        self.queue_url = queue_url
+        self.sqs_client = get_client('sqs', region)
+        self.wait_seconds = wait_seconds
+        self.stop_when_empty = stop_when_empty
+
+    def __iter__(self) -> Iterator[Tuple[List[Dict[str, Any]], str]]:
+        """
+        Yields the records of each message with its receipt handle.
+
+        :return: Iterator over tuples of records and receipt handle
+        """
+        while True:
+            messages = self.sqs_client.receive_message(
+                QueueUrl=self.queue_url, MaxNumberOfMessages=SQS_BATCH_SIZE, WaitTimeSeconds=self.wait_seconds
+            ).get('Messages', [])
+            if not messages and self.stop_when_empty:
+                return
+            for message in messages:
+                try:
+                    records = unwrap_records(json.loads(message['Body']))
+                except ValueError as e:
+                    logger.error(f"Ignoring malformed message {message['MessageId']}: {e}")
+                    records = []
+                yield records, message['ReceiptHandle']
+
+    def delete(self, receipts: List[str]) -> None:
+        """
+        Deletes processed messages from the queue.
+
+        :param receipts: Receipt handles of the messages
+        """
+        for start in range(0, len(receipts), SQS_BATCH_SIZE):
+            entries = [{'Id': str(index), 'ReceiptHandle': receipt}
+                       for index, receipt in enumerate(receipts[start:start + SQS_BATCH_SIZE])]
+            self.sqs_client.delete_message_batch(QueueUrl=self.queue_url, Entries=entries)
+
+
+def batch_messages(messages: Iterable[Tuple[List[Dict[str, Any]], Optional[str]]], window: float = DEFAULT_WINDOW,
+                   max_batch: int = DEFAULT_MAX_BATCH, default_region: str = "us-east-1"
+                   ) -> Iterator[Tuple[List[Target], Dict[str, List[Target]], int]]:
+    """
+    Groups messages into batches of distinct targets.
+
+    A batch is closed once window seconds have passed since its first message or it holds
+    max_batch targets. Messages are read on a separate thread, so a quiet source does not
+    hold back a batch that is due.
+
+    :param messages: Tuples of CloudTrail records and an optional receipt handle
+    :param window: Seconds a batch stays open after its first message
+    :param max_batch: Maximum number of distinct targets per batch
+    :param default_region: Region of records that do not carry one
+    :return: Iterator over tuples of targets, the targets of each message keyed by its receipt handle,
+             and number of records in the batch
+    """
+    channel: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, max_batch))
+
+    def produce() -> None:
+        try:
+            for message in messages:
+                channel.put(message)
+        except Exception as e:
+            channel.put(e)
+        channel.put(_DONE)
+
+    threading.Thread(target=produce, name="event-reader", daemon=True).start()
+
+    targets: Dict[Target, None] = {}
+    receipts: Dict[str, List[Target]] = {}
+    records_count = 0
+    deadline: Optional[float] = None
+    while True:
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            item = channel.get(timeout=timeout)
+        except queue.Empty:
+            item = None
+        if isinstance(item, Exception):
+            raise item
+        if item is not None and item is not _DONE:
+            records, receipt = item
+            message_targets = []
+            for record in records:
+                records_count += 1
+                for target in event_targets(record):
+                    target = target._replace(region=target.region or default_region)
+                    targets[target] = None
+                    message_targets.append(target)
+            if receipt is not None:
+                receipts[receipt] = message_targets
+            if deadline is None:
+                deadline = time.monotonic() + window
+        if item is None or item is _DONE or len(targets) >= max_batch:
+            if records_count or receipts:
+                yield list(targets), receipts, records_count
+            targets, receipts, records_count, deadline = {}, {}, 0, None
+        if item is _DONE:
+            return
+
+
+def resolve_role_targets(targets: List[Target], context: CheckContext) -> List[Target]:
+    """
+    Replaces role targets with the EC2 instances whose instance profile holds the role.
+
+    :param targets: Targets of one region
+    :param context: Per-run state of the region
+    :return: Distinct targets without role targets
+    """
+    resolved = dict.fromkeys(target for target in targets if target.check != ROLE_TARGET)
+    roles = [target.resource_id for target in targets if target.check == ROLE_TARGET]
+    if roles:
+        iam_client = context.client('iam')
+        profiles = {profile for role_name in roles for profile in list_role_instance_profiles(iam_client, role_name)}
+        if profiles:
+            for instance in describe_instance_records(context.client('ec2'), filters=instance_filters()):
+                if instance.profile_arn and instance.profile_name in profiles:
+                    resolved[Target("ec2", context.region, instance.instance_id)] = None
+    return list(resolved)
+
+
+def process_targets(targets: List[Target], remediate: bool = True, sink: Optional[FindingSink] = None,
+                    options: Optional[Dict[str, Any]] = None) -> Dict[str, Dict[str, int]]:
+    """
+    Runs the per-resource check logic on the targets of one batch.
+
+    Resources are looked up in one batched describe call per check and region instead of
+    being discovered by a full sweep. The state store is not consulted: an event means the
+    resource changed.
+
+    :param targets: Distinct targets
+    :param remediate: Perform the remediation actions, or only report them
+    :param sink: Receives each finding as it is produced, or None
+    :param options: Options of the checks, e.g. {"engine": "policy"}
+    :return: Verdict counts per check
+    """
+    verdicts: Dict[str, Dict[str, int]] = {}
+    by_region: Dict[str, List[Target]] = {}
+    for target in targets:
+        by_region.setdefault(target.region, []).append(target)
+
+    for region, region_targets in by_region.items():
+        context = CheckContext(region, options=options)
+        try:
+            resolved = resolve_role_targets(region_targets, context)
+        except Exception as e:
+            logger.error(f"Error resolving role targets in {region}: {e}")
+            # The other targets are still checked; the role targets fail, so their messages are kept
+            resolved = [target for target in region_targets if target.check != ROLE_TARGET]
+            counts = verdicts.setdefault(ROLE_TARGET, {})
+            for target in dict.fromkeys(target for target in region_targets if target.check == ROLE_TARGET):
+                finding = make_finding(ROLE_TARGET, region, target.resource_id, VERDICT_ERROR, status="Error",
+                                       reason=f"Unexpected error: {e}")
+                counts[VERDICT_ERROR] = counts.get(VERDICT_ERROR, 0) + 1
+                if sink is not None:
+                    sink(finding)
+        by_check: Dict[str, List[str]] = {}
+        for target in resolved:
+            by_check.setdefault(target.check, []).append(target.resource_id)
+
+        for name, resource_ids in by_check.items():
+            check = get_check(name)(context)
+            counts = verdicts.setdefault(name, {})
+            try:
+                resources = check.lookup(resource_ids)
+            except Exception as e:
+                logger.error(f"Error looking up {name} resources in {region}: {e}")
+                findings = [make_finding(name, region, resource_id, VERDICT_ERROR, status="Error",
+                                         reason=f"Unexpected error: {e}") for resource_id in resource_ids]
+            else:
+                found = {check.resource_id(resource) for resource in resources}
+                findings = [process_resource(check, resource, remediate) for resource in resources]
+                findings.extend(make_finding(name, region, resource_id, VERDICT_SKIPPED, reason="Resource not found")
+                                for resource_id in resource_ids if resource_id not in found)
+                findings.extend(finish_check(check))
+            for finding in findings:
+                counts[finding['verdict']] = counts.get(finding['verdict'], 0) + 1
+                if sink is not None:
+                    sink(finding)
+    return verdicts
+
+
+def target_failed(target: Target, failed: Set[Target]) -> bool:
+    """
+    Checks whether a target of an event could not be checked.
+
+    :param target: Target named by an event
+    :param failed: Targets whose findings were errors
+    :return: True if the target failed; a role target also fails if any EC2 instance of its region did
+    """
+    if target.check == ROLE_TARGET:
+        return target in failed or any(other.check == "ec2" and other.region == target.region for other in failed)
+    return target in failed
+
+
+def run_events(messages: Iterable[Tuple[List[Dict[str, Any]], Optional[str]]], region: str = "us-east-1",
+               window: float = DEFAULT_WINDOW, max_batch: int = DEFAULT_MAX_BATCH, remediate: bool = True,
+               sink: Optional[FindingSink] = None, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Checks the resources named by a stream of CloudTrail events, batch by batch.
+
+    :param messages: Tuples of CloudTrail records and an optional receipt handle; an SqsSource's
+                     messages are deleted once their batch has been processed, unless a resource
+                     they name could not be checked
+    :param region: Region of records that do not carry one
+    :param window: Seconds a batch stays open after its first message
+    :param max_batch: Maximum number of distinct targets per batch
+    :param remediate: Perform the remediation actions, or only report them
+    :param sink: Receives each finding as it is produced, or None
+    :param options: Options of the checks, e.g. {"engine": "policy"}
+    :return: Event, target and batch counts with the verdict counts per check, with an error status
+             if a resource could not be checked or the input could not be read
+    """
+    delete = getattr(messages, 'delete', None)
+    events = targets_count = batches = 0
+    verdicts: Dict[str, Dict[str, int]] = {}
+    failed: Set[Target] = set()
+
+    def collect(finding: Dict[str, Any]) -> None:
+        if finding['verdict'] == VERDICT_ERROR:
+            failed.add(Target(finding['check'], finding['region'], finding['resource_id']))
+        if sink is not None:
+            sink(finding)
+
+    try:
+        for targets, receipts, records_count in batch_messages(messages, window, max_batch, region):
+            start = time.perf_counter()
+            failed.clear()
+            batch_verdicts = process_targets(targets, remediate, collect, options)
+            for name, counts in batch_verdicts.items():
+                totals = verdicts.setdefault(name, {})
+                for verdict, count in counts.items():
+                    totals[verdict] = totals.get(verdict, 0) + count
+            if delete is not None and receipts:
+                # Messages naming a resource that could not be checked are left to be delivered again
+                processed = [receipt for receipt, message_targets in receipts.items()
+                             if not any(target_failed(target, failed) for target in message_targets)]
+                if processed:
+                    delete(processed)
+            events += records_count
+            targets_count += len(targets)
+            batches += 1
+            logger.info(f"Batch of {records_count} event/-s and {len(targets)} resource/-s "
+                        f"took {time.perf_counter() - start:.3f}s")
+    except ValueError as e:
+        # The input cannot be read any further; the batches already processed are still reported
+        return handle_failure(f"Bad event input: {e}", events=events, targets=targets_count, batches=batches,
+                              verdicts=verdicts)
+
+    message = f"Processed {events} event/-s in {batches} batch/-es"
+    if any(counts.get(VERDICT_ERROR) for counts in verdicts.values()):
+        return handle_failure(message, events=events, targets=targets_count, batches=batches, verdicts=verdicts)
+    return handle_success(message, events=events, targets=targets_count, batches=batches, verdicts=verdicts)
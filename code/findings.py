@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import sys
+import threading
+from typing import IO, Any, Callable, Dict, List, Optional, Union
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Verdicts of findings besides VERDICT_COMPLIANT and VERDICT_REMEDIATED, which the state store records
+VERDICT_NON_COMPLIANT = "non_compliant"
+VERDICT_SKIPPED = "skipped"
+VERDICT_ERROR = "error"
+
+# Number of findings buffered before they are written out
+DEFAULT_BUFFER_SIZE = 1000
+
+# Target that selects standard output instead of a file
+STDOUT = "-"
+
+# Callable receiving one finding at a time, e.g. an NdjsonWriter
+FindingSink = Callable[[Dict[str, Any]], None]
+
+
+def make_finding(check: str, region: Optional[str], resource_id: Optional[str], verdict: str,
+                 actions: Optional[List[Dict[str, Any]]] = None, status: str = "Success", reason: str = "",
+                 duration: float = 0.0, account: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Builds the structured result of checking one resource.
+
+    :param check: Check name, e.g. "ec2"
+    :param region: AWS region of the resource
+    :param resource_id: Resource identifier
+    :param verdict: Result of the check, one of the VERDICT_* constants
+    :param actions: Remediation actions needed or taken, each a dictionary with an "action" key
+    :param status: "Success", or "Error" if the resource could not be checked
+    :param reason: Human-readable explanation of the verdict
+    :param duration: Seconds spent on the resource
+    :param account: AWS account ID of the resource, if known
+    :return: Finding dictionary
+    """
+    finding = {
+        "check": check,
+        "region": region,
+        "resource_id": resource_id,
+        "verdict": verdict,
+        "actions": actions or [],
+        "status": status,
+        "reason": reason,
+        "duration": round(duration, 6),
+    }
+    if account:
+        finding["account"] = account
+    return finding
+
+
+def account_sink(sink: Optional[FindingSink], credentials: Optional[Dict[str, Any]]) -> Optional[FindingSink]:
+    """
+    Wraps a sink so findings are tagged with the account of the credentials they were found with.
+
+    :param sink: Finding sink, or None
+    :param credentials: Temporary credentials with an optional "AccountId" entry, or None
+    :return: Wrapping sink, or the sink itself if the account is not known
+    """
+    account = (credentials or {}).get('AccountId')
+    if sink is None or not account:
+        return sink
+    return lambda finding: sink({**finding, "account": account})
+
+
+class NdjsonWriter:
+    """
+    Streams findings as newline-delimited JSON, one object per line.
+
+    Lines are buffered and written out in batches, so large sweeps neither hold every
+    finding in memory nor write them one system call at a time. Usable as a finding
+    sink and as a context manager. Safe to share between threads.
+    """
+
+    def __init__(self, target: Union[str, IO[str]] = STDOUT, buffer_size: int = DEFAULT_BUFFER_SIZE) -> None:
+        """
+        :param target: Path of the output file, "-" for standard output, or an open text stream
+        :param buffer_size: Number of findings buffered before they are written out
+        """
+        self.buffer_size = max(1, buffer_size)
+        self.count = 0
+        self._owned = isinstance(target, str) and target != STDOUT
+        if self._owned:
+            self._stream: IO[str] = open(target, 'w', encoding='utf-8')
+        else:
+            self._stream = sys.stdout if target == STDOUT else target
+        self._lines: List[str] = []
+        self._lock = threading.Lock()
+
+    def write(self, finding: Dict[str, Any]) -> None:
+        """
+        Adds a finding to the output.
+
+        :param finding: Finding dictionary
+        """
+        line = json.dumps(finding, separators=(',', ':'), default=str)
+        with self._lock:
+            self._lines.append(line)
+            self.count += 1
+            if len(self._lines) >= self.buffer_size:
+                self._flush_locked()
+
+    __call__ = write
+
+    def _flush_locked(self) -> None:
+        """
+        Writes out the buffered findings; the caller holds the lock.
+        """
+        if self._lines:
+            self._stream.write("\n".join(self._lines) + "\n")
+            self._lines.clear()
+        self._stream.flush()
+
+    def flush(self) -> None:
+        """
+        Writes out the buffered findings.
+        """
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        """
+        Writes out the buffered findings and closes the output file, if the writer opened it.
+        """
+        self.flush()
+        if self._owned:
+            self._stream.close()
+
+    def __enter__(self) -> "NdjsonWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
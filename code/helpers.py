@@ -1,41 +1,196 @@
 # -*- coding: utf-8 -*-
 import boto3
 import logging
-from typing import Tuple, Dict, Any
+import threading
+from collections import OrderedDict
+from typing import Tuple, Dict, Any, Iterable, Iterator, List, Optional, Set, Union
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from .metrics import PHASE_DISCOVER, PHASE_EVALUATE, PHASE_REMEDIATE, register_metrics, timed_phase
+from .rate_limiter import register_rate_limiter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def initialize_clients(region: str) -> Tuple[boto3.client, boto3.client]:
+# Number of results requested per DescribeInstances page (API allows 5-1000)
+DEFAULT_PAGE_SIZE = 1000
+
+# Number of results requested per DescribeDBInstances page (API allows 20-100)
+DEFAULT_DB_PAGE_SIZE = 100
+
+# Maximum number of values in one describe filter, e.g. instance IDs looked up at once
+MAX_FILTER_VALUES = 100
+
+# Instance states worth checking; shutting-down and terminated instances are left out by the API
+ACTIVE_INSTANCE_STATES = ('pending', 'running', 'stopping', 'stopped')
+
+# Filter value matching every instance profile ARN, so instances without a profile are left out by the API
+ANY_INSTANCE_PROFILE_ARN = 'arn:*:iam::*:instance-profile/*'
+
+# Maximum number of entries kept per IAM lookup cache before evicting the least recently used
+DEFAULT_CACHE_SIZE = 1024
+
+# Default client configuration: a connection pool large enough for the concurrent scans
+# and the standard retry mode, which backs off on throttling errors
+DEFAULT_CLIENT_CONFIG = Config(
+    max_pool_connections=32,
+    retries={'mode': 'standard', 'max_attempts': 5}
+)
+
+class ClientPool:
+    """
+    Process-wide registry of boto3 clients sharing one session.
+
+    Clients are created lazily, once per (service, region, credentials) key, and reused
+    afterwards. Every client is hooked up to the shared rate limiter of its service and
+    account and to the process-wide metrics collector. Safe to share between threads.
+    """
+
+    def __init__(self, session: Optional[boto3.session.Session] = None,
+                 config: Config = DEFAULT_CLIENT_CONFIG) -> None:
+        """
+        :param session: boto3 session to create clients from, a new one by default
+        :param config: botocore configuration applied to every client
+        """
+        self.session = session or boto3.session.Session()
+        self.config = config
+        self._clients: Dict[Tuple[str, str, Optional[Tuple[str, ...]]], boto3.client] = {}
+        # boto3 sessions are not thread-safe, so clients are created one at a time
+        self._lock = threading.Lock()
+
+    def get_client(self, service: str, region: str,
+                   credentials: Optional[Dict[str, str]] = None) -> boto3.client:
+        """
+        Returns the pooled client for a service and region, creating it on first use.
+
+        :param service: AWS service name
+        :param region: AWS region name
+        :param credentials: Temporary credentials as returned by STS, default credential chain if omitted;
+            an optional "AccountId" entry selects the account's rate limiter
+        :return: Client for the service
+        """
+        credentials_key = None
+        if credentials:
+            credentials_key = (credentials['AccessKeyId'], credentials['SecretAccessKey'],
+                               credentials.get('SessionToken', ''))
+        key = (service, region, credentials_key)
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                kwargs = {}
+                if credentials_key:
+                    kwargs = {
+                        'aws_access_key_id': credentials_key[0],
+                        'aws_secret_access_key': credentials_key[1],
+                        'aws_session_token': credentials_key[2] or None,
+                    }
+                client = self.session.client(service, region_name=region, config=self.config, **kwargs)
+                account = "default"
+                if credentials:
+                    account = credentials.get('AccountId') or credentials['AccessKeyId']
+                register_rate_limiter(client, account)
+                register_metrics(client)
+                self._clients[key] = client
+        return client
+
+    def clear(self) -> None:
+        """
+        Drops every pooled client.
+        """
+        with self._lock:
+            self._clients.clear()
+
+_client_pool = ClientPool()
+
+def configure_client_pool(config: Config = DEFAULT_CLIENT_CONFIG,
+                          session: Optional[boto3.session.Session] = None) -> ClientPool:
+    """
+    Replaces the process-wide client pool, e.g. to change the connection pool size or retry mode.
+
+    :param config: botocore configuration applied to every client
+    :param session: boto3 session to create clients from, a new one by default
+    :return: The new client pool
+    """
+    global _client_pool
+    _client_pool = ClientPool(session, config)
+    return _client_pool
+
+def get_client_pool() -> ClientPool:
+    """
+    Returns the process-wide client pool.
+
+    :return: Client pool
+    """
+    return _client_pool
+
+def set_client_pool(pool: ClientPool) -> None:
+    """
+    Installs a client pool as the process-wide one, e.g. to restore one returned by get_client_pool().
+
+    :param pool: Client pool
+    """
+    global _client_pool
+    _client_pool = pool
+
+def get_client(service: str, region: str, credentials: Optional[Dict[str, str]] = None) -> boto3.client:
+    """
+    Returns a client from the process-wide client pool.
+
+    :param service: AWS service name
+    :param region: AWS region name
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+    :return: Client for the service
+    """
+    return _client_pool.get_client(service, region, credentials)
+
+def initialize_clients(region: str, credentials: Optional[Dict[str, str]] = None) -> Tuple[boto3.client, boto3.client]:
     """
     Initializes EC2 and IAM clients.
 
     :param region: AWS region name
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
     :return: Tuple of EC2 and IAM clients
     """
-    ec2_client = boto3.client('ec2', region_name=region)
-    iam_client = boto3.client('iam', region_name=region)
-    return ec2_client, iam_client
+    return get_client('ec2', region, credentials), get_client('iam', region, credentials)
 
-def initialize_s3_client(region: str) -> boto3.client:
+def initialize_s3_client(region: str, credentials: Optional[Dict[str, str]] = None) -> boto3.client:
     """
     Initializes S3 client.
 
     :param region: AWS region name
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
     :return: S3 client
     """
-    return boto3.client('s3', region_name=region)
+    return get_client('s3', region, credentials)
 
-def initialize_rds_client(region: str) -> boto3.client:
+def initialize_rds_client(region: str, credentials: Optional[Dict[str, str]] = None) -> boto3.client:
     """
     Initializes RDS client.
 
     :param region: AWS region name
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
     :return: RDS client
     """
-    return boto3.client('rds', region_name=region)
+    return get_client('rds', region, credentials)
+
+@timed_phase(PHASE_DISCOVER)
+def list_buckets(s3_client: boto3.client, bucket_region: Optional[str] = None) -> List[str]:
+    """
+    Lists the names of all S3 buckets, or of the buckets in one region.
 
+    :param s3_client: Initialized S3 client
+    :param bucket_region: Only list buckets located in this region, if given
+    :return: Bucket names
+    """
+    if bucket_region:
+        response = s3_client.list_buckets(BucketRegion=bucket_region)
+    else:
+        response = s3_client.list_buckets()
+    return [bucket['Name'] for bucket in response.get('Buckets', [])]
+
+@timed_phase(PHASE_EVALUATE)
 def get_bucket_policy(s3_client: boto3.client, bucket_name: str) -> Dict[str, Any]:
     """
     Retrieves the bucket policy for a specified S3 bucket.
@@ -46,6 +201,24 @@ def get_bucket_policy(s3_client: boto3.client, bucket_name: str) -> Dict[str, An
     """
     return s3_client.get_bucket_policy(Bucket=bucket_name)
 
+@timed_phase(PHASE_EVALUATE)
+def get_bucket_location(s3_client: boto3.client, bucket_name: str) -> str:
+    """
+    Retrieves the region a specified S3 bucket is located in.
+
+    :param s3_client: Initialized S3 client
+    :param bucket_name: Name of the S3 bucket
+    :return: Region name of the bucket
+    """
+    location = s3_client.get_bucket_location(Bucket=bucket_name).get('LocationConstraint')
+    # Buckets in us-east-1 report no location constraint, legacy eu-west-1 buckets report "EU"
+    if not location:
+        return 'us-east-1'
+    if location == 'EU':
+        return 'eu-west-1'
+    return location
+
+@timed_phase(PHASE_REMEDIATE)
 def delete_bucket_policy(s3_client: boto3.client, bucket_name: str) -> None:
     """
     Deletes the bucket policy for a specified S3 bucket.
@@ -56,15 +229,359 @@ def delete_bucket_policy(s3_client: boto3.client, bucket_name: str) -> None:
     s3_client.delete_bucket_policy(Bucket=bucket_name)
     logger.info(f"Bucket {bucket_name} policy removed.")
 
-def describe_instances(ec2_client: boto3.client) -> Dict[str, Any]:
+@timed_phase(PHASE_REMEDIATE)
+def put_bucket_policy(s3_client: boto3.client, bucket_name: str, policy: str) -> None:
+    """
+    Replaces the bucket policy for a specified S3 bucket.
+
+    :param s3_client: Initialized S3 client
+    :param bucket_name: Name of the S3 bucket
+    :param policy: Policy document as JSON text
+    """
+    s3_client.put_bucket_policy(Bucket=bucket_name, Policy=policy)
+    logger.info(f"Bucket {bucket_name} policy replaced.")
+
+@timed_phase(PHASE_DISCOVER)
+def get_account_id(sts_client: boto3.client) -> str:
+    """
+    Retrieves the ID of the account the credentials belong to.
+
+    :param sts_client: Initialized STS client
+    :return: AWS account ID
+    """
+    return sts_client.get_caller_identity()['Account']
+
+@timed_phase(PHASE_DISCOVER)
+def assume_role(sts_client: boto3.client, role_arn: str, session_name: str, duration: int) -> Dict[str, Any]:
+    """
+    Assumes an IAM role and returns its temporary credentials.
+
+    :param sts_client: Initialized STS client
+    :param role_arn: ARN of the role to assume
+    :param session_name: Name of the role session, shown in CloudTrail
+    :param duration: Lifetime of the credentials in seconds
+    :return: Credentials with AccessKeyId, SecretAccessKey, SessionToken and Expiration
     """
-    Describes EC2 instances.
+    return sts_client.assume_role(RoleArn=role_arn, RoleSessionName=session_name,
+                                  DurationSeconds=duration)['Credentials']
+
+@timed_phase(PHASE_DISCOVER)
+def get_account_public_access_block(s3control_client: boto3.client, account_id: str) -> Dict[str, bool]:
+    """
+    Retrieves the account-level S3 Public Access Block configuration.
+
+    :param s3control_client: Initialized S3 Control client
+    :param account_id: AWS account ID
+    :return: Public Access Block settings, empty if none are configured
+    """
+    try:
+        response = s3control_client.get_public_access_block(AccountId=account_id)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchPublicAccessBlockConfiguration':
+            return {}
+        raise
+    return response['PublicAccessBlockConfiguration']
+
+@timed_phase(PHASE_EVALUATE)
+def get_bucket_public_access_block(s3_client: boto3.client, bucket_name: str) -> Dict[str, bool]:
+    """
+    Retrieves the Public Access Block configuration of a specified S3 bucket.
+
+    :param s3_client: Initialized S3 client
+    :param bucket_name: Name of the S3 bucket
+    :return: Public Access Block settings, empty if none are configured
+    """
+    try:
+        response = s3_client.get_public_access_block(Bucket=bucket_name)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchPublicAccessBlockConfiguration':
+            return {}
+        raise
+    return response['PublicAccessBlockConfiguration']
+
+@timed_phase(PHASE_EVALUATE)
+def get_bucket_policy_status(s3_client: boto3.client, bucket_name: str) -> bool:
+    """
+    Retrieves whether S3 considers the bucket policy of a specified bucket public.
+
+    :param s3_client: Initialized S3 client
+    :param bucket_name: Name of the S3 bucket
+    :return: True if the bucket policy is public
+    """
+    return s3_client.get_bucket_policy_status(Bucket=bucket_name)['PolicyStatus']['IsPublic']
+
+@timed_phase(PHASE_REMEDIATE)
+def put_bucket_public_access_block(s3_client: boto3.client, bucket_name: str, configuration: Dict[str, bool]) -> None:
+    """
+    Sets the Public Access Block configuration of a specified S3 bucket.
+
+    :param s3_client: Initialized S3 client
+    :param bucket_name: Name of the S3 bucket
+    :param configuration: Public Access Block settings
+    """
+    s3_client.put_public_access_block(Bucket=bucket_name, PublicAccessBlockConfiguration=configuration)
+    logger.info(f"Bucket {bucket_name} public access blocked.")
+
+def restricts_public_buckets(configuration: Dict[str, bool]) -> bool:
+    """
+    Checks whether a Public Access Block configuration makes public bucket policies ineffective.
+
+    BlockPublicPolicy only rejects new public policies; RestrictPublicBuckets also limits
+    existing ones to AWS services and principals of the bucket owner's account.
+
+    :param configuration: Public Access Block settings
+    :return: True if public bucket policies cannot grant access
+    """
+    return bool(configuration.get('RestrictPublicBuckets'))
+
+class Record:
+    """
+    Base class of the compact resource records the describe helpers project responses into.
+
+    Records only keep the few fields the checkers need, in __slots__, so large inventories
+    do not hold on to the full describe responses.
+    """
+
+    __slots__ = ()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the record's fields as a dictionary.
+
+        :return: Dictionary of field names and values
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other: Any) -> bool:
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class InstanceRecord(Record):
+    """
+    EC2 instance fields needed by the SSM checker.
+    """
+
+    __slots__ = ('instance_id', 'profile_arn', 'state')
+
+    def __init__(self, instance_id: str, profile_arn: Optional[str] = None, state: Optional[str] = None) -> None:
+        """
+        :param instance_id: EC2 instance ID
+        :param profile_arn: ARN of the attached IAM instance profile, if any
+        :param state: Instance state name, e.g. "running"
+        """
+        self.instance_id = instance_id
+        self.profile_arn = profile_arn
+        self.state = state
+
+    @classmethod
+    def from_instance(cls, instance: Dict[str, Any]) -> "InstanceRecord":
+        """
+        Projects a DescribeInstances instance description into a record.
+
+        :param instance: EC2 instance information
+        :return: Instance record
+        """
+        return cls(
+            instance['InstanceId'],
+            instance.get('IamInstanceProfile', {}).get('Arn'),
+            instance.get('State', {}).get('Name')
+        )
+
+    @property
+    def profile_name(self) -> Optional[str]:
+        """
+        Name of the attached IAM instance profile, if any.
+        """
+        return self.profile_arn.split('/')[-1] if self.profile_arn else None
+
+class DbInstanceRecord(Record):
+    """
+    RDS instance fields needed by the public access checker.
+    """
+
+    __slots__ = ('identifier', 'publicly_accessible', 'cluster_identifier', 'status', 'modifying')
+
+    def __init__(self, identifier: str, publicly_accessible: bool = False,
+                 cluster_identifier: Optional[str] = None, status: Optional[str] = None,
+                 modifying: bool = False) -> None:
+        """
+        :param identifier: DB instance identifier
+        :param publicly_accessible: Whether the instance is, or is about to be, publicly accessible
+        :param cluster_identifier: Identifier of the Aurora cluster the instance belongs to, if any
+        :param status: DB instance status, e.g. "available"
+        :param modifying: Whether a change of public access is still pending
+        """
+        self.identifier = identifier
+        self.publicly_accessible = publicly_accessible
+        self.cluster_identifier = cluster_identifier
+        self.status = status
+        self.modifying = modifying
+
+    @classmethod
+    def from_instance(cls, instance: Dict[str, Any]) -> "DbInstanceRecord":
+        """
+        Projects a DescribeDBInstances instance description into a record.
+
+        :param instance: RDS instance information
+        :return: DB instance record
+        """
+        return cls(
+            instance['DBInstanceIdentifier'],
+            check_public_access(instance),
+            instance.get('DBClusterIdentifier'),
+            instance.get('DBInstanceStatus'),
+            'PubliclyAccessible' in instance.get('PendingModifiedValues', {})
+        )
+
+    @property
+    def private(self) -> bool:
+        """
+        Whether the instance is not publicly accessible and no change of that is pending.
+        """
+        return not self.publicly_accessible and not self.modifying and self.status != 'modifying'
+
+class DbClusterRecord(Record):
+    """
+    RDS cluster fields needed by the public access checker.
+    """
+
+    __slots__ = ('identifier', 'engine', 'members', 'publicly_accessible')
+
+    def __init__(self, identifier: str, engine: Optional[str] = None, members: Tuple[str, ...] = (),
+                 publicly_accessible: bool = False) -> None:
+        """
+        :param identifier: DB cluster identifier
+        :param engine: Database engine, e.g. "aurora-mysql"
+        :param members: Identifiers of the DB instances in the cluster
+        :param publicly_accessible: Whether the cluster itself is publicly accessible (Multi-AZ DB clusters)
+        """
+        self.identifier = identifier
+        self.engine = engine
+        self.members = members
+        self.publicly_accessible = publicly_accessible
+
+    @classmethod
+    def from_cluster(cls, cluster: Dict[str, Any]) -> "DbClusterRecord":
+        """
+        Projects a DescribeDBClusters cluster description into a record.
+
+        :param cluster: RDS cluster information
+        :return: DB cluster record
+        """
+        return cls(
+            cluster['DBClusterIdentifier'],
+            cluster.get('Engine'),
+            tuple(member['DBInstanceIdentifier'] for member in cluster.get('DBClusterMembers', [])),
+            cluster.get('PubliclyAccessible', False)
+        )
+
+def instance_filters(states: Iterable[str] = ACTIVE_INSTANCE_STATES,
+                     profile_arns: Iterable[str] = ()) -> List[Dict[str, Any]]:
+    """
+    Builds DescribeInstances filters, so instances the checkers would ignore are not returned at all.
+
+    :param states: Instance states to keep, every state if empty
+    :param profile_arns: Instance profile ARNs to keep, wildcards allowed, e.g. ANY_INSTANCE_PROFILE_ARN;
+        every instance, with or without a profile, if empty
+    :return: List of filters
+    """
+    filters = []
+    if states:
+        filters.append({'Name': 'instance-state-name', 'Values': list(states)})
+    if profile_arns:
+        filters.append({'Name': 'iam-instance-profile.arn', 'Values': list(profile_arns)})
+    return filters
+
+@timed_phase(PHASE_DISCOVER)
+def describe_instances(ec2_client: boto3.client, page_size: int = DEFAULT_PAGE_SIZE,
+                       filters: Optional[List[Dict[str, Any]]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Describes EC2 instances page by page, yielding each instance as its page arrives.
+
+    :param ec2_client: Initialized EC2 client
+    :param page_size: Number of instances requested per page
+    :param filters: DescribeInstances filters, e.g. from instance_filters(); every instance if omitted
+    :return: Iterator over EC2 instance descriptions
+    """
+    paginator = ec2_client.get_paginator('describe_instances')
+    kwargs = {'Filters': filters} if filters else {}
+    for page in paginator.paginate(PaginationConfig={'PageSize': page_size}, **kwargs):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                yield instance
+
+@timed_phase(PHASE_DISCOVER)
+def describe_instance_record_pages(ec2_client: boto3.client, page_size: int = DEFAULT_PAGE_SIZE,
+                                   token: Optional[str] = None, filters: Optional[List[Dict[str, Any]]] = None
+                                   ) -> Iterator[Tuple[Optional[str], List[InstanceRecord]]]:
+    """
+    Describes EC2 instances page by page, projecting each page into compact records as soon as it arrives.
+
+    Each page comes with the token that fetches it again, so an interrupted sweep can resume from it.
+    The token is only valid with the same filters.
 
     :param ec2_client: Initialized EC2 client
-    :return: Description of EC2 instances
+    :param page_size: Number of instances requested per page
+    :param token: Token of the page to start from, the first page if omitted
+    :param filters: DescribeInstances filters, e.g. from instance_filters(); every instance if omitted
+    :return: Iterator over tuples of page token and EC2 instance records
     """
-    return ec2_client.describe_instances()
+    while True:
+        kwargs = {'MaxResults': page_size}
+        if filters:
+            kwargs['Filters'] = filters
+        if token:
+            kwargs['NextToken'] = token
+        page = ec2_client.describe_instances(**kwargs)
+        records = [InstanceRecord.from_instance(instance)
+                   for reservation in page['Reservations'] for instance in reservation['Instances']]
+        next_token = page.get('NextToken')
+        # Drop the raw page before handing out records
+        del page
+        yield token, records
+        if not next_token:
+            return
+        token = next_token
 
+def describe_instance_records(ec2_client: boto3.client, page_size: int = DEFAULT_PAGE_SIZE,
+                              filters: Optional[List[Dict[str, Any]]] = None) -> Iterator[InstanceRecord]:
+    """
+    Describes EC2 instances page by page, projecting each page into compact records as soon as it arrives.
+
+    :param ec2_client: Initialized EC2 client
+    :param page_size: Number of instances requested per page
+    :param filters: DescribeInstances filters, e.g. from instance_filters(); every instance if omitted
+    :return: Iterator over EC2 instance records
+    """
+    for _, records in describe_instance_record_pages(ec2_client, page_size, filters=filters):
+        yield from records
+
+@timed_phase(PHASE_DISCOVER)
+def describe_instance_records_by_id(ec2_client: boto3.client, instance_ids: List[str]) -> List[InstanceRecord]:
+    """
+    Describes the given EC2 instances, up to MAX_FILTER_VALUES per call.
+
+    An instance-id filter is used instead of InstanceIds, so instances that no longer exist are left out
+    instead of failing the whole call.
+
+    :param ec2_client: Initialized EC2 client
+    :param instance_ids: EC2 instance IDs
+    :return: Records of the instances that exist
+    """
+    records = []
+    paginator = ec2_client.get_paginator('describe_instances')
+    for start in range(0, len(instance_ids), MAX_FILTER_VALUES):
+        chunk = instance_ids[start:start + MAX_FILTER_VALUES]
+        for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': chunk}]):
+            records.extend(InstanceRecord.from_instance(instance)
+                           for reservation in page['Reservations'] for instance in reservation['Instances'])
+    return records
+
+@timed_phase(PHASE_EVALUATE)
 def get_instance_profile(iam_client: boto3.client, profile_name: str) -> Dict[str, Any]:
     """
     Retrieves an IAM instance profile.
@@ -75,6 +592,7 @@ def get_instance_profile(iam_client: boto3.client, profile_name: str) -> Dict[st
     """
     return iam_client.get_instance_profile(InstanceProfileName=profile_name)
 
+@timed_phase(PHASE_EVALUATE)
 def list_attached_policies(iam_client: boto3.client, role_name: str) -> Dict[str, Any]:
     """
     Lists policies attached to a specified IAM role.
@@ -85,6 +603,54 @@ def list_attached_policies(iam_client: boto3.client, role_name: str) -> Dict[str
     """
     return iam_client.list_attached_role_policies(RoleName=role_name)
 
+@timed_phase(PHASE_EVALUATE)
+def find_policy_arns(iam_client: boto3.client, policy_name: str) -> Iterator[str]:
+    """
+    Finds the ARNs of the AWS managed and customer managed policies with a given name.
+
+    :param iam_client: Initialized IAM client
+    :param policy_name: Name of the IAM policy
+    :return: Iterator over matching policy ARNs
+    """
+    yield f"arn:{iam_client.meta.partition}:iam::aws:policy/{policy_name}"
+    paginator = iam_client.get_paginator('list_policies')
+    for page in paginator.paginate(Scope='Local', OnlyAttached=True):
+        for policy in page['Policies']:
+            if policy['PolicyName'] == policy_name:
+                yield policy['Arn']
+
+@timed_phase(PHASE_EVALUATE)
+def list_policy_roles(iam_client: boto3.client, policy_arn: str) -> Iterator[str]:
+    """
+    Lists the names of the IAM roles a policy is attached to.
+
+    :param iam_client: Initialized IAM client
+    :param policy_arn: ARN of the IAM policy
+    :return: Iterator over role names, empty if the policy does not exist
+    """
+    paginator = iam_client.get_paginator('list_entities_for_policy')
+    try:
+        for page in paginator.paginate(PolicyArn=policy_arn, EntityFilter='Role'):
+            for role in page['PolicyRoles']:
+                yield role['RoleName']
+    except iam_client.exceptions.NoSuchEntityException:
+        return
+
+@timed_phase(PHASE_EVALUATE)
+def list_role_instance_profiles(iam_client: boto3.client, role_name: str) -> Iterator[str]:
+    """
+    Lists the names of the instance profiles a role belongs to.
+
+    :param iam_client: Initialized IAM client
+    :param role_name: Name of the IAM role
+    :return: Iterator over instance profile names
+    """
+    paginator = iam_client.get_paginator('list_instance_profiles_for_role')
+    for page in paginator.paginate(RoleName=role_name):
+        for profile in page['InstanceProfiles']:
+            yield profile['InstanceProfileName']
+
+@timed_phase(PHASE_REMEDIATE)
 def detach_policy(iam_client: boto3.client, role_name: str, policy_arn: str) -> None:
     """
     Detaches a policy from a specified IAM role.
@@ -94,8 +660,242 @@ def detach_policy(iam_client: boto3.client, role_name: str, policy_arn: str) ->
     :param policy_arn: ARN of the policy to detach
     """
     iam_client.detach_role_policy(RoleName=role_name, PolicyArn=policy_arn)
-    logger.info(f"Detached SSM policy from role: {role_name}")
+    logger.info(f"Detached policy {policy_arn} from role: {role_name}")
+
+@timed_phase(PHASE_REMEDIATE)
+def delete_role_policy(iam_client: boto3.client, role_name: str, policy_name: str) -> None:
+    """
+    Deletes an inline policy from a specified IAM role.
+
+    :param iam_client: Initialized IAM client
+    :param role_name: Name of the IAM role
+    :param policy_name: Name of the inline policy
+    """
+    iam_client.delete_role_policy(RoleName=role_name, PolicyName=policy_name)
+    logger.info(f"Deleted inline policy {policy_name} from role: {role_name}")
+
+@timed_phase(PHASE_DISCOVER)
+def get_account_authorization_details(iam_client: boto3.client, filters: List[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Retrieves the account's IAM entities page by page.
+
+    :param iam_client: Initialized IAM client
+    :param filters: Entity types to retrieve, e.g. ["Role", "LocalManagedPolicy"]
+    :return: Iterator over GetAccountAuthorizationDetails pages
+    """
+    paginator = iam_client.get_paginator('get_account_authorization_details')
+    yield from paginator.paginate(Filter=filters)
+
+class IamCache:
+    """
+    Per-run, size-bounded cache of IAM instance profile and attached role policy lookups.
+
+    Entries are evicted least recently used first. Detached role policies are remembered
+    so a policy is never detached from the same role twice in the same run.
+    Safe to share between threads.
+    """
 
+    def __init__(self, iam_client: boto3.client, max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        """
+        :param iam_client: Initialized IAM client
+        :param max_size: Maximum number of entries kept per lookup type
+        """
+        self.iam_client = iam_client
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.detached_roles: Set[str] = set()
+        self._detached: Set[Tuple[str, str]] = set()
+        self._deleted: Set[Tuple[str, str]] = set()
+        self._profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._policies: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, cache: "OrderedDict[str, Dict[str, Any]]", key: str, fetch) -> Dict[str, Any]:
+        """
+        Returns a cached value for key, calling fetch on a miss.
+
+        :param cache: Cache to look the key up in
+        :param key: Cache key
+        :param fetch: Callable returning the value for key
+        :return: Cached or freshly fetched value
+        """
+        with self._lock:
+            if key in cache:
+                self.hits += 1
+                cache.move_to_end(key)
+                return cache[key]
+            self.misses += 1
+
+        # Fetch outside the lock so lookups of other keys are not serialized behind it
+        value = fetch(key)
+        with self._lock:
+            cache[key] = value
+            if len(cache) > self.max_size:
+                cache.popitem(last=False)
+        return value
+
+    def get_instance_profile(self, profile_name: str) -> Dict[str, Any]:
+        """
+        Retrieves an IAM instance profile, using the cache when possible.
+
+        :param profile_name: Name of the IAM instance profile
+        :return: Instance profile
+        """
+        return self._lookup(self._profiles, profile_name,
+                            lambda name: get_instance_profile(self.iam_client, name))
+
+    def list_attached_policies(self, role_name: str) -> Dict[str, Any]:
+        """
+        Lists policies attached to an IAM role, using the cache when possible.
+
+        :param role_name: Name of the IAM role
+        :return: List of attached policies
+        """
+        return self._lookup(self._policies, role_name,
+                            lambda name: list_attached_policies(self.iam_client, name))
+
+    def detach_policy(self, role_name: str, policy_arn: str) -> bool:
+        """
+        Detaches a policy from an IAM role unless it was already detached from the role in this run.
+
+        :param role_name: Name of the IAM role
+        :param policy_arn: ARN of the policy to detach
+        :return: True if the policy was detached, False if it was already detached
+        """
+        with self._lock:
+            if (role_name, policy_arn) in self._detached:
+                return False
+            self._detached.add((role_name, policy_arn))
+            self.detached_roles.add(role_name)
+        try:
+            detach_policy(self.iam_client, role_name, policy_arn)
+        except Exception:
+            with self._lock:
+                self._detached.discard((role_name, policy_arn))
+                if not any(role == role_name for role, _ in self._detached):
+                    self.detached_roles.discard(role_name)
+            raise
+        return True
+
+    def delete_inline_policy(self, role_name: str, policy_name: str) -> bool:
+        """
+        Deletes an inline policy from an IAM role unless it was already deleted in this run.
+
+        :param role_name: Name of the IAM role
+        :param policy_name: Name of the inline policy
+        :return: True if the policy was deleted, False if it was already deleted
+        """
+        with self._lock:
+            if (role_name, policy_name) in self._deleted:
+                return False
+            self._deleted.add((role_name, policy_name))
+        try:
+            delete_role_policy(self.iam_client, role_name, policy_name)
+        except Exception:
+            with self._lock:
+                self._deleted.discard((role_name, policy_name))
+            raise
+        return True
+
+    def removed_policies(self) -> Tuple[List[str], List[str]]:
+        """
+        Returns the policies removed from roles in this run.
+
+        :return: Sorted names of the detached managed policies and of the deleted inline policies
+        """
+        with self._lock:
+            return (sorted({policy_arn.rsplit('/', 1)[-1] for _, policy_arn in self._detached}),
+                    sorted({policy_name for _, policy_name in self._deleted}))
+
+    def profile_policy_arns(self, profile_name: str) -> List[str]:
+        """
+        Lists the policies attached to the roles of an instance profile, leaving out those detached in this run.
+
+        :param profile_name: Name of the IAM instance profile
+        :return: Sorted "role:policy ARN" pairs
+        """
+        instance_profile = self.get_instance_profile(profile_name)
+        pairs = []
+        for role in instance_profile['InstanceProfile']['Roles']:
+            role_name = role['RoleName']
+            for policy in self.list_attached_policies(role_name)['AttachedPolicies']:
+                with self._lock:
+                    if (role_name, policy['PolicyArn']) in self._detached:
+                        continue
+                pairs.append(f"{role_name}:{policy['PolicyArn']}")
+        return sorted(pairs)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns cache hit and miss counts.
+
+        :return: Dictionary with hit and miss counts
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+class S3ClientRouter:
+    """
+    Routes S3 buckets to a client in their home region.
+
+    Bucket regions are looked up once through GetBucketLocation and cached, as are the
+    per-region clients, so requests are never redirected across regions. Safe to share
+    between threads.
+    """
+
+    def __init__(self, s3_client: boto3.client, credentials: Optional[Dict[str, str]] = None) -> None:
+        """
+        :param s3_client: Initialized S3 client used for bucket location lookups
+        :param credentials: Temporary credentials the per-region clients are created with, if any
+        """
+        self.s3_client = s3_client
+        self.credentials = credentials
+        self._bucket_regions: Dict[str, str] = {}
+        self._clients: Dict[str, boto3.client] = {s3_client.meta.region_name: s3_client}
+        self._lock = threading.Lock()
+
+    def set_bucket_region(self, bucket_name: str, region: str) -> None:
+        """
+        Records a bucket's region when it is already known, skipping the lookup.
+
+        :param bucket_name: Name of the S3 bucket
+        :param region: Region name of the bucket
+        """
+        with self._lock:
+            self._bucket_regions[bucket_name] = region
+
+    def get_bucket_region(self, bucket_name: str) -> str:
+        """
+        Returns a bucket's region, looking it up on first use.
+
+        :param bucket_name: Name of the S3 bucket
+        :return: Region name of the bucket
+        """
+        with self._lock:
+            region = self._bucket_regions.get(bucket_name)
+        if region is None:
+            region = get_bucket_location(self.s3_client, bucket_name)
+            self.set_bucket_region(bucket_name, region)
+        return region
+
+    def get_client(self, bucket_name: str) -> boto3.client:
+        """
+        Returns an S3 client in the bucket's home region.
+
+        :param bucket_name: Name of the S3 bucket
+        :return: S3 client
+        """
+        region = self.get_bucket_region(bucket_name)
+        with self._lock:
+            client = self._clients.get(region)
+        if client is None:
+            client = initialize_s3_client(region, self.credentials)
+            with self._lock:
+                client = self._clients.setdefault(region, client)
+        return client
+
+@timed_phase(PHASE_DISCOVER)
 def describe_db_instances(rds_client: boto3.client) -> Dict[str, Any]:
     """
     Describes RDS instances.
@@ -105,15 +905,93 @@ def describe_db_instances(rds_client: boto3.client) -> Dict[str, Any]:
     """
     return rds_client.describe_db_instances()
 
-def check_public_access(instance: Dict[str, Any]) -> bool:
+@timed_phase(PHASE_DISCOVER)
+def describe_db_instance_record_pages(rds_client: boto3.client, page_size: int = DEFAULT_DB_PAGE_SIZE,
+                                      token: Optional[str] = None) -> Iterator[Tuple[Optional[str], List[DbInstanceRecord]]]:
+    """
+    Describes RDS instances page by page, projecting each page into compact records as soon as it arrives.
+
+    Each page comes with the marker that fetches it again, so an interrupted sweep can resume from it.
+
+    :param rds_client: Initialized RDS client
+    :param page_size: Number of instances requested per page (API allows 20-100)
+    :param token: Marker of the page to start from, the first page if omitted
+    :return: Iterator over tuples of page marker and DB instance records
+    """
+    while True:
+        kwargs = {'MaxRecords': page_size}
+        if token:
+            kwargs['Marker'] = token
+        page = rds_client.describe_db_instances(**kwargs)
+        records = [DbInstanceRecord.from_instance(instance) for instance in page['DBInstances']]
+        next_token = page.get('Marker')
+        # Drop the raw page before handing out records
+        del page
+        yield token, records
+        if not next_token:
+            return
+        token = next_token
+
+def describe_db_instance_records(rds_client: boto3.client, page_size: int = DEFAULT_DB_PAGE_SIZE) -> Iterator[DbInstanceRecord]:
+    """
+    Describes RDS instances page by page, projecting each page into compact records as soon as it arrives.
+
+    :param rds_client: Initialized RDS client
+    :param page_size: Number of instances requested per page
+    :return: Iterator over DB instance records
+    """
+    for _, records in describe_db_instance_record_pages(rds_client, page_size):
+        yield from records
+
+@timed_phase(PHASE_DISCOVER)
+def describe_db_instance_records_by_id(rds_client: boto3.client, identifiers: List[str]) -> List[DbInstanceRecord]:
+    """
+    Describes the given RDS instances, up to MAX_FILTER_VALUES per call.
+
+    :param rds_client: Initialized RDS client
+    :param identifiers: DB instance identifiers
+    :return: Records of the instances that exist
+    """
+    records = []
+    paginator = rds_client.get_paginator('describe_db_instances')
+    for start in range(0, len(identifiers), MAX_FILTER_VALUES):
+        chunk = identifiers[start:start + MAX_FILTER_VALUES]
+        for page in paginator.paginate(Filters=[{'Name': 'db-instance-id', 'Values': chunk}]):
+            records.extend(DbInstanceRecord.from_instance(instance) for instance in page['DBInstances'])
+    return records
+
+@timed_phase(PHASE_DISCOVER)
+def describe_db_cluster_records(rds_client: boto3.client, page_size: int = DEFAULT_DB_PAGE_SIZE) -> Iterator[DbClusterRecord]:
+    """
+    Describes RDS clusters, Aurora and Multi-AZ DB clusters, page by page.
+
+    :param rds_client: Initialized RDS client
+    :param page_size: Number of clusters requested per page
+    :return: Iterator over DB cluster records
+    """
+    paginator = rds_client.get_paginator('describe_db_clusters')
+    for page in paginator.paginate(PaginationConfig={'PageSize': page_size}):
+        records = [DbClusterRecord.from_cluster(cluster) for cluster in page['DBClusters']]
+        # Drop the raw page before handing out records
+        del page
+        yield from records
+
+def check_public_access(instance: Union[Dict[str, Any], DbInstanceRecord]) -> bool:
     """
     Checks if an RDS instance has public access.
 
-    :param instance: RDS instance information
+    :param instance: RDS instance information or record
     :return: True if the instance is publicly accessible, False otherwise
     """
+    if isinstance(instance, DbInstanceRecord):
+        return instance.publicly_accessible
+    # A pending modification already decides the instance's future accessibility
+    pending = instance.get('PendingModifiedValues', {})
+    if 'PubliclyAccessible' in pending:
+        return pending['PubliclyAccessible']
     return instance.get('PubliclyAccessible', False)
 
+@timed_phase(PHASE_REMEDIATE)
 def modify_db_instance(rds_client: boto3.client, instance_id: str) -> None:
     """
     Modifies an RDS instance to disable public access.
@@ -128,15 +1006,16 @@ def modify_db_instance(rds_client: boto3.client, instance_id: str) -> None:
     )
     logger.info(f"Disabled public access for RDS instance: {instance_id}")
 
-def handle_success(message: str) -> Dict[str, str]:
+def handle_success(message: str, **details: Any) -> Dict[str, Any]:
     """
     Handles success response.
 
     :param message: Success message
+    :param details: Additional fields to include in the response
     :return: Success response dictionary
     """
     logger.info(message)
-    return {"status": "Success", "reason": message}
+    return {"status": "Success", "reason": message, **details}
 
 def handle_error(exception: Exception, message: str) -> Dict[str, str]:
     """
@@ -148,3 +1027,14 @@ def handle_error(exception: Exception, message: str) -> Dict[str, str]:
     """
     logger.error(f"{message}{exception}")
     return {"status": "Error", "reason": f"{message}{exception}"}
+
+def handle_failure(message: str, **details: Any) -> Dict[str, Any]:
+    """
+    Handles error response of a run that failed for some resources but still has results to report.
+
+    :param message: Error message
+    :param details: Additional fields to include in the response
+    :return: Error response dictionary
+    """
+    logger.error(message)
+    return {"status": "Error", "reason": message, **details}
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import re
+from typing import Any, Dict, Iterable, List, Optional, Pattern, Tuple
+from urllib.parse import unquote
+import boto3
+from .helpers import get_account_authorization_details
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Entity types always retrieved: roles with their instance profiles, attached and inline policies
+ROLE_FILTERS = ["Role"]
+
+# Entity types retrieved as well when managed policy documents must be matched against action patterns
+POLICY_FILTERS = ["LocalManagedPolicy", "AWSManagedPolicy"]
+
+
+def _wildcard_regex(patterns: Iterable[str]) -> Optional[Pattern[str]]:
+    """
+    Compiles IAM wildcard patterns ("*" and "?") into one case-insensitive regular expression.
+
+    :param patterns: Wildcard patterns, e.g. "ssm:*"
+    :return: Compiled expression matching any of the patterns, or None if there are none
+    """
+    alternatives = [re.escape(pattern).replace(r'\*', '.*').replace(r'\?', '.') for pattern in patterns]
+    if not alternatives:
+        return None
+    return re.compile("^(?:" + "|".join(alternatives) + ")$", re.IGNORECASE)
+
+
+def _as_list(value: Any) -> List[Any]:
+    """
+    Wraps a single policy element in a list.
+
+    :param value: Policy element, a single value or a list
+    :return: List of values
+    """
+    return value if isinstance(value, list) else [value]
+
+
+def parse_document(document: Any) -> Dict[str, Any]:
+    """
+    Parses a policy document as returned by IAM, which may be URL-encoded JSON.
+
+    :param document: Policy document as a dictionary or string
+    :return: Policy document as a dictionary
+    """
+    if isinstance(document, dict):
+        return document
+    return json.loads(unquote(document))
+
+
+class PolicyMatcher:
+    """
+    Decides which role policies are forbidden by name, by ARN or by the actions they allow.
+
+    The action patterns are compiled once into a single expression, so every policy is
+    checked in one pass however many patterns are configured.
+    """
+
+    def __init__(self, names: Iterable[str] = (), arns: Iterable[str] = (), actions: Iterable[str] = ()) -> None:
+        """
+        :param names: Forbidden policy names
+        :param arns: Forbidden managed policy ARNs
+        :param actions: Forbidden actions, with IAM wildcards, e.g. "ssm:*" or "iam:Pass*"
+        """
+        self.names = frozenset(names)
+        self.arns = frozenset(arns)
+        self.actions = tuple(actions)
+        self._actions_regex = _wildcard_regex(self.actions)
+
+    @classmethod
+    def from_values(cls, values: Iterable[str], actions: Iterable[str] = ()) -> "PolicyMatcher":
+        """
+        Builds a matcher from policy names and ARNs given together, e.g. on the command line.
+
+        :param values: Policy names and ARNs; values starting with "arn:" are ARNs
+        :param actions: Forbidden actions, with IAM wildcards
+        :return: Policy matcher
+        """
+        values = list(values)
+        return cls([value for value in values if not value.startswith("arn:")],
+                   [value for value in values if value.startswith("arn:")], actions)
+
+    @property
+    def needs_documents(self) -> bool:
+        """
+        Whether managed policy documents must be retrieved to match action patterns.
+        """
+        return self._actions_regex is not None
+
+    def matches_action(self, action: str) -> bool:
+        """
+        Checks whether an allowed action, possibly itself a wildcard, overlaps a forbidden pattern.
+
+        :param action: Action of a policy statement, e.g. "ssm:GetParameter" or "ssm:*"
+        :return: True if the action is forbidden
+        """
+        if self._actions_regex is None:
+            return False
+        if self._actions_regex.match(action):
+            return True
+        # A wildcard in the policy, e.g. "*" or "ssm:*", grants whatever forbidden action it covers
+        if '*' in action or '?' in action:
+            granted = _wildcard_regex([action])
+            return any(granted.match(pattern) for pattern in self.actions)
+        return False
+
+    def forbidden_action(self, document: Any) -> Optional[str]:
+        """
+        Returns the first forbidden action a policy document allows.
+
+        :param document: Policy document
+        :return: Forbidden action, or None if the document allows none
+        """
+        if self._actions_regex is None or document is None:
+            return None
+        for statement in _as_list(parse_document(document).get('Statement', [])):
+            if statement.get('Effect') != 'Allow':
+                continue
+            for action in _as_list(statement.get('Action', [])):
+                if self.matches_action(action):
+                    return action
+        return None
+
+    def match(self, name: str, arn: Optional[str] = None, document: Any = None) -> Optional[str]:
+        """
+        Decides whether a policy is forbidden.
+
+        :param name: Policy name
+        :param arn: Policy ARN, None for inline policies
+        :param document: Policy document, if known
+        :return: Why the policy is forbidden, e.g. "name" or "action:ssm:*", or None if it is allowed
+        """
+        if name in self.names:
+            return "name"
+        if arn is not None and arn in self.arns:
+            return "arn"
+        action = self.forbidden_action(document)
+        return f"action:{action}" if action else None
+
+
+class AuthorizationDetails:
+    """
+    In-memory indexes of the account's roles, instance profiles and role policies.
+
+    Built from one paginated GetAccountAuthorizationDetails sweep, so the number of IAM
+    calls does not grow with the number of instances, profiles or roles.
+    """
+
+    def __init__(self) -> None:
+        self.profile_roles: Dict[str, List[str]] = {}
+        self.role_policies: Dict[str, List[Dict[str, str]]] = {}
+        self.role_inline_policies: Dict[str, List[Tuple[str, Any]]] = {}
+        self.policy_documents: Dict[str, Any] = {}
+        self.pages = 0
+
+    @classmethod
+    def load(cls, iam_client: boto3.client, with_documents: bool = False) -> "AuthorizationDetails":
+        """
+        Retrieves the account's authorization details and indexes them.
+
+        :param iam_client: Initialized IAM client
+        :param with_documents: Also retrieve the default versions of the managed policies
+        :return: Indexed authorization details
+        """
+        details = cls()
+        filters = ROLE_FILTERS + (POLICY_FILTERS if with_documents else [])
+        for page in get_account_authorization_details(iam_client, filters):
+            details.add_page(page)
+        return details
+
+    def add_page(self, page: Dict[str, Any]) -> None:
+        """
+        Indexes one GetAccountAuthorizationDetails page.
+
+        :param page: Response page
+        """
+        self.pages += 1
+        for role in page.get('RoleDetailList', []):
+            role_name = role['RoleName']
+            for profile in role.get('InstanceProfileList', []):
+                self.profile_roles.setdefault(profile['InstanceProfileName'], []).append(role_name)
+            self.role_policies[role_name] = [{'PolicyName': policy['PolicyName'], 'PolicyArn': policy['PolicyArn']}
+                                             for policy in role.get('AttachedManagedPolicies', [])]
+            self.role_inline_policies[role_name] = [(policy['PolicyName'], policy.get('PolicyDocument'))
+                                                    for policy in role.get('RolePolicyList', [])]
+        for policy in page.get('Policies', []):
+            for version in policy.get('PolicyVersionList', []):
+                if version.get('IsDefaultVersion'):
+                    self.policy_documents[policy['Arn']] = version.get('Document')
+
+    def forbidden_policies(self, role_name: str, matcher: PolicyMatcher) -> List[Dict[str, str]]:
+        """
+        Lists the attached and inline policies of a role the matcher forbids.
+
+        :param role_name: Name of the IAM role
+        :param matcher: Policy matcher
+        :return: Forbidden policies, each with "policy_name", "match" and, if managed, "policy_arn"
+        """
+        forbidden = []
+        for policy in self.role_policies.get(role_name, []):
+            reason = matcher.match(policy['PolicyName'], policy['PolicyArn'],
+                                   self.policy_documents.get(policy['PolicyArn']))
+            if reason:
+                forbidden.append({"policy_name": policy['PolicyName'], "policy_arn": policy['PolicyArn'],
+                                  "match": reason})
+        for policy_name, document in self.role_inline_policies.get(role_name, []):
+            reason = matcher.match(policy_name, None, document)
+            if reason:
+                forbidden.append({"policy_name": policy_name, "match": reason})
+        return forbidden
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the size of the indexes and the number of pages they were built from.
+
+        :return: Dictionary of counts
+        """
+        return {"pages": self.pages, "profiles": len(self.profile_roles), "roles": len(self.role_policies),
+                "policy_documents": len(self.policy_documents)}
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+AWS Lambda entry point running the checks within the invocation's time budget.
+
+Only the standard library is imported at module load, so cold starts stay short. The
+checks are imported on first use and stay loaded, together with the pooled clients,
+for as long as Lambda reuses the execution environment. A sweep that runs low on time
+saves its position (check, page token and index within the page) to a checkpoint,
+and the next invocation resumes from there.
+"""
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Checks run when neither the event nor the environment names any, in order
+DEFAULT_CHECKS = ("ec2", "rds", "s3")
+
+# Milliseconds left in the invocation at which the sweep stops and saves its position
+DEFAULT_SAFETY_MARGIN_MS = 20000
+
+# Environment variables providing defaults for the event fields
+CHECKS_ENV = "CHECKS"
+CHECKPOINT_ENV = "CHECKPOINT_URI"
+SAFETY_MARGIN_ENV = "SAFETY_MARGIN_MS"
+
+# Prefix of checkpoint locations stored in S3 rather than in a local file
+S3_PREFIX = "s3://"
+
+
+class Checkpoint:
+    """
+    Position of an interrupted sweep, stored as JSON in a local file or an S3 object.
+    """
+
+    def __init__(self, uri: str, region: str = "us-east-1") -> None:
+        """
+        :param uri: Path of a local file, or "s3://bucket/key" of an S3 object
+        :param region: AWS region of the S3 client used for S3 locations
+        """
+        self.uri = uri
+        self.region = region
+
+    def _s3_location(self) -> Optional[tuple]:
+        """
+        Splits an S3 location into bucket and key.
+
+        :return: Tuple of bucket and key, or None for a local file
+        """
+        if not self.uri.startswith(S3_PREFIX):
+            return None
+        bucket, _, key = self.uri[len(S3_PREFIX):].partition('/')
+        return bucket, key
+
+    def _s3_client(self):
+        from .helpers import get_client
+        return get_client('s3', self.region)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """
+        Reads the saved position.
+
+        :return: Saved sweep state, or None if there is no checkpoint
+        """
+        location = self._s3_location()
+        if location is None:
+            if not os.path.exists(self.uri):
+                return None
+            with open(self.uri) as f:
+                return json.load(f)
+
+        s3_client = self._s3_client()
+        try:
+            body = s3_client.get_object(Bucket=location[0], Key=location[1])['Body'].read()
+        except s3_client.exceptions.NoSuchKey:
+            return None
+        return json.loads(body)
+
+    def save(self, state: Dict[str, Any]) -> None:
+        """
+        Writes the position of the sweep.
+
+        :param state: Sweep state
+        """
+        payload = json.dumps(state, default=str)
+        location = self._s3_location()
+        if location is None:
+            with open(self.uri, 'w') as f:
+                f.write(payload)
+        else:
+            self._s3_client().put_object(Bucket=location[0], Key=location[1], Body=payload.encode('utf-8'))
+        logger.info(f"Checkpoint saved to {self.uri}")
+
+    def clear(self) -> None:
+        """
+        Removes the checkpoint once the sweep has finished.
+        """
+        location = self._s3_location()
+        if location is None:
+            if os.path.exists(self.uri):
+                os.remove(self.uri)
+        else:
+            self._s3_client().delete_object(Bucket=location[0], Key=location[1])
+
+
+def run_sweep(checks: List[str], region: str = "us-east-1", checkpoint: Optional[Checkpoint] = None,
+              remaining_ms: Optional[Callable[[], int]] = None, margin_ms: int = DEFAULT_SAFETY_MARGIN_MS,
+              remediate: bool = True, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Runs checks resource by resource until they finish or the time budget runs low.
+
+    :param checks: Names of the checks to run, in order
+    :param region: AWS region to run the checks in
+    :param checkpoint: Where the position is saved when time runs low and loaded from on start
+    :param remaining_ms: Function returning the milliseconds left in the invocation, no limit if omitted
+    :param margin_ms: Milliseconds left at which the sweep stops; at least one resource is processed per
+        invocation, so a margin above the whole budget still makes progress
+    :param remediate: Perform the remediation actions, or only report them
+    :param options: Options of the checks, e.g. {"engine": "policy"}
+    :return: Verdict counts per check, with "complete" False if the sweep stopped early
+    """
+    from .engine import VERDICT_ERROR, CheckContext, finish_check, get_check, process_resource
+    from .helpers import handle_failure, handle_success
+
+    state = (checkpoint.load() if checkpoint is not None else None) or {
+        "check": None, "token": None, "index": 0, "verdicts": {}, "invocations": 0,
+    }
+    state["invocations"] += 1
+    start = checks.index(state["check"]) if state["check"] in checks else 0
+
+    context = CheckContext(region, options=options)
+    processed = 0
+    for name in checks[start:]:
+        check = get_check(name)(context)
+        verdicts = state["verdicts"].setdefault(name, {})
+        token, skip = (state["token"], state["index"]) if name == state["check"] else (None, 0)
+        for token, resources in check.pages(token):
+            for index in range(skip, len(resources)):
+                if remaining_ms is not None and remaining_ms() < margin_ms:
+                    if not processed:
+                        # Stopping before any resource would save the same position on every invocation
+                        logger.warning(f"Safety margin of {margin_ms}ms exceeds the time left; "
+                                       f"processing one resource anyway")
+                    else:
+                        state.update(check=name, token=token, index=index)
+                        if checkpoint is not None:
+                            checkpoint.save(state)
+                        else:
+                            logger.warning("Time budget reached without a checkpoint; progress is lost")
+                        return handle_success(f"Time budget reached during the {name} check, resuming next "
+                                              f"invocation", complete=False, verdicts=state["verdicts"],
+                                              invocations=state["invocations"])
+                finding = process_resource(check, resources[index], remediate)
+                verdicts[finding["verdict"]] = verdicts.get(finding["verdict"], 0) + 1
+                processed += 1
+            skip = 0
+        for finding in finish_check(check):
+            verdicts[finding["verdict"]] = verdicts.get(finding["verdict"], 0) + 1
+
+    if checkpoint is not None:
+        checkpoint.clear()
+    message = f"Checked {sum(sum(counts.values()) for counts in state['verdicts'].values())} resource/-s"
+    if any(counts.get(VERDICT_ERROR) for counts in state["verdicts"].values()):
+        return handle_failure(message, complete=True, verdicts=state["verdicts"], invocations=state["invocations"])
+    return handle_success(message, complete=True, verdicts=state["verdicts"], invocations=state["invocations"])
+
+
+def handler(event: Optional[Dict[str, Any]], context: Any) -> Dict[str, Any]:
+    """
+    Lambda handler. Event fields, all optional, fall back to environment variables:
+
+    - "checks": list of check names (CHECKS, comma-separated; default every check)
+    - "region": AWS region (AWS_REGION)
+    - "checkpoint": local path or "s3://bucket/key" (CHECKPOINT_URI)
+    - "safety_margin_ms": milliseconds left at which the sweep stops (SAFETY_MARGIN_MS)
+    - "dry_run": report actions without performing them
+    - "options": options of the checks, e.g. {"engine": "policy", "remediation": "block"}
+
+    :param event: Invocation event
+    :param context: Lambda context, used for the remaining time
+    :return: Sweep result
+    """
+    event = event or {}
+    checks = event.get("checks") or os.environ.get(CHECKS_ENV, ",".join(DEFAULT_CHECKS)).split(",")
+    region = event.get("region") or os.environ.get("AWS_REGION", "us-east-1")
+    uri = event.get("checkpoint") or os.environ.get(CHECKPOINT_ENV)
+    margin_ms = int(event.get("safety_margin_ms") or os.environ.get(SAFETY_MARGIN_ENV, DEFAULT_SAFETY_MARGIN_MS))
+
+    return run_sweep(
+        [name.strip() for name in checks if name.strip()],
+        region,
+        checkpoint=Checkpoint(uri, region) if uri else None,
+        remaining_ms=getattr(context, 'get_remaining_time_in_millis', None),
+        margin_ms=margin_ms,
+        remediate=not event.get("dry_run", False),
+        options=event.get("options")
+    )
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+from .rate_limiter import is_throttling_response
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the API call latency histogram buckets
+LATENCY_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Checker phases that are timed
+PHASE_DISCOVER = "discover"
+PHASE_EVALUATE = "evaluate"
+PHASE_REMEDIATE = "remediate"
+
+
+class OperationMetrics:
+    """
+    Counters and latency histogram of one service operation.
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttles = 0
+        self.bytes_received = 0
+        self.latency_sum = 0.0
+        self.latency_buckets: List[int] = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, latency: float) -> None:
+        """
+        Adds a call latency to the histogram.
+
+        :param latency: Call latency in seconds
+        """
+        self.latency_sum += latency
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.latency_buckets[index] += 1
+                return
+        self.latency_buckets[-1] += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Returns the metrics as a dictionary with a cumulative latency histogram.
+
+        :return: Dictionary of the operation metrics
+        """
+        cumulative = 0
+        histogram = {}
+        for bound, count in zip([*map(str, LATENCY_BUCKETS), "+Inf"], self.latency_buckets):
+            cumulative += count
+            histogram[bound] = cumulative
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "throttles": self.throttles,
+            "bytes_received": self.bytes_received,
+            "latency_sum": round(self.latency_sum, 6),
+            "latency_histogram": histogram,
+        }
+
+
+class Metrics:
+    """
+    Process-wide collector of API call metrics and checker phase timings. Safe to share between threads.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._operations: Dict[Tuple[str, str], OperationMetrics] = defaultdict(OperationMetrics)
+        self._phases: Dict[str, float] = defaultdict(float)
+
+    def record_call(self, service: str, operation: str, latency: float, bytes_received: int = 0,
+                    retries: int = 0, error: bool = False) -> None:
+        """
+        Records one completed API call.
+
+        :param service: AWS service name
+        :param operation: API operation name
+        :param latency: Call latency in seconds, including retries
+        :param bytes_received: Size of the response body
+        :param retries: Number of retries the call needed
+        :param error: Whether the call ended in an error
+        """
+        with self._lock:
+            operation_metrics = self._operations[(service, operation)]
+            operation_metrics.calls += 1
+            operation_metrics.retries += retries
+            operation_metrics.bytes_received += bytes_received
+            operation_metrics.errors += int(error)
+            operation_metrics.observe(latency)
+
+    def record_throttle(self, service: str, operation: str) -> None:
+        """
+        Records a throttling response.
+
+        :param service: AWS service name
+        :param operation: API operation name
+        """
+        with self._lock:
+            self._operations[(service, operation)].throttles += 1
+
+    def record_phase(self, phase: str, seconds: float) -> None:
+        """
+        Adds time spent in a checker phase.
+
+        :param phase: Phase name
+        :param seconds: Time spent in seconds
+        """
+        with self._lock:
+            self._phases[phase] += seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the collected metrics.
+
+        :return: Dictionary with per-operation metrics under "api" and phase seconds under "phases"
+        """
+        with self._lock:
+            api: Dict[str, Dict[str, Any]] = {}
+            for (service, operation), operation_metrics in sorted(self._operations.items()):
+                api.setdefault(service, {})[operation] = operation_metrics.as_dict()
+            phases = {phase: round(seconds, 6) for phase, seconds in sorted(self._phases.items())}
+        return {"api": api, "phases": phases}
+
+    def since(self, baseline: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns the metrics collected after an earlier snapshot, e.g. those of one run.
+
+        Calls made at the same time by other runs of the process are included.
+
+        :param baseline: Snapshot taken when the run started
+        :return: Dictionary shaped like snapshot(), without operations and phases that saw no activity
+        """
+        current = self.snapshot()
+        api: Dict[str, Dict[str, Any]] = {}
+        for service, operations in current["api"].items():
+            for operation, values in operations.items():
+                previous = baseline["api"].get(service, {}).get(operation)
+                if previous is not None:
+                    values = {key: value - previous[key] for key, value in values.items()
+                              if key != "latency_histogram"}
+                    if not values["calls"] and not values["throttles"]:
+                        continue
+                    values["latency_sum"] = round(values["latency_sum"], 6)
+                    values["latency_histogram"] = {
+                        bound: count - previous["latency_histogram"][bound]
+                        for bound, count in operations[operation]["latency_histogram"].items()
+                    }
+                api.setdefault(service, {})[operation] = values
+        phases = {}
+        for phase, seconds in current["phases"].items():
+            seconds = round(seconds - baseline["phases"].get(phase, 0.0), 6)
+            if seconds > 0:
+                phases[phase] = seconds
+        return {"api": api, "phases": phases}
+
+    def reset(self) -> None:
+        """
+        Drops all collected metrics.
+        """
+        with self._lock:
+            self._operations.clear()
+            self._phases.clear()
+
+    def to_prometheus(self) -> str:
+        """
+        Renders the metrics in the Prometheus text exposition format.
+
+        :return: Prometheus textfile contents
+        """
+        snapshot = self.snapshot()
+        counters = ("calls", "errors", "retries", "throttles", "bytes_received")
+        lines = []
+        for counter in counters:
+            lines.append(f"# TYPE aws_policy_checker_api_{counter}_total counter")
+            for service, operations in snapshot["api"].items():
+                for operation, values in operations.items():
+                    lines.append(f'aws_policy_checker_api_{counter}_total{{service="{service}",'
+                                 f'operation="{operation}"}} {values[counter]}')
+        lines.append("# TYPE aws_policy_checker_api_latency_seconds histogram")
+        for service, operations in snapshot["api"].items():
+            for operation, values in operations.items():
+                labels = f'service="{service}",operation="{operation}"'
+                for bound, count in values["latency_histogram"].items():
+                    lines.append(f'aws_policy_checker_api_latency_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'aws_policy_checker_api_latency_seconds_sum{{{labels}}} {values["latency_sum"]}')
+                lines.append(f'aws_policy_checker_api_latency_seconds_count{{{labels}}} {values["calls"]}')
+        lines.append("# TYPE aws_policy_checker_phase_seconds_total counter")
+        for phase, seconds in snapshot["phases"].items():
+            lines.append(f'aws_policy_checker_phase_seconds_total{{phase="{phase}"}} {seconds}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """
+        Writes the metrics to a file, as a Prometheus textfile if the path ends in ".prom" and as JSON otherwise.
+
+        :param path: Path of the metrics file
+        """
+        with open(path, 'w') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.snapshot(), f, indent=2)
+        logger.info(f"Metrics written to {path}")
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """
+    Returns the process-wide metrics collector.
+
+    :return: Metrics collector
+    """
+    return _metrics
+
+
+def timed_phase(phase: str) -> Callable:
+    """
+    Decorator adding the time spent in a function to a checker phase.
+
+    For generator functions only the time spent producing items is counted, not the
+    time the caller spends between items.
+
+    :param phase: Phase name
+    :return: Decorator
+    """
+    def decorator(func: Callable) -> Callable:
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args: Any, **kwargs: Any) -> Iterator[Any]:
+                iterator = func(*args, **kwargs)
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        _metrics.record_phase(phase, time.perf_counter() - start)
+                    yield item
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _metrics.record_phase(phase, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def register_metrics(client) -> None:
+    """
+    Hooks a client up to the process-wide metrics collector.
+
+    :param client: boto3 client
+    """
+    service = client.meta.service_model.service_name
+    event_name = client.meta.service_model.service_id.hyphenize()
+
+    def before_call(model=None, context=None, **kwargs: Any) -> None:
+        if context is not None:
+            context['metrics_start'] = time.perf_counter()
+
+    def needs_retry(response=None, operation=None, **kwargs: Any) -> None:
+        if is_throttling_response(response):
+            _metrics.record_throttle(service, operation.name if operation else "unknown")
+
+    def after_call(http_response=None, parsed=None, model=None, context=None, **kwargs: Any) -> None:
+        start = (context or {}).get('metrics_start')
+        latency = time.perf_counter() - start if start is not None else 0.0
+        parsed = parsed or {}
+        bytes_received = 0
+        if http_response is not None and not model.has_streaming_output:
+            bytes_received = len(http_response.content or b'')
+        _metrics.record_call(
+            service, model.name, latency,
+            bytes_received=bytes_received,
+            retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+            error='Error' in parsed
+        )
+
+    client.meta.events.register(f'before-call.{event_name}', before_call)
+    client.meta.events.register(f'needs-retry.{event_name}', needs_retry)
+    client.meta.events.register(f'after-call.{event_name}', after_call)
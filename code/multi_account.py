@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Union
+from botocore.exceptions import BotoCoreError, ClientError
+from .helpers import assume_role, get_client, handle_error, handle_failure, handle_success
+from .metrics import get_metrics
+from .rate_limiter import get_rate_limiter_stats
+from .multi_region import ALL_REGIONS, CHECKERS, get_enabled_regions, scan_region
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Upper bound on the number of accounts scanned at the same time
+DEFAULT_MAX_ACCOUNTS = 8
+
+# Upper bound on the number of regions and checkers scanned at the same time within one account
+DEFAULT_MAX_WORKERS = 4
+
+# Name of the role sessions, shown in the CloudTrail logs of the scanned accounts
+DEFAULT_SESSION_NAME = "aws-policy-checker"
+
+# Lifetime requested for assumed role credentials, in seconds
+DEFAULT_DURATION = 3600
+
+# Credentials are assumed again this many seconds before they expire
+EXPIRY_MARGIN = 300
+
+
+def role_arn(account_id: str, role_name: str, partition: str = "aws") -> str:
+    """
+    Builds the ARN of a role in an account.
+
+    :param account_id: AWS account ID
+    :param role_name: Name of the IAM role
+    :param partition: AWS partition, e.g. "aws-us-gov"
+    :return: Role ARN
+    """
+    return f"arn:{partition}:iam::{account_id}:role/{role_name}"
+
+
+class CredentialCache:
+    """
+    Caches assumed role credentials per account until shortly before they expire.
+
+    The cached credentials carry an "AccountId" entry, so pooled clients created from
+    them share the rate limiters of their account. Safe to share between threads.
+    """
+
+    def __init__(self, role_name: str, region: str = "us-east-1", session_name: str = DEFAULT_SESSION_NAME,
+                 duration: int = DEFAULT_DURATION, margin: int = EXPIRY_MARGIN,
+                 clock: Callable[[], float] = time.time) -> None:
+        """
+        :param role_name: Name of the role assumed in every account
+        :param region: AWS region of the STS endpoint
+        :param session_name: Name of the role sessions
+        :param duration: Lifetime requested for the credentials in seconds
+        :param margin: Seconds before expiry at which credentials are assumed again
+        :param clock: Function returning the current time in seconds since the epoch
+        """
+        self.role_name = role_name
+        self.region = region
+        self.session_name = session_name
+        self.duration = duration
+        self.margin = margin
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._credentials: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, account_id: str) -> Dict[str, Any]:
+        """
+        Returns credentials for an account, assuming the role if none are cached or they are about to expire.
+
+        :param account_id: AWS account ID
+        :return: Credentials with AccessKeyId, SecretAccessKey, SessionToken, Expiration and AccountId
+        :raises ClientError: If the role cannot be assumed.
+        """
+        with self._lock:
+            credentials = self._credentials.get(account_id)
+            if credentials is not None and credentials['Expiration'].timestamp() - self.margin > self.clock():
+                self.hits += 1
+                return credentials
+            self.misses += 1
+
+        # Assume outside the lock so accounts do not wait for each other's STS calls
+        credentials = assume_role(get_client('sts', self.region), role_arn(account_id, self.role_name),
+                                  self.session_name, self.duration)
+        credentials = {**credentials, 'AccountId': account_id}
+        with self._lock:
+            self._credentials[account_id] = credentials
+        return credentials
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns cache hit and miss counts; every miss is one AssumeRole call.
+
+        :return: Dictionary with hit and miss counts
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+def scan_account(account_id: str, credential_cache: CredentialCache,
+                 checkers: Dict[str, Callable[..., Dict[str, Any]]],
+                 regions: Union[List[str], str, None] = ALL_REGIONS,
+                 max_workers: int = DEFAULT_MAX_WORKERS) -> Dict[str, Any]:
+    """
+    Runs checkers in every given region of one account.
+
+    :param account_id: AWS account ID
+    :param credential_cache: Cache of assumed role credentials
+    :param checkers: Checker entry points taking a region name and credentials, by name
+    :param regions: Regions to scan, or "all" for every region enabled in the account
+    :param max_workers: Maximum number of region and checker pairs scanned at the same time
+    :return: Account report with the checker results keyed by region and checker name
+    """
+    start = time.perf_counter()
+    try:
+        credentials = credential_cache.get(account_id)
+        if regions is None or regions == ALL_REGIONS:
+            regions = get_enabled_regions(credential_cache.region, credentials)
+    except (BotoCoreError, ClientError) as e:
+        result = handle_error(e, f"Error assuming role in account {account_id}: ")
+        result["duration"] = round(time.perf_counter() - start, 3)
+        return result
+
+    tasks = [(region, name) for region in regions for name in checkers]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks) or 1))) as executor:
+        results = executor.map(
+            lambda task: scan_region(partial(checkers[task[1]], credentials=credentials), task[0]), tasks
+        )
+        report: Dict[str, Dict[str, Any]] = {region: {} for region in regions}
+        for (region, name), result in zip(tasks, results):
+            report[region][name] = result
+    duration = round(time.perf_counter() - start, 3)
+
+    failed = sorted(f"{region}/{name}" for region, result in report.items()
+                    for name in result if result[name]['status'] != "Success")
+    if failed:
+        return handle_failure(f"Scanned {len(report)} region/-s of account {account_id}, {len(failed)} check/-s "
+                              f"failed: {', '.join(failed)}", regions=report, duration=duration)
+    return handle_success(f"Scanned {len(report)} region/-s", regions=report, duration=duration)
+
+
+def scan_accounts(account_ids: List[str], role_name: str,
+                  checkers: Optional[Dict[str, Callable[..., Dict[str, Any]]]] = None,
+                  regions: Union[List[str], str, None] = ALL_REGIONS,
+                  max_accounts: int = DEFAULT_MAX_ACCOUNTS, max_workers: int = DEFAULT_MAX_WORKERS,
+                  credential_cache: Optional[CredentialCache] = None) -> Dict[str, Any]:
+    """
+    Assumes a role in every account and runs the checkers there in parallel, aggregating one report.
+
+    :param account_ids: AWS account IDs to scan
+    :param role_name: Name of the role assumed in every account
+    :param checkers: Checker entry points taking a region name and credentials, by name; all by default
+    :param regions: Regions to scan, or "all" for every region enabled in each account
+    :param max_accounts: Maximum number of accounts scanned at the same time
+    :param max_workers: Maximum number of region and checker pairs scanned at the same time per account
+    :param credential_cache: Cache of assumed role credentials, a new one for role_name by default
+    :return: Aggregated report with the account reports keyed by account ID
+    """
+    checkers = checkers or CHECKERS
+    credential_cache = credential_cache or CredentialCache(role_name)
+
+    start = time.perf_counter()
+    baseline = get_metrics().snapshot()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_accounts, len(account_ids) or 1))) as executor:
+        results = executor.map(
+            lambda account_id: scan_account(account_id, credential_cache, checkers, regions, max_workers),
+            account_ids
+        )
+        report = dict(zip(account_ids, results))
+    duration = round(time.perf_counter() - start, 3)
+
+    details = {"accounts": report, "duration": duration, "credentials": credential_cache.stats(),
+               "rate_limits": get_rate_limiter_stats(), "metrics": get_metrics().since(baseline)}
+    failed = sorted(account_id for account_id, result in report.items() if result['status'] != "Success")
+    if failed:
+        return handle_failure(f"Scanned {len(report)} account/-s, {len(failed)} failed: {', '.join(failed)}",
+                              **details)
+    return handle_success(f"Scanned {len(report)} account/-s", **details)
+
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Union
+from .helpers import initialize_clients, handle_error, handle_failure, handle_success
+from .metrics import get_metrics
+from .rate_limiter import get_rate_limiter_stats
+from .ec2_check_remove_ssm_policy import check_remove_ssm_policy
+from .rds_check_remove_public_access import check_remove_public_access
+from .s3_check_remove_public_access import main as s3_main
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Upper bound on the number of regions scanned at the same time
+DEFAULT_MAX_WORKERS = 8
+
+# Value accepted in place of a region list to scan every enabled region
+ALL_REGIONS = "all"
+
+
+def scan_s3_region(region: str, credentials: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Check the S3 buckets located in a single region.
+
+    :param region: AWS region whose buckets are checked
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+    :return: Success or error message
+    """
+    return s3_main(region, bucket_region=region, credentials=credentials)
+
+
+# Checkers that can be fanned out across regions, by name; each also accepts credentials
+CHECKERS: Dict[str, Callable[..., Dict[str, Any]]] = {
+    "ec2": check_remove_ssm_policy,
+    "rds": check_remove_public_access,
+    "s3": scan_s3_region,
+}
+
+
+def get_enabled_regions(region: str = "us-east-1", credentials: Optional[Dict[str, str]] = None) -> List[str]:
+    """
+    Lists the regions enabled for the account.
+
+    :param region: AWS region used to query EC2 for the region list
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+    :return: Names of the enabled regions
+    """
+    ec2_client, _ = initialize_clients(region, credentials)
+    response = ec2_client.describe_regions()
+    return sorted(r['RegionName'] for r in response['Regions']
+                  if r.get('OptInStatus') != 'not-opted-in')
+
+
+def scan_region(checker: Callable[[str], Dict[str, Any]], region: str) -> Dict[str, Any]:
+    """
+    Runs a checker in one region and records how long it took.
+
+    :param checker: Checker entry point taking a region name
+    :param region: AWS region to scan
+    :return: Checker result with the duration in seconds added
+    """
+    start = time.perf_counter()
+    try:
+        result = checker(region)
+    except Exception as e:
+        result = handle_error(e, f"Unexpected error in {region}: ")
+    # Metrics are process-wide and reported once in the aggregated report
+    result.pop("metrics", None)
+    result["duration"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def scan_regions(checker: Callable[[str], Dict[str, Any]],
+                 regions: Union[List[str], str, None] = ALL_REGIONS,
+                 max_workers: int = DEFAULT_MAX_WORKERS) -> Dict[str, Any]:
+    """
+    Runs a checker in several regions in parallel and aggregates the results.
+
+    :param checker: Checker entry point taking a region name
+    :param regions: Regions to scan, or "all" for every enabled region
+    :param max_workers: Maximum number of regions scanned at the same time
+    :return: Aggregated report with the per-region results and timings
+    """
+    if regions is None or regions == ALL_REGIONS:
+        regions = get_enabled_regions()
+
+    start = time.perf_counter()
+    baseline = get_metrics().snapshot()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(regions)))) as executor:
+        results = executor.map(lambda region: scan_region(checker, region), regions)
+        report = dict(zip(regions, results))
+    duration = round(time.perf_counter() - start, 3)
+
+    failed = sorted(region for region, result in report.items() if result['status'] != "Success")
+    if failed:
+        return handle_failure(f"Scanned {len(report)} region/-s, {len(failed)} failed: {', '.join(failed)}",
+                              regions=report, duration=duration, rate_limits=get_rate_limiter_stats(),
+                              metrics=get_metrics().since(baseline))
+    return handle_success(f"Scanned {len(report)} region/-s", regions=report, duration=duration,
+                          rate_limits=get_rate_limiter_stats(), metrics=get_metrics().since(baseline))
+
+
+def main(regions: Union[List[str], str, None] = ALL_REGIONS,
+         max_workers: int = DEFAULT_MAX_WORKERS, metrics_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Runs every checker across the given regions.
+
+    :param regions: Regions to scan, or "all" for every enabled region
+    :param max_workers: Maximum number of regions scanned at the same time per checker
+    :param metrics_path: File the metrics are written to, as a Prometheus textfile if it ends in ".prom"
+    :return: Aggregated report per checker
+    """
+    if regions is None or regions == ALL_REGIONS:
+        regions = get_enabled_regions()
+    report = {name: scan_regions(checker, regions, max_workers) for name, checker in CHECKERS.items()}
+    if metrics_path:
+        get_metrics().write(metrics_path)
+    return report
+
+
+if __name__ == '__main__':
+    result = main()
+    logger.info(result)
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+from botocore.exceptions import ClientError
+from .engine import DEFAULT_MAX_WORKERS, Check, CheckContext, get_check, run_pipeline
+from .findings import VERDICT_ERROR, FindingSink, NdjsonWriter
+from .helpers import handle_failure, handle_success
+from .metrics import get_metrics
+from .state_store import fingerprint
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Version of the plan file format
+PLAN_VERSION = 1
+
+# Service each remediation action calls, used for the per-service concurrency limits
+ACTION_SERVICES = {
+    "detach_role_policy": "iam",
+    "delete_role_policy": "iam",
+    "modify_db_instance": "rds",
+    "delete_bucket_policy": "s3",
+    "put_bucket_policy": "s3",
+    "put_public_access_block": "s3",
+}
+
+# Services whose resources are named account-wide, so the same action found in several regions is merged
+GLOBAL_SERVICES = frozenset({"iam", "s3"})
+
+# Maximum number of calls in flight per service while a plan is applied; IAM throttles mutations early
+DEFAULT_SERVICE_LIMITS = {"iam": 2, "rds": 8, "s3": 8}
+
+# Attempts per action, and seconds before the first retry, doubled on every further retry
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF = 1.0
+
+# Error codes meaning the action's effect is already in place, e.g. a policy that is no longer attached
+ALREADY_DONE_ERRORS = frozenset({"NoSuchEntity", "NoSuchBucketPolicy"})
+
+# Error codes that retrying cannot fix
+PERMANENT_ERRORS = frozenset({"AccessDenied", "AccessDeniedException", "UnauthorizedOperation", "NoSuchBucket",
+                              "DBInstanceNotFound", "DBInstanceNotFoundFault", "InvalidParameterValue",
+                              "InvalidParameterCombination", "ValidationError", "MalformedPolicy"})
+
+# Outcomes of applied actions recorded in the result log
+RESULT_DONE = "done"
+RESULT_UNCHANGED = "unchanged"
+RESULT_FAILED = "failed"
+
+
+class Plan:
+    """
+    Remediation actions collected by a dry run, to be reviewed and applied later.
+
+    Identical actions are merged into one entry listing every resource that led to it,
+    e.g. a role policy reached through many instances sharing the role. Each entry has a
+    stable ID derived from the action, so a result log can tell which entries are done.
+    """
+
+    def __init__(self, metadata: Optional[Dict[str, Any]] = None) -> None:
+        """
+        :param metadata: Information about the plan, e.g. the regions and checks it covers
+        """
+        self.metadata = dict(metadata or {})
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.merged = 0
+        self._lock = threading.Lock()
+
+    def add(self, check: str, region: Optional[str], resource_id: str, action: Dict[str, Any]) -> str:
+        """
+        Adds an action, merging it with an identical action already planned.
+
+        :param check: Check name the action comes from
+        :param region: AWS region the resource was found in
+        :param resource_id: Identifier of the resource that needs the action
+        :param action: Action returned by the check's evaluate
+        :return: ID of the plan entry
+        """
+        service = ACTION_SERVICES.get(action['action'], check)
+        scope = None if service in GLOBAL_SERVICES else region
+        entry_id = fingerprint({'check': check, 'region': scope, 'action': action})[:16]
+        with self._lock:
+            entry = self.entries.get(entry_id)
+            if entry is None:
+                self.entries[entry_id] = {"id": entry_id, "check": check, "region": region, "service": service,
+                                          "action": action, "resources": [resource_id]}
+            else:
+                self.merged += 1
+                if resource_id not in entry['resources']:
+                    entry['resources'].append(resource_id)
+        return entry_id
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(list(self.entries.values()))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the number of planned actions, in total and per service, and of merged duplicates.
+
+        :return: Dictionary of counts
+        """
+        services: Dict[str, int] = {}
+        for entry in self.entries.values():
+            services[entry['service']] = services.get(entry['service'], 0) + 1
+        return {"actions": len(self.entries), "merged": self.merged, "services": services}
+
+    def save(self, path: str) -> None:
+        """
+        Writes the plan as indented JSON, replacing the file only once it is complete.
+
+        :param path: Path of the plan file
+        """
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump({"version": PLAN_VERSION, "metadata": self.metadata, "actions": list(self.entries.values())},
+                      f, indent=2, default=str)
+            f.write("\n")
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Plan":
+        """
+        Reads a plan file.
+
+        :param path: Path of the plan file
+        :return: Plan
+        :raises ValueError: If the file is not a plan of a supported version.
+        """
+        with open(path, encoding='utf-8') as f:
+            document = json.load(f)
+        if not isinstance(document, dict) or document.get('version') != PLAN_VERSION:
+            raise ValueError(f"{path} is not a version {PLAN_VERSION} plan")
+        plan = cls(document.get('metadata'))
+        for entry in document.get('actions', []):
+            plan.entries[entry['id']] = entry
+        return plan
+
+
+def build_plan(checks: Optional[List[str]] = None, region: Union[str, List[str]] = "us-east-1",
+               credentials: Optional[Dict[str, str]] = None, max_workers: int = DEFAULT_MAX_WORKERS,
+               sink: Optional[FindingSink] = None,
+               options: Optional[Dict[str, Any]] = None) -> Tuple[Plan, Dict[str, Any]]:
+    """
+    Runs checks without remediating and collects the actions they need into a plan.
+
+    Checks of account-wide resources, like S3 buckets, run once, in the first region.
+
+    :param checks: Check names, every built-in check by default
+    :param region: AWS region, or list of regions, to run the checks in
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+    :param max_workers: Number of resource workers per check
+    :param sink: Receives each finding as it is produced, or None
+    :param options: Options of the checks, e.g. {"engine": "account", "remediation": "block"}
+    :return: Plan, and a summary with verdict counts per check
+    """
+    baseline = get_metrics().snapshot()
+    regions = [region] if isinstance(region, str) else list(region)
+    names = list(checks or ("ec2", "rds", "s3"))
+    plan = Plan({"regions": regions, "checks": names, "created_at": time.time()})
+    verdicts: Dict[str, Dict[str, int]] = {}
+    for index, scan_region in enumerate(regions):
+        context = CheckContext(scan_region, credentials, options)
+        for name in names:
+            check = get_check(name)(context)
+            if index and not check.regional:
+                continue
+            counts = verdicts.setdefault(name, {})
+            for finding in run_pipeline(check, max_workers, remediate=False):
+                counts[finding['verdict']] = counts.get(finding['verdict'], 0) + 1
+                for action in finding['actions']:
+                    plan.add(name, scan_region, finding['resource_id'], action)
+                if sink is not None:
+                    sink(finding)
+
+    details = {"verdicts": verdicts, "plan": plan.stats(), "metrics": get_metrics().since(baseline)}
+    message = f"Planned {len(plan)} action/-s"
+    if any(counts.get(VERDICT_ERROR) for counts in verdicts.values()):
+        return plan, handle_failure(message + " with errors; the plan is incomplete", **details)
+    return plan, handle_success(message, **details)
+
+
+def read_results(path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Reads the last recorded result of every action from a result log.
+
+    :param path: Path of the NDJSON result log; a missing file has no results
+    :return: Results by plan entry ID
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run; that action is simply applied again
+                logger.warning(f"Ignoring incomplete line in {path}")
+                continue
+            results[result['id']] = result
+    return results
+
+
+class PlanExecutor:
+    """
+    Applies plan entries on a bounded worker pool, with a concurrency limit per service.
+
+    Every action is retried with exponential backoff unless its error is permanent. Errors
+    meaning the action's effect is already in place count as success, so entries can be
+    applied again safely, e.g. when a failed run is resumed.
+    """
+
+    def __init__(self, credentials: Optional[Dict[str, str]] = None, max_workers: int = DEFAULT_MAX_WORKERS,
+                 service_limits: Optional[Dict[str, int]] = None, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 backoff: float = DEFAULT_BACKOFF, sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+        :param max_workers: Maximum number of actions in flight at the same time
+        :param service_limits: Maximum number of actions in flight per service, DEFAULT_SERVICE_LIMITS if omitted
+        :param max_attempts: Attempts per action
+        :param backoff: Seconds before the first retry
+        :param sleep: Function waiting for a number of seconds
+        """
+        self.credentials = credentials
+        self.max_workers = max(1, max_workers)
+        limits = {**DEFAULT_SERVICE_LIMITS, **(service_limits or {})}
+        self._semaphores = {service: threading.BoundedSemaphore(max(1, limit)) for service, limit in limits.items()}
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.sleep = sleep
+        self._checks: Dict[Tuple[str, Optional[str]], Check] = {}
+        self._lock = threading.Lock()
+
+    def _check(self, name: str, region: Optional[str]) -> Check:
+        """
+        Returns the check instance of a check and region, sharing its clients and caches across actions.
+
+        :param name: Check name
+        :param region: AWS region
+        :return: Check instance
+        """
+        with self._lock:
+            key = (name, region)
+            if key not in self._checks:
+                self._checks[key] = get_check(name)(CheckContext(region or "us-east-1", self.credentials))
+            return self._checks[key]
+
+    def _semaphore(self, service: str) -> threading.BoundedSemaphore:
+        """
+        Returns the concurrency limit of a service, creating one with the default worker count if needed.
+
+        :param service: Service name
+        :return: Semaphore
+        """
+        with self._lock:
+            return self._semaphores.setdefault(service, threading.BoundedSemaphore(self.max_workers))
+
+    def apply_entry(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Performs one plan entry, retrying transient failures.
+
+        :param entry: Plan entry
+        :return: Result with the entry ID, outcome, number of attempts and, on failure, the error
+        """
+        start = time.perf_counter()
+        check = self._check(entry['check'], entry.get('region'))
+        result = {"id": entry['id'], "check": entry['check'], "action": entry['action']['action']}
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                with self._semaphore(entry['service']):
+                    # Checks remediate from the action itself; the resource is only passed for reference
+                    changed = check.remediate(entry['resources'][0], entry['action'])
+                result["status"] = RESULT_DONE if changed else RESULT_UNCHANGED
+                break
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code', '')
+                if code in ALREADY_DONE_ERRORS:
+                    result["status"] = RESULT_UNCHANGED
+                    break
+                error, retryable = e, code not in PERMANENT_ERRORS
+            except Exception as e:
+                error, retryable = e, True
+            if not retryable or attempt == self.max_attempts:
+                logger.error(f"Failed to apply {entry['action']['action']} ({entry['id']}): {error}")
+                result.update(status=RESULT_FAILED, error=str(error))
+                break
+            self.sleep(self.backoff * 2 ** (attempt - 1))
+        result["attempts"] = attempt
+        result["duration"] = round(time.perf_counter() - start, 6)
+        return result
+
+    def apply(self, entries: List[Dict[str, Any]], sink: Optional[FindingSink] = None) -> List[Dict[str, Any]]:
+        """
+        Performs plan entries concurrently.
+
+        :param entries: Plan entries
+        :param sink: Receives each result as soon as its action has finished, or None
+        :return: Results, one per entry, in the order the actions finished
+        """
+        results = []
+        if not entries:
+            return results
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(entries))) as executor:
+            futures = [executor.submit(self.apply_entry, entry) for entry in entries]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if sink is not None:
+                    sink(result)
+        return results
+
+
+def apply_plan(plan: Plan, log_path: Optional[str] = None, executor: Optional[PlanExecutor] = None) -> Dict[str, Any]:
+    """
+    Applies a plan, skipping the entries a previous run already completed according to the result log.
+
+    :param plan: Plan to apply
+    :param log_path: NDJSON result log, appended to with one line per applied action; no log if omitted
+    :param executor: Executor performing the actions, one with default limits if omitted
+    :return: Counts of outcomes, with the IDs of failed entries
+    """
+    start = time.perf_counter()
+    baseline = get_metrics().snapshot()
+    executor = executor or PlanExecutor()
+    previous = read_results(log_path) if log_path else {}
+    entries = [entry for entry in plan
+               if previous.get(entry['id'], {}).get('status') not in (RESULT_DONE, RESULT_UNCHANGED)]
+
+    if log_path:
+        with open(log_path, 'a', encoding='utf-8') as stream:
+            # Every result is written out at once, so an interrupted run can be resumed from the log
+            results = executor.apply(entries, NdjsonWriter(stream, buffer_size=1))
+    else:
+        results = executor.apply(entries)
+
+    outcomes: Dict[str, int] = {}
+    for result in results:
+        outcomes[result['status']] = outcomes.get(result['status'], 0) + 1
+    failed = [result['id'] for result in results if result['status'] == RESULT_FAILED]
+    details = {"outcomes": outcomes, "skipped": len(plan) - len(entries), "metrics": get_metrics().since(baseline),
+               "duration": round(time.perf_counter() - start, 3)}
+    if failed:
+        return handle_failure(f"Failed to apply {len(failed)} of {len(entries)} action/-s", failed=failed, **details)
+    return handle_success(f"Applied {len(entries)} action/-s", **details)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+from .helpers import DEFAULT_CACHE_SIZE
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Condition keys that limit a statement to known networks, accounts, organizations or principals
+RESTRICTIVE_CONDITION_KEYS = frozenset({
+    'aws:sourceip', 'aws:sourcevpc', 'aws:sourcevpce', 'aws:sourceaccount', 'aws:sourcearn',
+    'aws:sourceowner', 'aws:sourceorgid', 'aws:sourceorgpaths', 'aws:principalorgid',
+    'aws:principalorgpaths', 'aws:principalaccount', 'aws:principalarn', 'aws:userid',
+    'aws:username', 's3:dataaccesspointaccount', 's3:dataaccesspointarn',
+})
+
+# Condition values that match every request and therefore restrict nothing
+WILDCARD_CONDITION_VALUES = frozenset({'*', '0.0.0.0/0', '::/0'})
+
+# Statement fields that decide whether a statement grants public access
+VERDICT_FIELDS = ('Effect', 'Principal', 'NotPrincipal', 'Condition')
+
+
+def get_statements(document: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Returns the statements of a policy document, which may hold a single statement or a list.
+
+    :param document: Parsed policy document
+    :return: List of statements
+    """
+    statements = document.get('Statement', [])
+    return [statements] if isinstance(statements, dict) else list(statements)
+
+
+def _values(value: Any) -> List[Any]:
+    """
+    Returns a policy element that may be a single value or a list as a list.
+
+    :param value: Policy element
+    :return: List of values
+    """
+    return list(value) if isinstance(value, list) else [value]
+
+
+def is_public_principal(principal: Any) -> bool:
+    """
+    Checks whether a statement principal matches anyone, e.g. "*" or {"AWS": "*"}.
+
+    :param principal: Principal element of a statement
+    :return: True if the principal is anonymous
+    """
+    if isinstance(principal, dict):
+        return any('*' in _values(value) for value in principal.values())
+    return principal == '*'
+
+
+def is_restrictive_condition(condition: Dict[str, Any]) -> bool:
+    """
+    Checks whether a statement condition limits who can use the statement.
+
+    Only positive operators on the keys in RESTRICTIVE_CONDITION_KEYS count. Negated
+    operators such as StringNotEquals and IfExists operators still match requests from
+    anywhere, and so do wildcard values.
+
+    :param condition: Condition element of a statement
+    :return: True if the condition restricts the statement to known callers
+    """
+    for operator, clauses in condition.items():
+        if 'Not' in operator or operator.endswith('IfExists') or not isinstance(clauses, dict):
+            continue
+        for key, value in clauses.items():
+            if key.lower() not in RESTRICTIVE_CONDITION_KEYS:
+                continue
+            if not any(str(item) in WILDCARD_CONDITION_VALUES for item in _values(value)):
+                return True
+    return False
+
+
+def is_public_statement(statement: Dict[str, Any]) -> bool:
+    """
+    Checks whether a policy statement allows anonymous access.
+
+    :param statement: Policy statement
+    :return: True if the statement allows any principal without a restrictive condition
+    """
+    if statement.get('Effect') != 'Allow':
+        return False
+    # Allow with NotPrincipal grants access to everyone except the listed principals
+    if 'NotPrincipal' not in statement and not is_public_principal(statement.get('Principal')):
+        return False
+    return not is_restrictive_condition(statement.get('Condition') or {})
+
+
+def policy_hash(document: Dict[str, Any]) -> str:
+    """
+    Computes a hash of the parts of a policy that decide its verdict.
+
+    Resources and actions are left out, so policies provisioned from the same template
+    for different buckets hash the same.
+
+    :param document: Parsed policy document
+    :return: Hex digest of the normalized policy
+    """
+    normalized = [{field: statement.get(field) for field in VERDICT_FIELDS} for statement in get_statements(document)]
+    payload = json.dumps(normalized, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def remove_statements(document: Dict[str, Any], indexes: Tuple[int, ...]) -> Optional[Dict[str, Any]]:
+    """
+    Returns a copy of a policy document without the statements at the given positions.
+
+    :param document: Parsed policy document
+    :param indexes: Positions of the statements to remove
+    :return: Policy document, or None if no statement is left
+    """
+    remaining = [statement for index, statement in enumerate(get_statements(document)) if index not in indexes]
+    if not remaining:
+        return None
+    return {**document, 'Statement': remaining}
+
+
+class PolicyEvaluator:
+    """
+    Finds the public statements of bucket policies, memoizing verdicts by normalized policy hash.
+
+    Buckets provisioned from the same template share a verdict, so each distinct policy is
+    only evaluated once per run. Entries are evicted least recently used first. Safe to
+    share between threads.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE) -> None:
+        """
+        :param max_size: Maximum number of verdicts kept
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._verdicts: "OrderedDict[str, Tuple[int, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def public_statements(self, policy: Union[str, Dict[str, Any]]) -> Tuple[int, ...]:
+        """
+        Returns the positions of the statements that allow anonymous access.
+
+        :param policy: Policy document, as JSON text or parsed
+        :return: Positions of the public statements, empty if the policy is not public
+        :raises ValueError: If the policy text is not valid JSON.
+        """
+        document = json.loads(policy) if isinstance(policy, str) else policy
+        key = policy_hash(document)
+        with self._lock:
+            if key in self._verdicts:
+                self.hits += 1
+                self._verdicts.move_to_end(key)
+                return self._verdicts[key]
+            self.misses += 1
+
+        verdict = tuple(index for index, statement in enumerate(get_statements(document))
+                        if is_public_statement(statement))
+        with self._lock:
+            self._verdicts[key] = verdict
+            if len(self._verdicts) > self.max_size:
+                self._verdicts.popitem(last=False)
+        return verdict
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns verdict cache hit and miss counts.
+
+        :return: Dictionary with hit and miss counts
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
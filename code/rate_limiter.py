@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Starting requests per second for each service; IAM limits are low and account-wide
+DEFAULT_RATES: Dict[str, float] = {
+    'iam': 10.0,
+    'sts': 10.0,
+    'ec2': 50.0,
+    'rds': 20.0,
+    's3': 200.0,
+}
+
+# Starting requests per second for services without an entry in DEFAULT_RATES
+FALLBACK_RATE = 20.0
+
+# Lowest rate a limiter backs off to after repeated throttling
+MIN_RATE = 0.5
+
+# Error codes AWS services return when a caller is being throttled
+THROTTLING_ERROR_CODES = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'SlowDown',
+    'RequestThrottled',
+    'PriorRequestNotComplete',
+])
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket with adaptive rate.
+
+    The rate is halved on every throttling response and grows back additively after
+    successful calls, up to the rate the limiter started with.
+    """
+
+    def __init__(self, rate: float, min_rate: float = MIN_RATE,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        :param rate: Maximum requests per second
+        :param min_rate: Lowest rate the limiter backs off to
+        :param clock: Monotonic clock returning seconds
+        :param sleep: Function used to wait for a token
+        """
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self._floor = min_rate
+        self.calls = 0
+        self.throttles = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = rate
+        self._last = clock()
+        self._started = self._last
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Takes one token, waiting until it is available.
+
+        :return: Seconds spent waiting
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            self.calls += 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            self._sleep(wait)
+        return wait
+
+    def set_rate(self, rate: float) -> None:
+        """
+        Changes the maximum rate, e.g. to raise a service's limit, and restarts the adaptive rate from it.
+
+        :param rate: Maximum requests per second
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self.max_rate = rate
+            self.min_rate = min(self._floor, rate)
+            self.rate = rate
+
+    def on_throttle(self) -> None:
+        """
+        Halves the rate after a throttling response.
+        """
+        with self._lock:
+            self.throttles += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+        logger.warning(f"Throttled, lowering rate to {self.rate:.2f} req/s")
+
+    def on_success(self) -> None:
+        """
+        Raises the rate slightly after a successful call.
+        """
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + 0.1 * self.min_rate + 0.01 * self.rate)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns call counts, the current rate and the achieved throughput.
+
+        :return: Dictionary with limiter statistics
+        """
+        with self._lock:
+            elapsed = self._clock() - self._started
+            return {
+                "calls": self.calls,
+                "throttles": self.throttles,
+                "rate": round(self.rate, 3),
+                "throughput": round(self.calls / elapsed, 3) if elapsed > 0 else 0.0,
+            }
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(service: str, account: str = "default") -> RateLimiter:
+    """
+    Returns the shared rate limiter for a service and account, creating it on first use.
+
+    :param service: AWS service name
+    :param account: AWS account ID, "default" for the default credential chain
+    :return: Rate limiter
+    """
+    key = (service, account)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(DEFAULT_RATES.get(service, FALLBACK_RATE))
+            _limiters[key] = limiter
+        return limiter
+
+
+def set_rate(service: str, rate: float, account: str = "default") -> None:
+    """
+    Changes the rate of the shared rate limiter for a service and account.
+
+    The limiter is updated in place, so clients already hooked up to it use the new rate too.
+
+    :param service: AWS service name
+    :param rate: Maximum requests per second
+    :param account: AWS account ID, "default" for the default credential chain
+    """
+    get_rate_limiter(service, account).set_rate(rate)
+
+
+def get_rate_limiter_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Returns statistics for every rate limiter in use.
+
+    :return: Statistics keyed by "service/account"
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {f"{service}/{account}": limiter.stats() for (service, account), limiter in limiters.items()}
+
+
+def is_throttling_response(response: Optional[Tuple[Any, Dict[str, Any]]]) -> bool:
+    """
+    Checks whether a botocore response is a throttling error.
+
+    :param response: Tuple of HTTP response and parsed response, as passed to botocore event handlers
+    :return: True if the response is a throttling error, False otherwise
+    """
+    if not response:
+        return False
+    parsed = response[1] or {}
+    return parsed.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+def register_rate_limiter(client, account: str = "default") -> None:
+    """
+    Hooks a client up to the shared rate limiter of its service and account.
+
+    Every attempt, including retries, takes a token; throttling responses lower the rate
+    and successful calls raise it again.
+
+    :param client: boto3 client
+    :param account: AWS account ID, "default" for the default credential chain
+    """
+    service = client.meta.service_model.service_name
+    limiter = get_rate_limiter(service, account)
+    event_name = client.meta.service_model.service_id.hyphenize()
+
+    def before_send(**kwargs: Any) -> None:
+        limiter.acquire()
+
+    def needs_retry(response=None, **kwargs: Any) -> None:
+        if is_throttling_response(response):
+            limiter.on_throttle()
+
+    def after_call(parsed=None, **kwargs: Any) -> None:
+        if not (parsed or {}).get('Error'):
+            limiter.on_success()
+
+    client.meta.events.register(f'before-send.{event_name}', before_send)
+    client.meta.events.register(f'needs-retry.{event_name}', needs_retry)
+    client.meta.events.register(f'after-call.{event_name}', after_call)
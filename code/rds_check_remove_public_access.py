@@ -1,42 +1,263 @@
 # -*- coding: utf-8 -*-
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import boto3
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError
-from .helpers import initialize_rds_client, describe_db_instances, check_public_access, modify_db_instance, handle_error, handle_success
+from .helpers import (DbClusterRecord, DbInstanceRecord, initialize_rds_client, describe_db_instance_records,
+                      describe_db_instance_records_by_id, describe_db_cluster_records, check_public_access,
+                      modify_db_instance, handle_error, handle_failure, handle_success)
+from .findings import VERDICT_ERROR, VERDICT_NON_COMPLIANT, VERDICT_SKIPPED, FindingSink, account_sink, make_finding
+from .metrics import get_metrics
+from .state_store import VERDICT_COMPLIANT, VERDICT_REMEDIATED, StateStore, fingerprint
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def check_remove_public_access(region: str = "us-east-1") -> str:
+# Upper bound on the number of ModifyDBInstance calls in flight at the same time
+DEFAULT_MAX_WORKERS = 8
+
+# Seconds between two polls of the instances whose modification is still pending
+DEFAULT_POLL_INTERVAL = 15.0
+
+
+class ModificationTracker:
+    """
+    Follows submitted modifications until the instances are no longer publicly accessible.
+
+    All pending instances are polled together, up to 100 per DescribeDBInstances call,
+    instead of running one waiter per instance.
+    """
+
+    def __init__(self, rds_client: boto3.client, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep) -> None:
+        """
+        :param rds_client: Initialized RDS client
+        :param clock: Function returning the current time in seconds
+        :param sleep: Function waiting for a number of seconds
+        """
+        self.rds_client = rds_client
+        self.clock = clock
+        self.sleep = sleep
+        self.pending: Dict[str, float] = {}
+        self.time_to_private: Dict[str, float] = {}
+        self.polls = 0
+
+    def add(self, identifier: str, submitted_at: Optional[float] = None) -> None:
+        """
+        Starts tracking an instance whose modification was submitted.
+
+        :param identifier: DB instance identifier
+        :param submitted_at: Time the modification was submitted, now if omitted
+        """
+        self.pending[identifier] = self.clock() if submitted_at is None else submitted_at
+
+    def poll(self) -> List[str]:
+        """
+        Describes the pending instances once and stops tracking those that became private.
+
+        :return: Identifiers of the instances that became private
+        """
+        if not self.pending:
+            return []
+        self.polls += 1
+        now = self.clock()
+        records = {record.identifier: record
+                   for record in describe_db_instance_records_by_id(self.rds_client, list(self.pending))}
+        done = []
+        for identifier in list(self.pending):
+            record = records.get(identifier)
+            if record is None:
+                logger.warning(f"RDS instance {identifier} disappeared while its modification was pending")
+                del self.pending[identifier]
+            elif record.private:
+                self.time_to_private[identifier] = round(now - self.pending.pop(identifier), 3)
+                done.append(identifier)
+        return done
+
+    def wait(self, timeout: float = 0.0, interval: float = DEFAULT_POLL_INTERVAL) -> List[str]:
+        """
+        Polls until every instance is private or the timeout has passed; always polls at least once.
+
+        :param timeout: Seconds to keep polling
+        :param interval: Seconds between polls
+        :return: Identifiers of the instances still pending
+        """
+        deadline = self.clock() + timeout
+        self.poll()
+        while self.pending and self.clock() + interval <= deadline:
+            self.sleep(interval)
+            self.poll()
+        return sorted(self.pending)
+
+
+def submit_modifications(rds_client: boto3.client, identifiers: List[str], max_workers: int = DEFAULT_MAX_WORKERS,
+                         clock: Callable[[], float] = time.monotonic) -> Dict[str, Tuple[float, Optional[Exception]]]:
     """
-    Check all RDS instances for public accessibility and disable it if found.
+    Disables public access on several instances concurrently.
 
+    :param rds_client: Initialized RDS client
+    :param identifiers: DB instance identifiers
+    :param max_workers: Maximum number of calls in flight at the same time
+    :param clock: Function returning the current time in seconds
+    :return: Submission time and error, None on success, by identifier
+    """
+    def submit(identifier: str) -> Tuple[float, Optional[Exception]]:
+        submitted_at = clock()
+        try:
+            modify_db_instance(rds_client, identifier)
+        except Exception as e:
+            logger.error(f"Error disabling public access for RDS instance {identifier}: {e}")
+            return submitted_at, e
+        return submitted_at, None
+
+    if not identifiers:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(identifiers)))) as executor:
+        return dict(zip(identifiers, executor.map(submit, identifiers)))
+
+
+def db_instance_actions(instance: DbInstanceRecord) -> List[Dict[str, Any]]:
+    """
+    Decides whether an RDS instance needs its public access disabled.
+
+    :param instance: DB instance record
+    :return: Modify action, or none if the instance is not publicly accessible
+    """
+    if not check_public_access(instance):
+        return []
+    return [{"action": "modify_db_instance", "db_instance_identifier": instance.identifier}]
+
+
+def public_cluster_findings(region: str, clusters: List[DbClusterRecord]) -> List[Dict[str, Any]]:
+    """
+    Reports the publicly accessible Multi-AZ DB clusters.
+
+    ModifyDBCluster cannot change the public access of a Multi-AZ DB cluster, so it is only reported.
+
+    :param region: AWS region where the clusters are located
+    :param clusters: DB cluster records; Aurora clusters carry no setting of their own and are left out
+    :return: One non-compliant finding per public cluster
+    """
+    return [make_finding('rds', region, cluster.identifier, VERDICT_NON_COMPLIANT,
+                         reason="Multi-AZ DB cluster is publicly accessible")
+            for cluster in clusters if cluster.publicly_accessible]
+
+
+def check_remove_public_access(region: str = "us-east-1", state_store: Optional[StateStore] = None,
+                               credentials: Optional[Dict[str, str]] = None, sink: Optional[FindingSink] = None,
+                               max_workers: int = DEFAULT_MAX_WORKERS, wait: float = 0.0,
+                               poll_interval: float = DEFAULT_POLL_INTERVAL) -> str:
+    """
+    Check all RDS instances, including Aurora cluster members, for public accessibility and disable it if found.
+
+    Modifications are submitted concurrently once discovery has finished, then confirmed by
+    polling all pending instances together.
 
     :param region: AWS region where the RDS instances are located
+    :param state_store: Store of previous verdicts; unchanged instances are skipped
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+    :param sink: Receives one finding per RDS instance as it is processed
+    :param max_workers: Maximum number of modifications submitted at the same time
+    :param wait: Seconds to wait for the modifications to take effect; they are polled once if 0
+    :param poll_interval: Seconds between polls of the pending modifications
     :return: Success or error message
     :raises NoCredentialsError: If AWS credentials are not found.
     :raises PartialCredentialsError: If incomplete AWS credentials are provided.
     """
+    baseline = get_metrics().snapshot()
     try:
         # Initialize RDS client
-        rds_client = initialize_rds_client(region)
+        rds_client = initialize_rds_client(region, credentials)
+        # DB instance identifiers are only unique within an account and region
+        id_prefix = f"{credentials['AccountId']}/{region}" if credentials and credentials.get('AccountId') else region
+        sink = account_sink(sink, credentials)
 
-        # Describe RDS instances
-        response = describe_db_instances(rds_client)
+        # Aurora clusters, to report the cluster of each member; Multi-AZ DB clusters carry their own setting
+        clusters = list(describe_db_cluster_records(rds_client))
+        member_clusters = {member: cluster.identifier for cluster in clusters for member in cluster.members}
+
+        public: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+        skipped = 0
+        # Describe RDS instances, one page at a time
+        for instance in describe_db_instance_records(rds_client):
+            start = time.perf_counter()
+            instance_id = instance.identifier
+            resource_id = f"{id_prefix}/{instance_id}"
+            # Skip instances whose public access is unchanged since they were last checked
+            resource_fingerprint = fingerprint({'public': check_public_access(instance)})
+            if state_store is not None and state_store.is_unchanged('rds', resource_id, resource_fingerprint):
+                skipped += 1
+                if sink is not None:
+                    sink(make_finding('rds', region, instance_id, VERDICT_SKIPPED, reason="Unchanged since last check",
+                                      duration=time.perf_counter() - start))
+                continue
 
-        rds_instances = 0
-        for instance in response['DBInstances']:
             # Check if RDS instance has public access
-            if check_public_access(instance):
-                instance_id = instance['DBInstanceIdentifier']
-                # Modify RDS instance to disable public access
-                modify_db_instance(rds_client, instance_id)
+            actions = db_instance_actions(instance)
+            if actions:
+                public[instance_id] = start, actions
+                continue
+            if state_store is not None:
+                state_store.record('rds', resource_id, resource_fingerprint, VERDICT_COMPLIANT)
+            if sink is not None:
+                sink(make_finding('rds', region, instance_id, VERDICT_COMPLIANT, reason="Not publicly accessible",
+                                  duration=time.perf_counter() - start))
+
+        # Modify the public RDS instances concurrently, then confirm the changes took effect
+        submitted = submit_modifications(rds_client, list(public), max_workers)
+        tracker = ModificationTracker(rds_client)
+        for instance_id, (submitted_at, error) in submitted.items():
+            if error is None:
+                tracker.add(instance_id, submitted_at)
+        pending = tracker.wait(wait, poll_interval) if tracker.pending else []
+
+        rds_instances = 0
+        failed = []
+        for instance_id, (_, error) in submitted.items():
+            start, actions = public[instance_id]
+            cluster = member_clusters.get(instance_id)
+            suffix = f" (member of cluster {cluster})" if cluster else ""
+            duration = time.perf_counter() - start
+            if error is not None:
+                failed.append(instance_id)
+                finding = make_finding('rds', region, instance_id, VERDICT_ERROR, actions, status="Error",
+                                       reason=f"Unexpected error: {error}", duration=duration)
+            else:
                 rds_instances += 1
-        if rds_instances > 0: 
-            return handle_success(f"Disabled public access for {rds_instances} RDS instance/-s") 
+                if state_store is not None:
+                    state_store.record('rds', f"{id_prefix}/{instance_id}", fingerprint({'public': False}),
+                                       VERDICT_REMEDIATED)
+                reason = "Modification pending" if instance_id in pending else "Disabled public access"
+                finding = make_finding('rds', region, instance_id, VERDICT_REMEDIATED, actions,
+                                       reason=reason + suffix, duration=duration)
+                if instance_id in tracker.time_to_private:
+                    finding["time_to_private"] = tracker.time_to_private[instance_id]
+            if sink is not None:
+                sink(finding)
+
+        cluster_findings = public_cluster_findings(region, clusters)
+        public_clusters = [finding['resource_id'] for finding in cluster_findings]
+        if sink is not None:
+            for finding in cluster_findings:
+                sink(finding)
+
+        details = {"metrics": get_metrics().since(baseline), "time_to_private": tracker.time_to_private,
+                   "pending": pending, "polls": tracker.polls}
+        if public_clusters:
+            details["public_clusters"] = public_clusters
+        if state_store is not None:
+            state_store.commit()
+            details["skipped"] = skipped
+        if failed:
+            return handle_failure(f"Failed to disable public access for {len(failed)} RDS instance/-s: "
+                                  f"{', '.join(failed)}", **details)
+        if rds_instances > 0:
+            return handle_success(f"Disabled public access for {rds_instances} RDS instance/-s", **details)
         else:
-            return handle_success("No public access for RDS instance")
+            return handle_success("No public access for RDS instance", **details)
 
     except NoCredentialsError as e:
         return handle_error(e, "AWS credentials not found.")
@@ -1,54 +1,334 @@
 # -*- coding: utf-8 -*-
+import json
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 import boto3
 from botocore.exceptions import NoCredentialsError, ClientError
-from .helpers import initialize_s3_client, get_bucket_policy, delete_bucket_policy, handle_error, handle_success
+from .helpers import (S3ClientRouter, get_client, initialize_s3_client, list_buckets, get_bucket_policy,
+                      delete_bucket_policy, put_bucket_policy, get_account_id, get_account_public_access_block,
+                      get_bucket_public_access_block, get_bucket_policy_status, put_bucket_public_access_block,
+                      restricts_public_buckets, handle_error, handle_success)
+from .findings import VERDICT_ERROR, VERDICT_SKIPPED, FindingSink, account_sink, make_finding
+from .metrics import get_metrics
+from .policy_evaluator import PolicyEvaluator, remove_statements
+from .state_store import VERDICT_COMPLIANT, VERDICT_REMEDIATED, StateStore, fingerprint
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def check_remove_public_access(s3_client: boto3.client, bucket_name: str) -> str:
+# Number of buckets checked at the same time
+DEFAULT_MAX_WORKERS = 16
+
+# Remediations for public buckets: remove the public policy statements, or enable the bucket's Public Access Block
+REMEDIATION_POLICY = "policy"
+REMEDIATION_BLOCK = "block"
+
+# Public Access Block settings, all of which a bucket configuration must carry
+PUBLIC_ACCESS_BLOCK_SETTINGS = ('BlockPublicAcls', 'IgnorePublicAcls', 'BlockPublicPolicy', 'RestrictPublicBuckets')
+
+def policy_actions(evaluator: PolicyEvaluator, bucket_name: str, policy: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Decides how a bucket policy has to change so that it no longer allows public access.
+
+    :param evaluator: Policy evaluator shared across buckets of the same run
+    :param bucket_name: Name of the S3 bucket
+    :param policy: JSON policy document, or None if the bucket has none
+    :return: Action rewriting the policy without its public statements, or deleting it if every
+             statement is public; none if the policy does not allow public access
+    """
+    if policy is None:
+        return []
+    document = json.loads(policy)
+    public_statements = evaluator.public_statements(document)
+    if not public_statements:
+        return []
+    remaining = remove_statements(document, public_statements)
+    if remaining is None:
+        return [{"action": "delete_bucket_policy", "bucket": bucket_name}]
+    return [{"action": "put_bucket_policy", "bucket": bucket_name, "policy": json.dumps(remaining),
+             "removed_statements": len(public_statements)}]
+
+
+def public_access_block_actions(s3_client: boto3.client, bucket_name: str
+                                ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
     """
-    Check if an S3 bucket has public access, and if so, remove it.
+    Decides whether a bucket S3 considers public needs its Public Access Block enabled.
+
+    The bucket's existing Public Access Block is only read for public buckets, to keep its
+    other settings and to leave out buckets it already restricts.
 
     :param s3_client: Initialized S3 client
     :param bucket_name: Name of the S3 bucket
+    :return: Attributes whose change makes the bucket be checked again, and the action
+             enabling the Public Access Block, none if the bucket needs no change
+    """
+    try:
+        is_public = get_bucket_policy_status(s3_client, bucket_name)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchBucketPolicy':
+            raise
+        is_public = False
+    if not is_public:
+        return {'public': False}, []
+
+    # A Public Access Block removed or loosened since the last check changes the attributes
+    configuration = {setting: bool(value) for setting, value in
+                     get_bucket_public_access_block(s3_client, bucket_name).items()}
+    attributes = {'public': True, 'block': configuration}
+    if restricts_public_buckets(configuration):
+        return attributes, []
+
+    # Block public policies while keeping the bucket's ACL settings
+    configuration = {setting: configuration.get(setting, False) for setting in PUBLIC_ACCESS_BLOCK_SETTINGS}
+    configuration.update(BlockPublicPolicy=True, RestrictPublicBuckets=True)
+    return attributes, [{"action": "put_public_access_block", "bucket": bucket_name, "configuration": configuration}]
+
+
+def remediate_bucket(s3_client: boto3.client, action: Dict[str, Any]) -> None:
+    """
+    Performs an action returned by policy_actions or public_access_block_actions.
+
+    :param s3_client: S3 client in the bucket's region
+    :param action: Action to perform
+    """
+    if action['action'] == "put_bucket_policy":
+        put_bucket_policy(s3_client, action['bucket'], action['policy'])
+    elif action['action'] == "delete_bucket_policy":
+        delete_bucket_policy(s3_client, action['bucket'])
+    else:
+        put_bucket_public_access_block(s3_client, action['bucket'], action['configuration'])
+
+
+def check_remove_public_access(s3_client: boto3.client, bucket_name: str,
+                               state_store: Optional[StateStore] = None,
+                               evaluator: Optional[PolicyEvaluator] = None) -> str:
+    """
+    Check if an S3 bucket policy allows public access, and if so, remove the public statements.
+
+    The policy is rewritten without its public statements, or deleted if every statement is public.
+
+    :param s3_client: Initialized S3 client
+    :param bucket_name: Name of the S3 bucket
+    :param state_store: Store of previous verdicts; buckets with an unchanged policy are skipped
+    :param evaluator: Policy evaluator shared across buckets of the same run
     :return: Result message
     """
+    if evaluator is None:
+        evaluator = PolicyEvaluator()
 
     # Check bucket policy
     try:
-        bucket_policy = get_bucket_policy(s3_client, bucket_name)
-        if bucket_policy:
-            # Remove bucket policy
-            delete_bucket_policy(s3_client, bucket_name)
-            return handle_success(f"Bucket {bucket_name} has a bucket policy. Removed a policy.")
+        policy = get_bucket_policy(s3_client, bucket_name).get('Policy')
+        resource_fingerprint = fingerprint({'policy': policy})
+        if state_store is not None and state_store.is_unchanged('s3', bucket_name, resource_fingerprint):
+            return handle_success(f"Bucket {bucket_name} policy unchanged since last check", skipped=True)
+
+        actions = policy_actions(evaluator, bucket_name, policy)
+        if not actions:
+            if state_store is not None:
+                state_store.record('s3', bucket_name, resource_fingerprint, VERDICT_COMPLIANT)
+            return handle_success(f"Bucket {bucket_name} policy does not allow public access")
+
+        action = actions[0]
+        remediate_bucket(s3_client, action)
+        if action['action'] == "delete_bucket_policy":
+            message = f"Bucket {bucket_name} has a public bucket policy. Removed a policy."
+        else:
+            message = (f"Bucket {bucket_name} has a public bucket policy. "
+                       f"Removed {action['removed_statements']} public statement/-s.")
+        if state_store is not None:
+            state_store.record('s3', bucket_name, fingerprint({'policy': action.get('policy')}), VERDICT_REMEDIATED)
+        return handle_success(message, actions=actions)
     except ClientError as e:
         if e.response['Error']['Code'] == 'NoSuchBucketPolicy':
+            if state_store is not None:
+                state_store.record('s3', bucket_name, fingerprint({'policy': None}), VERDICT_COMPLIANT)
             return handle_success(f"No bucket policy found for {bucket_name}") 
         else:
-            return handle_error(f"Error checking bucket policy: {e}") 
+            return handle_error(e, "Error checking bucket policy: ") 
+    except ValueError as e:
+        return handle_error(e, "Error parsing bucket policy: ")
+
+
+def check_block_public_access(s3_client: boto3.client, bucket_name: str,
+                              state_store: Optional[StateStore] = None) -> Dict[str, Any]:
+    """
+    Check if S3 considers a bucket policy public, and if so, enable the bucket's Public Access Block.
+
+    The policy itself is neither fetched nor changed. The bucket's existing Public Access Block
+    is only read for public buckets, to keep its other settings and to skip buckets it already restricts.
+
+    :param s3_client: Initialized S3 client
+    :param bucket_name: Name of the S3 bucket
+    :param state_store: Store of previous verdicts; buckets with an unchanged policy status and, for
+        public buckets, an unchanged Public Access Block are skipped
+    :return: Result message, with the PutBucketPublicAccessBlock call a restricting Public Access Block
+             made unnecessary; the GetPublicAccessBlock call that found it is not counted as avoided
+    """
+    try:
+        attributes, actions = public_access_block_actions(s3_client, bucket_name)
+        resource_fingerprint = fingerprint(attributes)
+        if state_store is not None and state_store.is_unchanged('s3', bucket_name, resource_fingerprint):
+            return handle_success(f"Bucket {bucket_name} policy status unchanged since last check", skipped=True)
+        if not actions:
+            if state_store is not None:
+                state_store.record('s3', bucket_name, resource_fingerprint, VERDICT_COMPLIANT)
+            if not attributes['public']:
+                return handle_success(f"Bucket {bucket_name} policy does not allow public access")
+            # Only the PutBucketPublicAccessBlock is skipped; the GetPublicAccessBlock that found the block was made
+            return handle_success(f"Bucket {bucket_name} Public Access Block already restricts its public policy",
+                                  avoided_calls=1)
+
+        remediate_bucket(s3_client, actions[0])
+        if state_store is not None:
+            state_store.record('s3', bucket_name, fingerprint({'public': True, 'block': actions[0]['configuration']}),
+                               VERDICT_REMEDIATED)
+        return handle_success(f"Bucket {bucket_name} has a public bucket policy. Enabled Public Access Block.",
+                              actions=actions)
+    except ClientError as e:
+        return handle_error(e, "Error checking bucket policy status: ")
+
+
+def check_bucket(router: S3ClientRouter, bucket_name: str, state_store: Optional[StateStore] = None,
+                 evaluator: Optional[PolicyEvaluator] = None, remediation: str = REMEDIATION_POLICY) -> Dict[str, Any]:
+    """
+    Check a single S3 bucket using a client in the bucket's home region.
+
+    :param router: Router returning an S3 client for the bucket's region
+    :param bucket_name: Name of the S3 bucket
+    :param state_store: Store of previous verdicts; buckets with an unchanged policy are skipped
+    :param evaluator: Policy evaluator shared across buckets of the same run
+    :param remediation: REMEDIATION_POLICY to remove public statements, REMEDIATION_BLOCK to enable Public Access Block
+    :return: Structured result for the bucket, with its verdict and the actions taken
+    """
+    start = time.perf_counter()
+    region = None
+    try:
+        region = router.get_bucket_region(bucket_name)
+        if remediation == REMEDIATION_BLOCK:
+            result = check_block_public_access(router.get_client(bucket_name), bucket_name, state_store)
+        else:
+            result = check_remove_public_access(router.get_client(bucket_name), bucket_name, state_store, evaluator)
+    except ClientError as e:
+        result = handle_error(e, "Error locating bucket: ")
+    verdict = VERDICT_REMEDIATED if result.get('actions') else VERDICT_COMPLIANT
+    if result['status'] != "Success":
+        verdict = VERDICT_ERROR
+    elif result.get('skipped'):
+        verdict = VERDICT_SKIPPED
+    return {
+        "bucket": bucket_name,
+        "region": region,
+        "status": result['status'],
+        "reason": result['reason'],
+        "verdict": verdict,
+        "actions": result.get('actions', []),
+        "skipped": result.get('skipped', False),
+        "avoided_calls": result.get('avoided_calls', 0),
+        "duration": round(time.perf_counter() - start, 3),
+    }
+
 
+def get_account_block(region: str, credentials: Optional[Dict[str, str]] = None) -> Dict[str, bool]:
+    """
+    Reads the account-level Public Access Block, treating an unreadable one as not configured.
 
-def main(region: str = "us-east-1") -> None:
+    :param region: AWS region to initialize the STS and S3 Control clients
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+    :return: Public Access Block settings, empty if none are configured or they cannot be read
+    """
+    try:
+        account_id = (credentials or {}).get('AccountId') or get_account_id(get_client('sts', region, credentials))
+        return get_account_public_access_block(get_client('s3control', region, credentials), account_id)
+    except ClientError as e:
+        logger.warning(f"Could not read the account Public Access Block, checking every bucket: {e}")
+        return {}
+
+
+def main(region: str = "us-east-1", bucket_region: Optional[str] = None,
+         max_workers: int = DEFAULT_MAX_WORKERS, state_store: Optional[StateStore] = None,
+         remediation: str = REMEDIATION_POLICY, credentials: Optional[Dict[str, str]] = None,
+         sink: Optional[FindingSink] = None) -> Dict[str, Any]:
     """
     Main function to check all S3 buckets and remove public access if found.
 
+    The account-level Public Access Block is read first; if it already makes public bucket
+    policies ineffective, no bucket is checked individually.
+
     :param region: AWS region to initialize the S3 client
+    :param bucket_region: Only check buckets located in this region, if given
+    :param max_workers: Number of buckets checked at the same time
+    :param state_store: Store of previous verdicts; buckets with an unchanged policy are skipped
+    :param remediation: REMEDIATION_POLICY to remove public statements, REMEDIATION_BLOCK to enable Public Access Block
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+    :param sink: Receives one finding per bucket as it is checked; the per-bucket results are then
+        left out of the summary
+    :return: Success or error message, with per-bucket results under "buckets" unless a sink was given,
+             verdict counts under "verdicts" and the calls Public Access Blocks made unnecessary under "avoided_calls"
     """
-    s3_client = initialize_s3_client(region)
+    baseline = get_metrics().snapshot()
+    s3_client = initialize_s3_client(region, credentials)
+    router = S3ClientRouter(s3_client, credentials)
+    evaluator = PolicyEvaluator()
+    sink = account_sink(sink, credentials)
 
     try:
-        response = s3_client.list_buckets()
-        buckets = response.get('Buckets', [])
-        for bucket in buckets:
-            check_remove_public_access(s3_client, bucket['Name'])
-    except NoCredentialsError:
-        handle_error("Credentials not available.") 
-    except ClientError as e:
-        handle_error(f"Error listing buckets: {e}")
+        bucket_names = list_buckets(s3_client, bucket_region)
+        if bucket_region:
+            for bucket_name in bucket_names:
+                router.set_bucket_region(bucket_name, bucket_region)
 
+        buckets = []
+        verdicts: Dict[str, int] = {}
+        skipped = 0
+        avoided_calls = 0
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            if restricts_public_buckets(get_account_block(region, credentials)):
+                # Each bucket would have needed a policy lookup, and a location lookup unless its region is known
+                calls_per_bucket = 1 if bucket_region else 2
+                results = ({
+                    "bucket": bucket_name,
+                    "region": bucket_region,
+                    "status": "Success",
+                    "reason": "Account Public Access Block restricts public bucket policies",
+                    "verdict": VERDICT_COMPLIANT,
+                    "actions": [],
+                    "skipped": True,
+                    "avoided_calls": calls_per_bucket,
+                    "duration": 0.0,
+                } for bucket_name in bucket_names)
+            else:
+                results = executor.map(
+                    lambda name: check_bucket(router, name, state_store, evaluator, remediation), bucket_names
+                )
+
+            # Results are consumed while the sweep is still running, so a sink sees them early
+            for result in results:
+                verdicts[result['verdict']] = verdicts.get(result['verdict'], 0) + 1
+                skipped += result['skipped']
+                avoided_calls += result['avoided_calls']
+                if sink is not None:
+                    sink(make_finding('s3', result['region'], result['bucket'], result['verdict'], result['actions'],
+                                      result['status'], result['reason'], result['duration']))
+                else:
+                    buckets.append(result)
+
+        details = {}
+        if sink is None:
+            details["buckets"] = buckets
+        if state_store is not None:
+            state_store.commit()
+            details["skipped"] = skipped
+        return handle_success(f"Checked {sum(verdicts.values())} S3 bucket/-s", verdicts=verdicts,
+                              cache=evaluator.stats(), avoided_calls=avoided_calls,
+                              metrics=get_metrics().since(baseline), **details)
+    except NoCredentialsError as e:
+        return handle_error(e, "Credentials not available.") 
+    except ClientError as e:
+        return handle_error(e, "Error listing buckets: ")
 
 if __name__ == '__main__':
     result = main()
@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from botocore.exceptions import ClientError
+from .engine import CheckContext, get_check
+from .findings import VERDICT_ERROR, VERDICT_NON_COMPLIANT, FindingSink, make_finding
+from .helpers import (S3ClientRouter, DbInstanceRecord, InstanceRecord, get_client, describe_instance_records,
+                      describe_db_instance_records, get_instance_profile, list_attached_policies, list_buckets,
+                      get_bucket_policy, handle_error, handle_failure, handle_success, instance_filters)
+from .state_store import VERDICT_COMPLIANT
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Marks the start and end of a snapshot file, with the format version
+MAGIC = b"APCSNAP1"
+
+# Layout of the footer: offset and length of the index, followed by MAGIC
+FOOTER = struct.Struct("<QQ")
+
+# Number of records compressed together; larger blocks compress better, smaller ones load less per lookup
+DEFAULT_BLOCK_SIZE = 256
+
+# Number of decompressed blocks kept in memory by a reader
+DEFAULT_BLOCK_CACHE_SIZE = 16
+
+# Kinds of snapshot records, each keyed by resource ID
+KIND_INSTANCE = "instance"
+KIND_INSTANCE_PROFILE = "instance_profile"
+KIND_ROLE_POLICIES = "role_policies"
+KIND_BUCKET = "bucket"
+KIND_DB_INSTANCE = "db_instance"
+
+# Kind of the records of resources that could not be captured, keyed by "<kind>/<resource ID>"
+KIND_ERROR = "error"
+
+
+class SnapshotWriter:
+    """
+    Writes resource records into a snapshot file.
+
+    Records are compressed in blocks. The index, which maps each kind and resource ID to
+    its block and position, is written last, so capture streams to disk as it goes.
+    """
+
+    def __init__(self, path: str, block_size: int = DEFAULT_BLOCK_SIZE, **metadata: Any) -> None:
+        """
+        :param path: Path of the snapshot file
+        :param block_size: Number of records per compressed block
+        :param metadata: Details stored with the snapshot, e.g. the region it was captured in
+        """
+        self.block_size = max(1, block_size)
+        self.metadata = metadata
+        self.count = 0
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._blocks: List[Tuple[int, int]] = []
+        self._block: List[Any] = []
+        self._index: Dict[str, Dict[str, Tuple[int, int]]] = {}
+
+    def add(self, kind: str, resource_id: str, payload: Any) -> None:
+        """
+        Adds a record to the snapshot.
+
+        :param kind: Record kind, one of the KIND_* constants
+        :param resource_id: Resource identifier, unique within the kind
+        :param payload: JSON-serializable record
+        """
+        self._index.setdefault(kind, {})[resource_id] = (len(self._blocks), len(self._block))
+        self._block.append(payload)
+        self.count += 1
+        if len(self._block) >= self.block_size:
+            self._write_block()
+
+    def _write_block(self) -> None:
+        """
+        Compresses the buffered records and appends them to the file.
+        """
+        if not self._block:
+            return
+        data = zlib.compress(json.dumps(self._block, separators=(',', ':'), default=str).encode('utf-8'))
+        self._blocks.append((self._file.tell(), len(data)))
+        self._file.write(data)
+        self._block = []
+
+    def close(self) -> None:
+        """
+        Writes the last block, the index and the footer, and closes the file.
+        """
+        if self._file.closed:
+            return
+        self._write_block()
+        index = zlib.compress(json.dumps({"metadata": self.metadata, "blocks": self._blocks, "index": self._index},
+                                         separators=(',', ':'), default=str).encode('utf-8'))
+        offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(FOOTER.pack(offset, len(index)) + MAGIC)
+        self._file.close()
+
+    def __enter__(self) -> "SnapshotWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class Snapshot:
+    """
+    Reads records from a snapshot file.
+
+    The file is memory-mapped and only the index is decompressed on open. Blocks are
+    decompressed when a record in them is first read, and the most recent ones are cached.
+    """
+
+    def __init__(self, path: str, cache_size: int = DEFAULT_BLOCK_CACHE_SIZE) -> None:
+        """
+        :param path: Path of the snapshot file
+        :param cache_size: Number of decompressed blocks kept in memory
+        :raises ValueError: If the file is not a snapshot.
+        """
+        self.path = path
+        self.cache_size = max(1, cache_size)
+        self.blocks_loaded = 0
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        footer_size = FOOTER.size + len(MAGIC)
+        if len(self._map) < len(MAGIC) + footer_size or self._map[:len(MAGIC)] != MAGIC \
+                or self._map[-len(MAGIC):] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a snapshot file")
+        offset, length = FOOTER.unpack(self._map[-footer_size:-len(MAGIC)])
+        index = json.loads(zlib.decompress(self._map[offset:offset + length]))
+        self.metadata: Dict[str, Any] = index['metadata']
+        self._blocks: List[List[int]] = index['blocks']
+        self._index: Dict[str, Dict[str, List[int]]] = index['index']
+        self._cache: "OrderedDict[int, List[Any]]" = OrderedDict()
+
+    def _block(self, number: int) -> List[Any]:
+        """
+        Returns the records of a block, decompressing it if it is not cached.
+
+        :param number: Block number
+        :return: Records of the block
+        """
+        if number in self._cache:
+            self._cache.move_to_end(number)
+            return self._cache[number]
+        offset, length = self._blocks[number]
+        records = json.loads(zlib.decompress(self._map[offset:offset + length]))
+        self.blocks_loaded += 1
+        self._cache[number] = records
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return records
+
+    def get(self, kind: str, resource_id: str) -> Optional[Any]:
+        """
+        Returns a record by kind and resource ID.
+
+        :param kind: Record kind, one of the KIND_* constants
+        :param resource_id: Resource identifier
+        :return: Record, or None if the snapshot does not hold it
+        """
+        position = self._index.get(kind, {}).get(resource_id)
+        if position is None:
+            return None
+        return self._block(position[0])[position[1]]
+
+    def ids(self, kind: str) -> List[str]:
+        """
+        Returns the resource IDs of a kind, without loading any record.
+
+        :param kind: Record kind, one of the KIND_* constants
+        :return: Resource identifiers
+        """
+        return list(self._index.get(kind, {}))
+
+    def error(self, kind: str, resource_id: str) -> Optional[str]:
+        """
+        Returns the reason a resource could not be captured.
+
+        :param kind: Record kind, one of the KIND_* constants
+        :param resource_id: Resource identifier
+        :return: Error message, or None if the resource was captured
+        """
+        return self.get(KIND_ERROR, f"{kind}/{resource_id}")
+
+    def records(self, kind: str) -> Iterator[Tuple[str, Any]]:
+        """
+        Yields the records of a kind in the order they were captured.
+
+        :param kind: Record kind, one of the KIND_* constants
+        :return: Iterator over tuples of resource ID and record
+        """
+        for resource_id in self._index.get(kind, {}):
+            yield resource_id, self.get(kind, resource_id)
+
+    def close(self) -> None:
+        """
+        Unmaps and closes the file.
+        """
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self) -> "Snapshot":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class SnapshotIamCache:
+    """
+    Answers the IAM lookups of the EC2 check from a snapshot instead of the IAM API.
+    """
+
+    def __init__(self, snapshot: Snapshot) -> None:
+        """
+        :param snapshot: Snapshot holding instance profiles and role policies
+        """
+        self.snapshot = snapshot
+        self.detached_roles: set = set()
+
+    def get_instance_profile(self, profile_name: str) -> Dict[str, Any]:
+        """
+        Returns an instance profile in the shape of a GetInstanceProfile response.
+
+        :raises KeyError: If the snapshot does not hold the profile.
+        :raises RuntimeError: If the profile could not be captured.
+        """
+        reason = self.snapshot.error(KIND_INSTANCE_PROFILE, profile_name)
+        if reason is not None:
+            raise RuntimeError(f"Instance profile {profile_name} could not be captured: {reason}")
+        roles = self.snapshot.get(KIND_INSTANCE_PROFILE, profile_name)
+        if roles is None:
+            raise KeyError(f"Instance profile {profile_name} is not in the snapshot")
+        return {'InstanceProfile': {'InstanceProfileName': profile_name,
+                                    'Roles': [{'RoleName': role_name} for role_name in roles]}}
+
+    def list_attached_policies(self, role_name: str) -> Dict[str, Any]:
+        """
+        Returns the policies of a role in the shape of a ListAttachedRolePolicies response.
+
+        :raises RuntimeError: If the policies of the role could not be captured.
+        """
+        reason = self.snapshot.error(KIND_ROLE_POLICIES, role_name)
+        if reason is not None:
+            raise RuntimeError(f"Policies of role {role_name} could not be captured: {reason}")
+        return {'AttachedPolicies': self.snapshot.get(KIND_ROLE_POLICIES, role_name) or []}
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of snapshot blocks loaded so far.
+        """
+        return {"blocks_loaded": self.snapshot.blocks_loaded}
+
+
+def capture(path: str, region: str = "us-east-1", credentials: Optional[Dict[str, str]] = None,
+            block_size: int = DEFAULT_BLOCK_SIZE) -> Dict[str, Any]:
+    """
+    Records the discovery results of every check into a snapshot file.
+
+    :param path: Path of the snapshot file
+    :param region: AWS region to capture
+    :param credentials: Temporary credentials as returned by STS, default credential chain if omitted
+    :param block_size: Number of records per compressed block
+    :return: Number of records captured per kind and of resources that could not be captured,
+             which are recorded in the snapshot and give error findings when evaluated
+    """
+    start = time.perf_counter()
+    errors = 0
+    try:
+        with SnapshotWriter(path, block_size, region=region, captured_at=time.time()) as writer:
+            def add_error(kind: str, resource_id: str, e: Exception) -> None:
+                # Evaluating a resource that depends on this record gives an error finding instead of a verdict
+                nonlocal errors
+                logger.error(f"Error capturing {kind} {resource_id}: {e}")
+                writer.add(KIND_ERROR, f"{kind}/{resource_id}", str(e))
+                errors += 1
+
+            # EC2 instances, then the instance profiles and role policies they lead to
+            iam_client = get_client('iam', region, credentials)
+            profiles = set()
+            ec2_client = get_client('ec2', region, credentials)
+            for instance in describe_instance_records(ec2_client, filters=instance_filters()):
+                writer.add(KIND_INSTANCE, instance.instance_id, instance.to_dict())
+                if instance.profile_name:
+                    profiles.add(instance.profile_name)
+            roles = set()
+            for profile_name in sorted(profiles):
+                try:
+                    profile = get_instance_profile(iam_client, profile_name)['InstanceProfile']
+                except iam_client.exceptions.NoSuchEntityException:
+                    continue
+                except ClientError as e:
+                    add_error(KIND_INSTANCE_PROFILE, profile_name, e)
+                    continue
+                role_names = [role['RoleName'] for role in profile['Roles']]
+                writer.add(KIND_INSTANCE_PROFILE, profile_name, role_names)
+                roles.update(role_names)
+            for role_name in sorted(roles):
+                try:
+                    policies = list_attached_policies(iam_client, role_name)['AttachedPolicies']
+                except ClientError as e:
+                    add_error(KIND_ROLE_POLICIES, role_name, e)
+                    continue
+                writer.add(KIND_ROLE_POLICIES, role_name, [{'PolicyName': policy['PolicyName'],
+                                                            'PolicyArn': policy['PolicyArn']} for policy in policies])
+
+            # S3 buckets with their policies, read through a client in each bucket's region
+            s3_client = get_client('s3', region, credentials)
+            router = S3ClientRouter(s3_client, credentials)
+            for bucket in list_buckets(s3_client):
+                policy = None
+                try:
+                    policy = get_bucket_policy(router.get_client(bucket), bucket)['Policy']
+                except ClientError as e:
+                    if e.response['Error']['Code'] != 'NoSuchBucketPolicy':
+                        add_error(KIND_BUCKET, bucket, e)
+                writer.add(KIND_BUCKET, bucket, {'policy': policy})
+
+            # RDS instances
+            for db_instance in describe_db_instance_records(get_client('rds', region, credentials)):
+                writer.add(KIND_DB_INSTANCE, db_instance.identifier, db_instance.to_dict())
+            total = writer.count
+    except Exception as e:
+        # A listing failed, so the snapshot would be missing whole kinds of resources; none is kept
+        if os.path.exists(path):
+            os.remove(path)
+        return handle_error(e, "Error capturing snapshot: ")
+
+    with Snapshot(path) as snapshot:
+        counts = {kind: len(snapshot.ids(kind)) for kind in (KIND_INSTANCE, KIND_INSTANCE_PROFILE, KIND_ROLE_POLICIES,
+                                                              KIND_BUCKET, KIND_DB_INSTANCE)}
+    message = f"Captured {total} record/-s into {path}"
+    details = {"records": counts, "errors": errors, "duration": round(time.perf_counter() - start, 3)}
+    if errors:
+        return handle_failure(f"{message}, {errors} resource/-s could not be captured", **details)
+    return handle_success(message, **details)
+
+
+def _snapshot_resources(snapshot: Snapshot, name: str) -> Iterator[Tuple[str, Any]]:
+    """
+    Yields the resources of a check from a snapshot, as the check's discovery would.
+
+    :param snapshot: Open snapshot
+    :param name: Check name
+    :return: Iterator over tuples of resource ID and resource
+    """
+    if name == "ec2":
+        for resource_id, fields in snapshot.records(KIND_INSTANCE):
+            yield resource_id, InstanceRecord(**fields)
+    elif name == "rds":
+        for resource_id, fields in snapshot.records(KIND_DB_INSTANCE):
+            yield resource_id, DbInstanceRecord(**fields)
+    elif name == "s3":
+        yield from ((bucket, bucket) for bucket in snapshot.ids(KIND_BUCKET))
+
+
+def evaluate(path: str, checks: Optional[List[str]] = None, sink: Optional[FindingSink] = None) -> Dict[str, Any]:
+    """
+    Runs the checks' decision logic against a snapshot, without credentials or API calls.
+
+    Nothing is remediated: resources that need actions are reported as non-compliant.
+
+    :param path: Path of the snapshot file
+    :param checks: Check names, every check in the snapshot by default
+    :param sink: Receives each finding as it is produced, or None
+    :return: Verdict counts per check
+    """
+    start = time.perf_counter()
+    verdicts: Dict[str, Dict[str, int]] = {}
+    with Snapshot(path) as snapshot:
+        region = snapshot.metadata.get('region')
+        # The context's clients are never used; the EC2 check's IAM lookups go to the snapshot
+        context = CheckContext(region)
+        context.cache['iam_cache'] = SnapshotIamCache(snapshot)
+        for name in checks or ("ec2", "rds", "s3"):
+            check = get_check(name)(context)
+            counts = verdicts.setdefault(name, {})
+            for resource_id, resource in _snapshot_resources(snapshot, name):
+                try:
+                    if name == "s3":
+                        reason = snapshot.error(KIND_BUCKET, resource_id)
+                        if reason is not None:
+                            raise RuntimeError(f"Bucket {resource_id} could not be captured: {reason}")
+                        actions = check.evaluate_policy(resource, snapshot.get(KIND_BUCKET, resource_id)['policy'])
+                    else:
+                        actions = check.evaluate(resource)
+                    verdict = VERDICT_NON_COMPLIANT if actions else VERDICT_COMPLIANT
+                    finding = make_finding(name, region, resource_id, verdict, actions,
+                                           reason=f"Needs {len(actions)} action/-s" if actions else "")
+                except Exception as e:
+                    logger.error(f"Error evaluating {resource_id}: {e}")
+                    finding = make_finding(name, region, resource_id, VERDICT_ERROR, status="Error",
+                                           reason=f"Unexpected error: {e}")
+                counts[finding['verdict']] = counts.get(finding['verdict'], 0) + 1
+                if sink is not None:
+                    sink(finding)
+        blocks_loaded = snapshot.blocks_loaded
+
+    message = f"Evaluated {sum(sum(counts.values()) for counts in verdicts.values())} resource/-s from {path}"
+    details = {"verdicts": verdicts, "blocks_loaded": blocks_loaded, "duration": round(time.perf_counter() - start, 3)}
+    if any(counts.get(VERDICT_ERROR) for counts in verdicts.values()):
+        return handle_failure(message, **details)
+    return handle_success(message, **details)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Number of recorded verdicts buffered before they are committed to disk
+COMMIT_INTERVAL = 500
+
+# Verdicts recorded for a resource after it was checked
+VERDICT_COMPLIANT = "compliant"
+VERDICT_REMEDIATED = "remediated"
+
+
+def fingerprint(attributes: Dict[str, Any]) -> str:
+    """
+    Computes a stable fingerprint of a resource's security-relevant attributes.
+
+    :param attributes: Attributes that decide the resource's verdict
+    :return: Hex digest of the attributes
+    """
+    payload = json.dumps(attributes, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class StateStore:
+    """
+    SQLite-backed store of resource fingerprints and their last verdict.
+
+    Checkers skip resources whose fingerprint has not changed since they were last
+    checked, unless the store was opened in full-rescan mode. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = ":memory:", full_rescan: bool = False) -> None:
+        """
+        :param path: Path of the SQLite database file
+        :param full_rescan: Check every resource, ignoring stored fingerprints
+        """
+        self.path = path
+        self.full_rescan = full_rescan
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS resources ("
+            " kind TEXT NOT NULL,"
+            " resource_id TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " verdict TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (kind, resource_id))"
+        )
+        self._connection.commit()
+
+    def get(self, kind: str, resource_id: str) -> Optional[Tuple[str, str]]:
+        """
+        Returns the stored fingerprint and verdict of a resource.
+
+        :param kind: Resource type, e.g. "ec2", "rds" or "s3"
+        :param resource_id: Resource identifier
+        :return: Tuple of fingerprint and verdict, or None if the resource is unknown
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT fingerprint, verdict FROM resources WHERE kind = ? AND resource_id = ?",
+                (kind, resource_id)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def is_unchanged(self, kind: str, resource_id: str, resource_fingerprint: str) -> bool:
+        """
+        Checks whether a resource can be skipped because it has not changed since its last check.
+
+        :param kind: Resource type, e.g. "ec2", "rds" or "s3"
+        :param resource_id: Resource identifier
+        :param resource_fingerprint: Current fingerprint of the resource
+        :return: True if the resource is unchanged and not in full-rescan mode, False otherwise
+        """
+        if self.full_rescan:
+            return False
+        stored = self.get(kind, resource_id)
+        return stored is not None and stored[0] == resource_fingerprint
+
+    def record(self, kind: str, resource_id: str, resource_fingerprint: str, verdict: str) -> None:
+        """
+        Stores a resource's fingerprint and verdict.
+
+        :param kind: Resource type, e.g. "ec2", "rds" or "s3"
+        :param resource_id: Resource identifier
+        :param resource_fingerprint: Fingerprint the verdict was reached for
+        :param verdict: Result of the check
+        """
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO resources (kind, resource_id, fingerprint, verdict, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (kind, resource_id, resource_fingerprint, verdict, time.time())
+            )
+            self._pending += 1
+            if self._pending >= COMMIT_INTERVAL:
+                self._connection.commit()
+                self._pending = 0
+
+    def commit(self) -> None:
+        """
+        Writes buffered verdicts to disk.
+        """
+        with self._lock:
+            self._connection.commit()
+            self._pending = 0
+
+    def close(self) -> None:
+        """
+        Commits buffered verdicts and closes the database.
+        """
+        self.commit()
+        self._connection.close()
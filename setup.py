@@ -16,7 +16,12 @@ setup(
     author='Arte Chp',
     author_email='art.cha@tutanota.com',
     url='https://github.com/ArteChp/aws_policy_checker',
-    packages=find_packages(exclude=('tests', 'docs')),
+    packages=find_packages(exclude=('tests', 'docs', 'benchmarks')),
+    entry_points={
+        'console_scripts': [
+            'aws-policy-checker=code.cli:main',
+        ],
+    },
     python_requires='>=3.6'
 )
 
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import itertools
+import json
+import time
+import unittest
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from unittest.mock import patch
+import boto3
+from moto import mock_aws
+from code import aio
+from code.ec2_check_remove_ssm_policy import ENGINE_POLICY
+from code.engine import Check, CheckContext
+from code.findings import VERDICT_NON_COMPLIANT
+from code.helpers import instance_filters
+from code.s3_check_remove_public_access import REMEDIATION_BLOCK
+from code.state_store import VERDICT_REMEDIATED
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGION: str = 'us-east-1'
+AMI: str = 'ami-12345678'
+SSM_POLICY_NAME: str = 'AmazonSSMManagedInstanceCore'
+
+# Seconds each fake resource takes to evaluate
+EVALUATE_DELAY: float = 0.1
+
+
+class SlowCheck(Check):
+    """Fake check whose resources are numbers, one per page, each taking a while to evaluate."""
+
+    name = "slow"
+
+    def __init__(self, context: CheckContext, count: Optional[int] = None) -> None:
+        super().__init__(context)
+        self.count = count
+        self.discovered = 0
+
+    def pages(self, token: Optional[str] = None) -> Iterator[Tuple[Optional[str], List[int]]]:
+        for index in itertools.count() if self.count is None else range(self.count):
+            self.discovered += 1
+            yield str(index), [index]
+
+    def resource_id(self, resource: int) -> str:
+        return str(resource)
+
+    def evaluate(self, resource: int) -> List[Dict[str, Any]]:
+        time.sleep(EVALUATE_DELAY)
+        return [{"action": "noop"}]
+
+
+class TestAio(unittest.TestCase):
+    """Unit tests for the asyncio API."""
+
+    def setUp(self) -> None:
+        """Set up the mock AWS environment."""
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+
+    def tearDown(self) -> None:
+        """Clean up the mock AWS environment."""
+        self.mock_aws.stop()
+
+    def test_async_helpers_page_records(self) -> None:
+        """Test that the async describe helper yields the records of every page."""
+        ec2 = boto3.client('ec2', region_name=REGION)
+        for _ in range(7):
+            ec2.run_instances(ImageId=AMI, MinCount=1, MaxCount=1)
+
+        async def collect() -> List[str]:
+            return [record.instance_id async for record in
+                    aio.describe_instance_records(ec2, page_size=5, filters=instance_filters())]
+
+        self.assertEqual(len(asyncio.run(collect())), 7)
+
+    def test_entry_points_remediate_and_share_one_loop(self) -> None:
+        """Test that the async entry points remediate, and several scans run concurrently on one loop."""
+        iam = boto3.client('iam', region_name=REGION)
+        iam.create_role(RoleName='ssm-role', AssumeRolePolicyDocument='{}')
+        policy_arn = iam.create_policy(PolicyName=SSM_POLICY_NAME, PolicyDocument=json.dumps({
+            'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': 'ssm:*', 'Resource': '*'}]
+        }))['Policy']['Arn']
+        iam.attach_role_policy(RoleName='ssm-role', PolicyArn=policy_arn)
+        iam.create_instance_profile(InstanceProfileName='ssm-profile')
+        iam.add_role_to_instance_profile(InstanceProfileName='ssm-profile', RoleName='ssm-role')
+        boto3.client('ec2', region_name=REGION).run_instances(ImageId=AMI, MinCount=1, MaxCount=1,
+                                                               IamInstanceProfile={'Name': 'ssm-profile'})
+        boto3.client('rds', region_name=REGION).create_db_instance(
+            DBInstanceIdentifier='public-db', AllocatedStorage=20, DBInstanceClass='db.t4g.micro', Engine='mysql',
+            MasterUsername='admin', MasterUserPassword='password', PubliclyAccessible=True
+        )
+
+        async def scan() -> List[Dict[str, Any]]:
+            return await asyncio.gather(aio.ec2_check_remove_ssm_policy(REGION),
+                                        aio.rds_check_remove_public_access(REGION, remediate=False),
+                                        aio.s3_check_remove_public_access(REGION))
+
+        ec2_result, rds_result, s3_result = asyncio.run(scan())
+
+        self.assertEqual(ec2_result['verdicts'], {VERDICT_REMEDIATED: 1})
+        self.assertEqual(iam.list_attached_role_policies(RoleName='ssm-role')['AttachedPolicies'], [])
+        self.assertEqual(rds_result['verdicts'], {VERDICT_NON_COMPLIANT: 1})
+        self.assertEqual((s3_result['status'], s3_result['verdicts']), ("Success", {}))
+
+    def test_entry_points_take_the_checkers_options(self) -> None:
+        """Test that the async entry points accept the engine of the EC2 checker and the remediation of the S3 one."""
+        iam = boto3.client('iam', region_name=REGION)
+        iam.create_role(RoleName='ssm-role', AssumeRolePolicyDocument='{}')
+        policy_arn = iam.create_policy(PolicyName=SSM_POLICY_NAME, PolicyDocument=json.dumps({
+            'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': 'ssm:*', 'Resource': '*'}]
+        }))['Policy']['Arn']
+        iam.attach_role_policy(RoleName='ssm-role', PolicyArn=policy_arn)
+        iam.create_instance_profile(InstanceProfileName='ssm-profile')
+        iam.add_role_to_instance_profile(InstanceProfileName='ssm-profile', RoleName='ssm-role')
+        boto3.client('ec2', region_name=REGION).run_instances(ImageId=AMI, MinCount=1, MaxCount=1,
+                                                               IamInstanceProfile={'Name': 'ssm-profile'})
+        s3 = boto3.client('s3', region_name=REGION)
+        s3.create_bucket(Bucket='public-bucket')
+        s3.put_bucket_policy(Bucket='public-bucket', Policy=json.dumps({
+            'Version': '2012-10-17',
+            'Statement': [{'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject',
+                           'Resource': 'arn:aws:s3:::public-bucket/*'}]
+        }))
+
+        async def scan() -> List[Dict[str, Any]]:
+            return await asyncio.gather(aio.ec2_check_remove_ssm_policy(REGION, engine=ENGINE_POLICY),
+                                        aio.s3_check_remove_public_access(REGION, remediation=REMEDIATION_BLOCK))
+
+        ec2_result, s3_result = asyncio.run(scan())
+
+        self.assertEqual(ec2_result['verdicts'], {VERDICT_REMEDIATED: 1})
+        self.assertEqual(iam.list_attached_role_policies(RoleName='ssm-role')['AttachedPolicies'], [])
+        self.assertEqual(s3_result['verdicts'], {VERDICT_REMEDIATED: 1})
+        self.assertTrue(s3.get_public_access_block(Bucket='public-bucket')
+                        ['PublicAccessBlockConfiguration']['RestrictPublicBuckets'])
+        self.assertIn('Policy', s3.get_bucket_policy(Bucket='public-bucket'))
+
+    def test_resources_are_processed_concurrently(self) -> None:
+        """Test that a scan overlaps the evaluation of its resources up to its concurrency."""
+        check = SlowCheck(CheckContext(REGION), count=8)
+
+        async def collect() -> List[Dict[str, Any]]:
+            return [finding async for finding in aio.stream_check(check, remediate=False, concurrency=8)]
+
+        start = time.perf_counter()
+        findings = asyncio.run(collect())
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(sorted(int(finding['resource_id']) for finding in findings), list(range(8)))
+        self.assertLess(elapsed, EVALUATE_DELAY * 4)
+
+    def test_closing_the_stream_stops_discovery(self) -> None:
+        """Test that a consumer leaving early stops an endless discovery."""
+        check = SlowCheck(CheckContext(REGION))
+
+        async def take(count: int) -> List[Dict[str, Any]]:
+            findings = []
+            stream = aio.stream_check(check, remediate=False, concurrency=2)
+            async for finding in stream:
+                findings.append(finding)
+                if len(findings) == count:
+                    break
+            await stream.aclose()
+            discovered = check.discovered
+            await asyncio.sleep(EVALUATE_DELAY * 3)
+            self.assertEqual(check.discovered, discovered)
+            return findings
+
+        self.assertEqual(len(asyncio.run(take(3))), 3)
+
+    def test_timeout_reports_partial_results(self) -> None:
+        """Test that a scan running past its timeout is stopped and reported as an error."""
+        with patch('code.aio.get_check', return_value=SlowCheck):
+            result = asyncio.run(aio.run_check("slow", REGION, remediate=False, concurrency=2,
+                                               timeout=EVALUATE_DELAY * 2.5))
+
+        self.assertEqual(result['status'], "Error")
+        self.assertIn("Timed out", result['reason'])
+        self.assertGreater(result['verdicts'][VERDICT_NON_COMPLIANT], 0)
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import tempfile
+import unittest
+import logging
+from benchmarks.bench_checkers import main
+from code.helpers import get_client_pool
+from code.rate_limiter import get_rate_limiter
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TestBenchCheckers(unittest.TestCase):
+    """Unit tests for the scale benchmark harness."""
+
+    def test_benchmark_writes_results(self) -> None:
+        """Test that a small benchmark run records timings, memory and API calls."""
+        pool = get_client_pool()
+        iam_rate = get_rate_limiter('iam').max_rate
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+
+            main(['--instances', '4', '--profiles', '2', '--only', 'ec2_instance_engine',
+                  '--only', 'rds', '--db-instances', '2', '--output', output])
+
+            with open(output) as f:
+                report = json.load(f)
+
+        self.assertEqual(sorted(report['results']), ['ec2_instance_engine', 'rds'])
+        ec2 = report['results']['ec2_instance_engine']
+        self.assertEqual(ec2['status'], "Success")
+        self.assertEqual(ec2['api_calls']['iam.GetInstanceProfile'], 2)
+        self.assertGreater(ec2['peak_memory_bytes'], 0)
+        self.assertEqual(report['results']['rds']['api_calls']['rds.ModifyDBInstance'], 1)
+        self.assertIs(get_client_pool(), pool)
+        self.assertEqual(get_rate_limiter('iam').max_rate, iam_rate)
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
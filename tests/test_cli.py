@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import logging
+from contextlib import redirect_stderr, redirect_stdout
+from unittest.mock import patch
+import boto3
+from moto import mock_aws
+from code.cli import main
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGION: str = 'us-west-2'
+AMI: str = 'ami-061392db613a6357b'
+
+# Budget for importing the CLI module, in microseconds
+IMPORT_TIME_BUDGET_US: int = 100000
+
+
+class TestCli(unittest.TestCase):
+    """Unit tests for the aws-policy-checker command line."""
+
+    def test_import_is_lazy_and_within_budget(self) -> None:
+        """Test that importing the CLI loads no AWS libraries and stays within the import-time budget."""
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             "import sys, code.cli; print(sorted(m for m in ('boto3', 'botocore') if m in sys.modules))"],
+            capture_output=True, text=True, check=True
+        )
+
+        self.assertEqual(completed.stdout.strip(), "[]")
+        cumulative = [int(line.split('|')[1]) for line in completed.stderr.splitlines()
+                      if line.rstrip().endswith('| code.cli')]
+        self.assertEqual(len(cumulative), 1)
+        self.assertLess(cumulative[0], IMPORT_TIME_BUDGET_US)
+
+    def test_no_command_prints_help(self) -> None:
+        """Test that running without a command only prints the help."""
+        output = io.StringIO()
+        with redirect_stdout(output):
+            exit_code = main([])
+
+        self.assertEqual(exit_code, 0)
+        self.assertIn("aws-policy-checker", output.getvalue())
+
+    @mock_aws
+    def test_all_runs_every_check(self) -> None:
+        """Test that the "all" command runs every check in one process."""
+        boto3.client('ec2', region_name=REGION).run_instances(ImageId=AMI, MinCount=1, MaxCount=1)
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            exit_code = main(['all', '--region', REGION])
+        results = json.loads(output.getvalue())
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(sorted(results), ['ec2', 'rds', 's3'])
+        self.assertIn("No instances with SSM policy", results['ec2']['reason'])
+
+    @mock_aws
+    def test_several_regions_are_fanned_out(self) -> None:
+        """Test that repeated --region options scan the regions in parallel."""
+        output = io.StringIO()
+        with redirect_stdout(output):
+            exit_code = main(['rds', '--region', REGION, '--region', 'eu-west-1'])
+        result = json.loads(output.getvalue())
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(sorted(result['regions']), ['eu-west-1', REGION])
+
+    @mock_aws
+    def test_pipeline_dry_run(self) -> None:
+        """Test that --pipeline --dry-run reports findings without remediating."""
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='cli-bucket')
+        boto3.client('s3', region_name='us-east-1').put_bucket_policy(
+            Bucket='cli-bucket',
+            Policy=json.dumps({'Version': '2012-10-17', 'Statement': [{
+                'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject',
+                'Resource': 'arn:aws:s3:::cli-bucket/*'}]})
+        )
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            exit_code = main(['--pipeline', '--dry-run', 's3'])
+        result = json.loads(output.getvalue())
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(result['verdicts'], {'non_compliant': 1})
+        self.assertIn('Policy', boto3.client('s3', region_name='us-east-1').get_bucket_policy(Bucket='cli-bucket'))
+
+    @mock_aws
+    def test_pipeline_checks_buckets_once_across_regions(self) -> None:
+        """Test that the S3 engine check runs in the first region only when several regions are scanned."""
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='cli-bucket')
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            exit_code = main(['--pipeline', '--dry-run', 's3', '--region', 'us-east-1', '--region', REGION])
+        result = json.loads(output.getvalue())
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(result['regions']['us-east-1']['verdicts'], {'compliant': 1})
+        self.assertEqual(result['regions'][REGION]['verdicts'], {})
+
+    @mock_aws
+    def test_dry_run_without_pipeline_is_rejected(self) -> None:
+        """Test that --dry-run without --pipeline fails instead of running the remediating checkers."""
+        rds = boto3.client('rds', region_name=REGION)
+        rds.create_db_instance(DBInstanceIdentifier='cli-db', AllocatedStorage=20, DBInstanceClass='db.t4g.micro',
+                               Engine='mysql', MasterUsername='admin', MasterUserPassword='password',
+                               PubliclyAccessible=True)
+
+        with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit) as raised:
+            main(['--dry-run', 'rds', '--region', REGION])
+
+        self.assertEqual(raised.exception.code, 2)
+        self.assertTrue(rds.describe_db_instances()['DBInstances'][0]['PubliclyAccessible'])
+
+    @mock_aws
+    def test_accounts_are_scanned_through_assumed_roles(self) -> None:
+        """Test that --account runs the checks once per account and reports them by account and region."""
+        output = io.StringIO()
+        with redirect_stdout(output):
+            exit_code = main(['--account', '111111111111', '--account', '222222222222',
+                              '--role-name', 'SecurityAudit', '--pipeline', 'rds', '--region', REGION])
+        result = json.loads(output.getvalue())
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(sorted(result['accounts']), ['111111111111', '222222222222'])
+        self.assertEqual(result['accounts']['111111111111']['regions'][REGION]['rds']['status'], "Success")
+
+    @mock_aws
+    def test_findings_streamed_to_stdout(self) -> None:
+        """Test that --findings - writes NDJSON findings to stdout and the summary to stderr."""
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='cli-bucket')
+
+        output, errors = io.StringIO(), io.StringIO()
+        with redirect_stdout(output), redirect_stderr(errors):
+            exit_code = main(['--findings', '-', 's3'])
+
+        self.assertEqual(exit_code, 0)
+        findings = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([finding['resource_id'] for finding in findings], ['cli-bucket'])
+        self.assertIn('"verdicts"', errors.getvalue())
+
+    @mock_aws
+    def test_events_read_from_stdin(self) -> None:
+        """Test that the events command checks the resources named by events on stdin."""
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='cli-bucket')
+        event = {'eventName': 'PutBucketPolicy', 'awsRegion': 'us-east-1',
+                 'requestParameters': {'bucketName': 'cli-bucket'}}
+
+        output = io.StringIO()
+        with patch('sys.stdin', io.StringIO(json.dumps(event) + "\n")), redirect_stdout(output):
+            exit_code = main(['events', '--window', '0.1'])
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(json.loads(output.getvalue())['verdicts'], {'s3': {'compliant': 1}})
+
+    @mock_aws
+    def test_capture_records_the_given_region(self) -> None:
+        """Test that capture takes a single region and records the resources found there."""
+        rds = boto3.client('rds', region_name=REGION)
+        rds.create_db_instance(DBInstanceIdentifier='cli-db', AllocatedStorage=20, DBInstanceClass='db.t4g.micro',
+                               Engine='mysql', MasterUsername='admin', MasterUserPassword='password',
+                               PubliclyAccessible=True)
+
+        with tempfile.TemporaryDirectory() as directory:
+            with redirect_stdout(io.StringIO()) as output:
+                exit_code = main(['capture', os.path.join(directory, 'inventory.snap'), '--region', REGION])
+        captured = json.loads(output.getvalue())
+
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(captured['records']['db_instance'], 1)
+
+    @mock_aws
+    def test_plan_then_apply(self) -> None:
+        """Test that plan writes the actions to a file without remediating and apply performs them."""
+        rds = boto3.client('rds', region_name='us-east-1')
+        rds.create_db_instance(DBInstanceIdentifier='cli-db', AllocatedStorage=20, DBInstanceClass='db.t4g.micro',
+                               Engine='mysql', MasterUsername='admin', MasterUserPassword='password',
+                               PubliclyAccessible=True)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'plan.json')
+            with redirect_stdout(io.StringIO()) as output:
+                plan_exit_code = main(['plan', path, '--check', 'rds'])
+            planned = json.loads(output.getvalue())
+            public = rds.describe_db_instances()['DBInstances'][0]['PubliclyAccessible']
+            with redirect_stdout(io.StringIO()) as output:
+                apply_exit_code = main(['apply', path, '--service-limit', 'rds=1'])
+            applied = json.loads(output.getvalue())
+
+        self.assertEqual((plan_exit_code, apply_exit_code), (0, 0))
+        self.assertEqual(planned['plan']['actions'], 1)
+        self.assertTrue(public)
+        self.assertEqual(applied['outcomes'], {'done': 1})
+        self.assertFalse(rds.describe_db_instances()['DBInstances'][0]['PubliclyAccessible'])
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
@@ -2,8 +2,12 @@
 import unittest
 import boto3
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError
+from unittest.mock import patch
 from moto import mock_aws
-from code.ec2_check_remove_ssm_policy import check_remove_ssm_policy
+from code.ec2_check_remove_ssm_policy import ENGINE_ACCOUNT, ENGINE_POLICY, check_remove_ssm_policy
+from code.helpers import detach_policy
+from code.iam_authorization import PolicyMatcher
+from code.state_store import VERDICT_COMPLIANT
 
 # JSON policy document for SSM instance policy
 SSM_INSTANCE_POLICY = """
@@ -83,6 +87,18 @@ AMI = 'ami-061392db613a6357b'
 # Test method to check removal of SSM policy
 class TestCheckRemoveSSMPolicy(unittest.TestCase):
 
+    def _create_ssm_instance_profile(self, iam) -> str:
+        """Create an instance profile whose role has the SSM policy attached and return its ARN."""
+        instance_profile = iam.create_instance_profile(InstanceProfileName=PROFILE_NAME)
+        iam.create_role(RoleName=ROLE_NAME, AssumeRolePolicyDocument=ROLE_POLICY_DOC)
+        policy_arn = iam.create_policy(
+            PolicyName="AmazonSSMManagedInstanceCore",
+            PolicyDocument=SSM_INSTANCE_POLICY
+        )
+        iam.attach_role_policy(RoleName=ROLE_NAME, PolicyArn=policy_arn['Policy']['Arn'])
+        iam.add_role_to_instance_profile(InstanceProfileName=PROFILE_NAME, RoleName=ROLE_NAME)
+        return instance_profile['InstanceProfile']['Arn']
+
     @mock_aws
     def test_check_remove_ssm_policy(self):
 
@@ -135,7 +151,7 @@ class TestCheckRemoveSSMPolicy(unittest.TestCase):
         
         # Assertions to verify the function's behavior
         assert "Success" == result['status']
-        assert "Detached SSM policy from role" in result['reason']
+        assert "Detached policy/-ies AmazonSSMManagedInstanceCore from the roles of 1 instance/-s" == result['reason']
 
     @mock_aws
     def test_check_remove_no_ssm_policy(self):
@@ -157,5 +173,125 @@ class TestCheckRemoveSSMPolicy(unittest.TestCase):
         assert "Success" == result['status']
         assert "No instances with SSM policy" in result['reason']
 
+    @mock_aws
+    def test_check_remove_ssm_policy_shared_profile(self):
+
+        iam = boto3.client('iam', region_name=REGION)
+        profile_arn = self._create_ssm_instance_profile(iam)
+
+        # Create several EC2 instances sharing the same instance profile
+        ec2 = boto3.client('ec2', region_name=REGION)
+        for _ in range(3):
+            ec2.run_instances(
+                ImageId=AMI,
+                MinCount=1,
+                MaxCount=1,
+                IamInstanceProfile={'Arn': profile_arn}
+            )
+
+        with patch('code.helpers.detach_policy', wraps=detach_policy) as mock_detach:
+            result = check_remove_ssm_policy(REGION)
+
+        # The role is looked up once and its policy detached only once
+        assert "Success" == result['status']
+        assert "of 1 instance/-s" in result['reason']
+        assert mock_detach.call_count == 1
+        assert result['cache'] == {"hits": 2, "misses": 2}
+
+    @mock_aws
+    def test_check_remove_ssm_policy_policy_engine(self):
+
+        iam = boto3.client('iam', region_name=REGION)
+        profile_arn = self._create_ssm_instance_profile(iam)
+
+        # Create instances with the SSM profile and one without any profile
+        ec2 = boto3.client('ec2', region_name=REGION)
+        for _ in range(3):
+            ec2.run_instances(ImageId=AMI, MinCount=1, MaxCount=1, IamInstanceProfile={'Arn': profile_arn})
+        ec2.run_instances(ImageId=AMI, MinCount=1, MaxCount=1)
+
+        with patch('code.helpers.get_instance_profile') as mock_get_profile:
+            result = check_remove_ssm_policy(REGION, engine=ENGINE_POLICY)
+
+        # Same detach count as the instance engine, without per-instance IAM lookups
+        assert "Success" == result['status']
+        assert "of 1 instance/-s" in result['reason']
+        mock_get_profile.assert_not_called()
+        attached = iam.list_attached_role_policies(RoleName=ROLE_NAME)['AttachedPolicies']
+        assert attached == []
+
+    @mock_aws
+    def test_check_remove_no_ssm_policy_policy_engine(self):
+
+        ec2 = boto3.client('ec2', region_name=REGION)
+        ec2.run_instances(ImageId=AMI, MinCount=1, MaxCount=1)
+
+        result = check_remove_ssm_policy(REGION, engine=ENGINE_POLICY)
+
+        assert "Success" == result['status']
+        assert "No instances with SSM policy" in result['reason']
+
+    @mock_aws
+    def test_no_ssm_policy_policy_engine_reports_compliant_instances(self):
+
+        ec2 = boto3.client('ec2', region_name=REGION)
+        ec2.run_instances(ImageId=AMI, MinCount=2, MaxCount=2)
+        findings = []
+
+        result = check_remove_ssm_policy(REGION, engine=ENGINE_POLICY, sink=findings.append)
+
+        assert "Success" == result['status']
+        assert [finding['verdict'] for finding in findings] == [VERDICT_COMPLIANT] * 2
+
+    @mock_aws
+    def test_check_remove_ssm_policy_unknown_engine(self):
+
+        with patch('code.ec2_check_remove_ssm_policy.describe_instance_records') as mock_describe:
+            result = check_remove_ssm_policy(REGION, engine="instances")
+
+        # A misspelt engine is rejected instead of running the instance engine
+        assert "Error" == result['status']
+        assert result['reason'] == "Unknown engine 'instances', expected one of instance, policy, account"
+        mock_describe.assert_not_called()
+
+    @mock_aws
+    def test_check_remove_ssm_policy_account_engine(self):
+
+        iam = boto3.client('iam', region_name=REGION)
+        profile_arn = self._create_ssm_instance_profile(iam)
+        iam.put_role_policy(RoleName=ROLE_NAME, PolicyName='inline-ssm', PolicyDocument=SSM_INSTANCE_POLICY)
+
+        ec2 = boto3.client('ec2', region_name=REGION)
+        for _ in range(2):
+            ec2.run_instances(ImageId=AMI, MinCount=1, MaxCount=1, IamInstanceProfile={'Arn': profile_arn})
+
+        matcher = PolicyMatcher(names=["AmazonSSMManagedInstanceCore"], actions=["ssmmessages:Open*"])
+        with patch('code.helpers.get_instance_profile') as mock_get_profile, \
+                patch('code.helpers.list_attached_policies') as mock_list_policies:
+            result = check_remove_ssm_policy(REGION, engine=ENGINE_ACCOUNT, matcher=matcher)
+
+        # Both the managed and the inline policy are removed, without per-profile or per-role IAM lookups
+        assert "Success" == result['status']
+        assert result['reason'] == ("Detached policy/-ies AmazonSSMManagedInstanceCore and deleted inline "
+                                    "policy/-ies inline-ssm from the roles of 1 instance/-s")
+        assert result['authorization']['profiles'] == 1
+        mock_get_profile.assert_not_called()
+        mock_list_policies.assert_not_called()
+        assert iam.list_attached_role_policies(RoleName=ROLE_NAME)['AttachedPolicies'] == []
+        assert iam.list_role_policies(RoleName=ROLE_NAME)['PolicyNames'] == []
+
+    @mock_aws
+    def test_no_forbidden_policy_account_engine_reports_compliant_instances(self):
+
+        ec2 = boto3.client('ec2', region_name=REGION)
+        ec2.run_instances(ImageId=AMI, MinCount=2, MaxCount=2)
+        findings = []
+
+        result = check_remove_ssm_policy(REGION, engine=ENGINE_ACCOUNT, sink=findings.append)
+
+        assert "Success" == result['status']
+        assert "No instances with forbidden policies" in result['reason']
+        assert [finding['verdict'] for finding in findings] == [VERDICT_COMPLIANT] * 2
+
 if __name__ == '__main__':
     unittest.main()
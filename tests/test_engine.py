@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+import time
+import unittest
+import logging
+from unittest.mock import patch
+import boto3
+from moto import mock_aws
+from code.engine import CHECKS, Check, CheckContext, register_check, run_check, run_pipeline
+from code.helpers import detach_policy
+from code.state_store import StateStore
+from tests.test_ec2_check_remove_ssm_policy import ROLE_POLICY_DOC, SSM_INSTANCE_POLICY
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGION: str = 'us-west-2'
+AMI: str = 'ami-061392db613a6357b'
+
+
+class CountingCheck(Check):
+    """Check over plain integers that records how many were discovered."""
+
+    name = "counting"
+
+    def __init__(self, context: CheckContext, total: int = 100) -> None:
+        super().__init__(context)
+        self.total = total
+        self.discovered = 0
+
+    def discover(self):
+        for number in range(self.total):
+            self.discovered += 1
+            yield number
+
+    def resource_id(self, resource):
+        return str(resource)
+
+    def evaluate(self, resource):
+        if resource < 0:
+            raise ValueError("negative")
+        return [{"action": "noop"}] if resource % 2 else []
+
+    def remediate(self, resource, action):
+        return True
+
+
+class TestEngine(unittest.TestCase):
+    """Unit tests for the check registry and pipeline engine."""
+
+    def setUp(self) -> None:
+        """Set up the mock AWS environment."""
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+
+    def tearDown(self) -> None:
+        """Clean up the mock AWS environment."""
+        self.mock_aws.stop()
+
+    def test_builtin_checks_are_registered(self) -> None:
+        """Test that the built-in checks register themselves."""
+        run_check('rds', REGION)
+
+        self.assertTrue({'ec2', 'rds', 's3'} <= set(CHECKS))
+
+    def test_ec2_check_detaches_shared_role_once(self) -> None:
+        """Test the EC2 plugin against instances sharing one instance profile."""
+        iam = boto3.client('iam', region_name=REGION)
+        profile_arn = iam.create_instance_profile(InstanceProfileName='profile')['InstanceProfile']['Arn']
+        iam.create_role(RoleName='role', AssumeRolePolicyDocument=ROLE_POLICY_DOC)
+        policy = iam.create_policy(PolicyName='AmazonSSMManagedInstanceCore', PolicyDocument=SSM_INSTANCE_POLICY)
+        iam.attach_role_policy(RoleName='role', PolicyArn=policy['Policy']['Arn'])
+        iam.add_role_to_instance_profile(InstanceProfileName='profile', RoleName='role')
+        ec2 = boto3.client('ec2', region_name=REGION)
+        for _ in range(4):
+            ec2.run_instances(ImageId=AMI, MinCount=1, MaxCount=1, IamInstanceProfile={'Arn': profile_arn})
+
+        with patch('code.helpers.detach_policy', wraps=detach_policy) as mock_detach:
+            result = run_check('ec2', REGION, max_workers=4)
+
+        self.assertEqual(result['status'], "Success")
+        self.assertEqual(result['verdicts'].get('remediated'), 1)
+        self.assertEqual(len(result['findings']), 4)
+        self.assertEqual(mock_detach.call_count, 1)
+
+    def test_ec2_check_account_engine_option(self) -> None:
+        """Test that the EC2 plugin's account engine removes the managed and inline policies the matcher forbids."""
+        iam = boto3.client('iam', region_name=REGION)
+        profile_arn = iam.create_instance_profile(InstanceProfileName='profile')['InstanceProfile']['Arn']
+        iam.create_role(RoleName='role', AssumeRolePolicyDocument=ROLE_POLICY_DOC)
+        policy = iam.create_policy(PolicyName='AmazonSSMManagedInstanceCore', PolicyDocument=SSM_INSTANCE_POLICY)
+        iam.attach_role_policy(RoleName='role', PolicyArn=policy['Policy']['Arn'])
+        iam.put_role_policy(RoleName='role', PolicyName='inline-ssm', PolicyDocument=SSM_INSTANCE_POLICY)
+        iam.add_role_to_instance_profile(InstanceProfileName='profile', RoleName='role')
+        ec2 = boto3.client('ec2', region_name=REGION)
+        for _ in range(2):
+            ec2.run_instances(ImageId=AMI, MinCount=1, MaxCount=1, IamInstanceProfile={'Arn': profile_arn})
+        ec2.run_instances(ImageId=AMI, MinCount=1, MaxCount=1)
+
+        result = run_check('ec2', REGION, max_workers=1,
+                           options={'engine': 'account', 'forbid_action': ['ssmmessages:Open*']})
+
+        self.assertEqual(result['status'], "Success")
+        self.assertEqual(result['verdicts'], {'compliant': 2, 'remediated': 1})
+        self.assertEqual(result['authorization']['profiles'], 1)
+        self.assertEqual(iam.list_attached_role_policies(RoleName='role')['AttachedPolicies'], [])
+        self.assertEqual(iam.list_role_policies(RoleName='role')['PolicyNames'], [])
+
+    def test_ec2_check_rejects_unknown_engine(self) -> None:
+        """Test that the EC2 plugin rejects an engine option it does not know."""
+        with self.assertRaises(ValueError):
+            run_check('ec2', REGION, options={'engine': 'instances'})
+
+    def test_s3_check_block_remediation_option(self) -> None:
+        """Test that the S3 plugin enables the Public Access Block, and checks no bucket behind the account's."""
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket='public-bucket')
+        s3.put_bucket_policy(Bucket='public-bucket', Policy=json.dumps({
+            'Version': '2012-10-17',
+            'Statement': [{'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject',
+                           'Resource': 'arn:aws:s3:::public-bucket/*'}]
+        }))
+
+        result = run_check('s3', 'us-east-1', options={'remediation': 'block'})
+
+        self.assertEqual(result['verdicts'], {'remediated': 1})
+        self.assertTrue(s3.get_public_access_block(Bucket='public-bucket')
+                        ['PublicAccessBlockConfiguration']['RestrictPublicBuckets'])
+        self.assertIn('Policy', s3.get_bucket_policy(Bucket='public-bucket'))
+        result = run_check('s3', 'us-east-1', options={'remediation': 'block'})
+        self.assertEqual((result['verdicts'], result['avoided_calls']), ({'compliant': 1}, 1))
+
+        s3.delete_public_access_block(Bucket='public-bucket')
+        account_id = boto3.client('sts', region_name='us-east-1').get_caller_identity()['Account']
+        boto3.client('s3control', region_name='us-east-1').put_public_access_block(
+            AccountId=account_id, PublicAccessBlockConfiguration={'BlockPublicPolicy': True,
+                                                                  'RestrictPublicBuckets': True}
+        )
+        result = run_check('s3', 'us-east-1', options={'remediation': 'block'})
+
+        self.assertEqual((result['verdicts'], result['avoided_calls']), ({'compliant': 1}, 2))
+
+    def test_rds_check_tracks_modifications_and_reports_clusters(self) -> None:
+        """Test that the RDS plugin confirms its modifications and reports public Multi-AZ DB clusters."""
+        rds = boto3.client('rds', region_name=REGION)
+        rds.create_db_instance(DBInstanceIdentifier='test-db', AllocatedStorage=20, DBInstanceClass='db.t4g.micro',
+                               Engine='mysql', MasterUsername='admin', MasterUserPassword='password',
+                               PubliclyAccessible=True)
+        rds.create_db_cluster(DBClusterIdentifier='multi-az', Engine='mysql', DBClusterInstanceClass='db.m5d.large',
+                              AllocatedStorage=100, StorageType='io1', Iops=1000, MasterUsername='admin',
+                              MasterUserPassword='password', PubliclyAccessible=True)
+
+        result = run_check('rds', REGION)
+
+        self.assertEqual(list(result['time_to_private']), ['test-db'])
+        self.assertEqual((result['pending'], result['polls']), ([], 1))
+        self.assertEqual(result['public_clusters'], ['multi-az'])
+        self.assertEqual(result['verdicts'], {'non_compliant': 1, 'remediated': 1})
+
+    def test_rds_check_reports_without_remediating(self) -> None:
+        """Test that a dry run reports actions without performing them."""
+        rds = boto3.client('rds', region_name=REGION)
+        rds.create_db_instance(
+            DBInstanceIdentifier='test-db',
+            AllocatedStorage=20,
+            DBInstanceClass='db.t4g.micro',
+            Engine='mysql',
+            MasterUsername='admin',
+            MasterUserPassword='password',
+            PubliclyAccessible=True
+        )
+
+        result = run_check('rds', REGION, remediate=False)
+
+        self.assertEqual(result['verdicts'], {'non_compliant': 1})
+        self.assertEqual(result['findings'][0]['actions'][0]['action'], 'modify_db_instance')
+        self.assertTrue(rds.describe_db_instances()['DBInstances'][0]['PubliclyAccessible'])
+
+    def test_pipeline_applies_backpressure(self) -> None:
+        """Test that discovery pauses while the caller does not consume findings."""
+        check = CountingCheck(CheckContext(REGION), total=1000)
+
+        findings = run_pipeline(check, max_workers=2, queue_size=4)
+        next(findings)
+        time.sleep(0.3)
+        discovered = check.discovered
+        findings.close()
+
+        self.assertLess(discovered, 50)
+
+    def test_pipeline_reports_every_resource(self) -> None:
+        """Test that every resource produces exactly one finding with a consistent shape."""
+        check = CountingCheck(CheckContext(REGION), total=20)
+
+        findings = list(run_pipeline(check, max_workers=3, queue_size=2))
+
+        self.assertEqual(sorted(int(f['resource_id']) for f in findings), list(range(20)))
+        self.assertEqual(sum(1 for f in findings if f['verdict'] == 'remediated'), 10)
+        self.assertTrue(all(f['region'] == REGION and f['check'] == 'counting' for f in findings))
+
+    def test_register_custom_check(self) -> None:
+        """Test that a custom check registers and runs through run_check."""
+        @register_check
+        class FailingCheck(CountingCheck):
+            name = "failing"
+
+            def discover(self):
+                yield 1
+                yield -1
+
+        try:
+            result = run_check('failing', REGION)
+        finally:
+            CHECKS.pop('failing')
+
+        self.assertEqual(result['status'], "Error")
+        self.assertEqual(result['verdicts'], {'error': 1, 'remediated': 1})
+
+    def test_fingerprint_errors_become_findings(self) -> None:
+        """Test that a resource whose fingerprint cannot be built gets an error finding instead of stopping the run."""
+        class FingerprintFailingCheck(CountingCheck):
+            def fingerprint(self, resource):
+                if resource == 3:
+                    raise ValueError("lookup failed")
+                return {'number': resource}
+
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        store = StateStore(path)
+        check = FingerprintFailingCheck(CheckContext(REGION), total=5)
+
+        findings = list(run_pipeline(check, max_workers=2, state_store=store))
+        store.close()
+
+        errors = [f for f in findings if f['verdict'] == 'error']
+        self.assertEqual(len(findings), 5)
+        self.assertEqual([(f['resource_id'], f['reason']) for f in errors], [('3', "Unexpected error: lookup failed")])
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import unittest
+import logging
+from typing import Any, Dict, List
+from unittest.mock import patch
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_aws
+from code.events import ROLE_TARGET, SqsSource, Target, batch_messages, event_targets, read_messages, run_events
+from code.findings import VERDICT_ERROR, VERDICT_SKIPPED
+from code.state_store import VERDICT_REMEDIATED
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGION: str = 'us-east-1'
+BUCKET_NAME: str = 'event-bucket'
+ROLE_NAME: str = 'event-role'
+SSM_POLICY_NAME: str = 'AmazonSSMManagedInstanceCore'
+PUBLIC_POLICY = json.dumps({
+    'Version': '2012-10-17',
+    'Statement': [{'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject',
+                   'Resource': f'arn:aws:s3:::{BUCKET_NAME}/*'}]
+})
+
+
+def cloudtrail_record(name: str, parameters: Dict[str, Any], **fields: Any) -> Dict[str, Any]:
+    """Build a CloudTrail record of a successful call."""
+    return {'eventName': name, 'awsRegion': REGION, 'requestParameters': parameters, **fields}
+
+
+class TestEvents(unittest.TestCase):
+    """Unit tests for the event-driven remediation mode."""
+
+    def setUp(self) -> None:
+        """Set up the mock AWS environment."""
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+
+    def tearDown(self) -> None:
+        """Clean up the mock AWS environment."""
+        self.mock_aws.stop()
+
+    def test_event_targets(self) -> None:
+        """Test that relevant events map to the resources they name and other events are ignored."""
+        self.assertEqual(event_targets(cloudtrail_record('PutBucketPolicy', {'bucketName': BUCKET_NAME})),
+                         [Target('s3', REGION, BUCKET_NAME)])
+        association = cloudtrail_record('AssociateIamInstanceProfile', {
+            'AssociateIamInstanceProfileRequest': {'InstanceId': 'i-0123456789abcdef0'}
+        })
+        self.assertEqual(event_targets(association), [Target('ec2', REGION, 'i-0123456789abcdef0')])
+        attach = cloudtrail_record('AttachRolePolicy', {
+            'roleName': ROLE_NAME, 'policyArn': f'arn:aws:iam::aws:policy/{SSM_POLICY_NAME}'
+        })
+        self.assertEqual(event_targets(attach), [Target(ROLE_TARGET, REGION, ROLE_NAME)])
+
+        self.assertEqual(event_targets(cloudtrail_record('AttachRolePolicy', {
+            'roleName': ROLE_NAME, 'policyArn': 'arn:aws:iam::aws:policy/ReadOnlyAccess'
+        })), [])
+        self.assertEqual(event_targets(cloudtrail_record('ModifyDBInstance', {'dBInstanceIdentifier': 'db'},
+                                                         errorCode='AccessDenied')), [])
+        self.assertEqual(event_targets(cloudtrail_record('GetObject', {'bucketName': BUCKET_NAME})), [])
+
+    def test_batches_deduplicate_and_split(self) -> None:
+        """Test that repeated events of a resource are checked once and batches respect their size limit."""
+        record = cloudtrail_record('PutBucketPolicy', {'bucketName': BUCKET_NAME})
+        other = cloudtrail_record('ModifyDBInstance', {'dBInstanceIdentifier': 'db-1'})
+        third = cloudtrail_record('ModifyDBInstance', {'dBInstanceIdentifier': 'db-2'})
+        messages = [([record, record], None), ([other], 'receipt-1'), ([third, record], 'receipt-2')]
+
+        batches = list(batch_messages(messages, window=60, max_batch=2))
+
+        self.assertEqual(batches[0], ([Target('s3', REGION, BUCKET_NAME), Target('rds', REGION, 'db-1')],
+                                      {'receipt-1': [Target('rds', REGION, 'db-1')]}, 3))
+        self.assertEqual(batches[1], ([Target('rds', REGION, 'db-2'), Target('s3', REGION, BUCKET_NAME)],
+                                      {'receipt-2': [Target('rds', REGION, 'db-2'),
+                                                     Target('s3', REGION, BUCKET_NAME)]}, 2))
+
+    def test_file_events_check_only_named_resources(self) -> None:
+        """Test that events read from a stream remediate only the resources they name."""
+        s3 = boto3.client('s3', region_name=REGION)
+        for bucket in (BUCKET_NAME, 'untouched-bucket'):
+            s3.create_bucket(Bucket=bucket)
+            s3.put_bucket_policy(Bucket=bucket, Policy=PUBLIC_POLICY.replace(BUCKET_NAME, bucket))
+        boto3.client('rds', region_name=REGION).create_db_instance(
+            DBInstanceIdentifier='db-1', AllocatedStorage=20, DBInstanceClass='db.t4g.micro', Engine='mysql',
+            MasterUsername='admin', MasterUserPassword='password', PubliclyAccessible=True
+        )
+        events = [
+            cloudtrail_record('PutBucketPolicy', {'bucketName': BUCKET_NAME}),
+            {'detail-type': 'AWS API Call via CloudTrail', 'region': REGION,
+             'detail': {'eventName': 'PutBucketPolicy', 'requestParameters': {'bucketName': BUCKET_NAME}}},
+            {'Records': [cloudtrail_record('ModifyDBInstance', {'dBInstanceIdentifier': 'db-1'}),
+                         cloudtrail_record('ModifyDBInstance', {'dBInstanceIdentifier': 'db-gone'})]},
+        ]
+        findings: List[Dict[str, Any]] = []
+
+        stream = io.StringIO("\n".join(json.dumps(event) for event in events) + "\n")
+        result = run_events(read_messages(stream), REGION, window=0.1, sink=findings.append)
+
+        self.assertEqual(result['status'], "Success")
+        self.assertEqual(result['events'], 4)
+        self.assertEqual(result['targets'], 3)
+        self.assertEqual(result['verdicts'], {'s3': {VERDICT_REMEDIATED: 1},
+                                              'rds': {VERDICT_REMEDIATED: 1, VERDICT_SKIPPED: 1}})
+        self.assertEqual(len(findings), 3)
+        with self.assertRaises(s3.exceptions.ClientError):
+            s3.get_bucket_policy(Bucket=BUCKET_NAME)
+        self.assertIn('Policy', s3.get_bucket_policy(Bucket='untouched-bucket'))
+
+    def test_sqs_events_resolve_roles_and_delete_messages(self) -> None:
+        """Test that a role event checks the instances using the role and its message is deleted afterwards."""
+        iam = boto3.client('iam', region_name=REGION)
+        iam.create_role(RoleName=ROLE_NAME, AssumeRolePolicyDocument='{}')
+        policy_arn = iam.create_policy(PolicyName=SSM_POLICY_NAME, PolicyDocument=json.dumps({
+            'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': 'ssm:*', 'Resource': '*'}]
+        }))['Policy']['Arn']
+        iam.attach_role_policy(RoleName=ROLE_NAME, PolicyArn=policy_arn)
+        iam.create_instance_profile(InstanceProfileName='event-profile')
+        iam.add_role_to_instance_profile(InstanceProfileName='event-profile', RoleName=ROLE_NAME)
+        ec2 = boto3.client('ec2', region_name=REGION)
+        ec2.run_instances(ImageId='ami-12345678', MinCount=1, MaxCount=1, IamInstanceProfile={'Name': 'event-profile'})
+        ec2.run_instances(ImageId='ami-12345678', MinCount=1, MaxCount=1)
+
+        sqs = boto3.client('sqs', region_name=REGION)
+        queue_url = sqs.create_queue(QueueName='policy-events')['QueueUrl']
+        record = cloudtrail_record('AttachRolePolicy', {'roleName': ROLE_NAME, 'policyArn': policy_arn})
+        for _ in range(2):
+            sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps({'detail': record, 'region': REGION}))
+
+        result = run_events(SqsSource(queue_url, REGION, wait_seconds=0, stop_when_empty=True), REGION, window=0.1)
+
+        self.assertEqual(result['events'], 2)
+        self.assertEqual(result['verdicts'], {'ec2': {VERDICT_REMEDIATED: 1}})
+        self.assertEqual(iam.list_attached_role_policies(RoleName=ROLE_NAME)['AttachedPolicies'], [])
+        attributes = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['All'])['Attributes']
+        self.assertEqual(attributes['ApproximateNumberOfMessages'], '0')
+        self.assertEqual(attributes['ApproximateNumberOfMessagesNotVisible'], '0')
+
+    def test_sqs_messages_with_errors_are_kept(self) -> None:
+        """Test that only the messages whose resources were checked without errors are deleted."""
+        s3 = boto3.client('s3', region_name=REGION)
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        s3.put_bucket_policy(Bucket=BUCKET_NAME, Policy=PUBLIC_POLICY)
+        boto3.client('rds', region_name=REGION).create_db_instance(
+            DBInstanceIdentifier='db-1', AllocatedStorage=20, DBInstanceClass='db.t4g.micro', Engine='mysql',
+            MasterUsername='admin', MasterUserPassword='password', PubliclyAccessible=True
+        )
+        sqs = boto3.client('sqs', region_name=REGION)
+        queue_url = sqs.create_queue(QueueName='policy-events')['QueueUrl']
+        for record in (cloudtrail_record('PutBucketPolicy', {'bucketName': BUCKET_NAME}),
+                       cloudtrail_record('ModifyDBInstance', {'dBInstanceIdentifier': 'db-1'})):
+            sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps({'Records': [record]}))
+        denied = ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'denied'}}, 'ModifyDBInstance')
+
+        with patch('code.checks.modify_db_instance', side_effect=denied):
+            result = run_events(SqsSource(queue_url, REGION, wait_seconds=0, stop_when_empty=True), REGION,
+                                window=0.1)
+
+        self.assertEqual(result['status'], "Error")
+        self.assertEqual(result['verdicts'], {'s3': {VERDICT_REMEDIATED: 1}, 'rds': {VERDICT_ERROR: 1}})
+        attributes = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['All'])['Attributes']
+        self.assertEqual(attributes['ApproximateNumberOfMessagesNotVisible'], '1')
+
+    def test_sqs_messages_of_unresolved_roles_are_kept(self) -> None:
+        """Test that a role that cannot be resolved gives error findings and keeps its message, not stopping the run."""
+        s3 = boto3.client('s3', region_name=REGION)
+        s3.create_bucket(Bucket=BUCKET_NAME)
+        s3.put_bucket_policy(Bucket=BUCKET_NAME, Policy=PUBLIC_POLICY)
+        sqs = boto3.client('sqs', region_name=REGION)
+        queue_url = sqs.create_queue(QueueName='policy-events')['QueueUrl']
+        for record in (cloudtrail_record('PutBucketPolicy', {'bucketName': BUCKET_NAME}),
+                       cloudtrail_record('AttachRolePolicy', {'roleName': 'missing-role',
+                                                                'policyArn': f'arn:aws:iam::aws:policy/{SSM_POLICY_NAME}'})):
+            sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps({'Records': [record]}))
+        findings: List[Dict[str, Any]] = []
+        missing = ClientError({'Error': {'Code': 'NoSuchEntity', 'Message': 'missing'}}, 'ListInstanceProfilesForRole')
+
+        with patch('code.events.list_role_instance_profiles', side_effect=missing):
+            result = run_events(SqsSource(queue_url, REGION, wait_seconds=0, stop_when_empty=True), REGION,
+                                window=0.1, sink=findings.append)
+
+        self.assertEqual(result['status'], "Error")
+        self.assertEqual(result['verdicts'], {ROLE_TARGET: {VERDICT_ERROR: 1}, 's3': {VERDICT_REMEDIATED: 1}})
+        self.assertEqual([f['resource_id'] for f in findings if f['verdict'] == VERDICT_ERROR], ['missing-role'])
+        attributes = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['All'])['Attributes']
+        self.assertEqual(attributes['ApproximateNumberOfMessagesNotVisible'], '1')
+
+    def test_unreadable_input_is_reported(self) -> None:
+        """Test that input of several pretty-printed documents is reported as bad input instead of raising."""
+        document = json.dumps({'Records': [cloudtrail_record('PutBucketPolicy', {'bucketName': BUCKET_NAME})]},
+                              indent=2)
+
+        result = run_events(read_messages(io.StringIO(document + "\n" + document)), REGION, window=0.1)
+
+        self.assertEqual(result['status'], "Error")
+        self.assertTrue(result['reason'].startswith("Bad event input: line 1"))
+        self.assertEqual((result['events'], result['batches']), (0, 0))
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
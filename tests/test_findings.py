@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+import os
+import tempfile
+import unittest
+import logging
+from typing import Any, Dict, List
+import boto3
+from moto import mock_aws
+from code.findings import NdjsonWriter, account_sink, make_finding
+from code.rds_check_remove_public_access import check_remove_public_access
+from code.s3_check_remove_public_access import main as s3_main
+from code.state_store import VERDICT_COMPLIANT, VERDICT_REMEDIATED
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGION: str = 'us-west-2'
+
+
+class TestFindings(unittest.TestCase):
+    """Unit tests for per-resource findings and their NDJSON output."""
+
+    def setUp(self) -> None:
+        """Set up the mock AWS environment."""
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+
+    def tearDown(self) -> None:
+        """Clean up the mock AWS environment."""
+        self.mock_aws.stop()
+
+    def test_writer_buffers_lines(self) -> None:
+        """Test that findings are written in batches of the buffer size and flushed on close."""
+        stream = io.StringIO()
+        writer = NdjsonWriter(stream, buffer_size=2)
+
+        for index in range(3):
+            writer(make_finding('rds', REGION, f'db-{index}', VERDICT_COMPLIANT))
+        self.assertEqual(len(stream.getvalue().splitlines()), 2)
+        writer.close()
+
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([line['resource_id'] for line in lines], ['db-0', 'db-1', 'db-2'])
+        self.assertEqual(writer.count, 3)
+
+    def test_writer_opens_and_closes_files(self) -> None:
+        """Test that a path target is written to and closed by the writer."""
+        handle, path = tempfile.mkstemp(suffix='.ndjson')
+        os.close(handle)
+        try:
+            with NdjsonWriter(path) as writer:
+                account_sink(writer, {'AccountId': '111111111111'})(make_finding('s3', None, 'bucket', 'skipped'))
+            with open(path) as f:
+                self.assertEqual(json.loads(f.read())['account'], '111111111111')
+        finally:
+            os.remove(path)
+
+    def test_checkers_stream_one_finding_per_resource(self) -> None:
+        """Test that checkers pass each resource's finding to the sink as it is processed."""
+        rds = boto3.client('rds', region_name=REGION)
+        for index in range(2):
+            rds.create_db_instance(DBInstanceIdentifier=f'db-{index}', AllocatedStorage=20,
+                                   DBInstanceClass='db.t4g.micro', Engine='mysql', MasterUsername='admin',
+                                   MasterUserPassword='password', PubliclyAccessible=index == 0)
+        boto3.client('s3', region_name=REGION).create_bucket(
+            Bucket='findings-bucket', CreateBucketConfiguration={'LocationConstraint': REGION}
+        )
+        findings: List[Dict[str, Any]] = []
+
+        rds_result = check_remove_public_access(REGION, sink=findings.append)
+        s3_result = s3_main(REGION, sink=findings.append)
+
+        self.assertEqual(rds_result['status'], "Success")
+        self.assertNotIn('buckets', s3_result)
+        self.assertEqual(s3_result['verdicts'], {VERDICT_COMPLIANT: 1})
+        verdicts = {finding['resource_id']: finding['verdict'] for finding in findings}
+        self.assertEqual(verdicts, {'db-0': VERDICT_REMEDIATED, 'db-1': VERDICT_COMPLIANT,
+                                    'findings-bucket': VERDICT_COMPLIANT})
+        remediated = next(finding for finding in findings if finding['resource_id'] == 'db-0')
+        self.assertEqual(remediated['actions'][0]['action'], "modify_db_instance")
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
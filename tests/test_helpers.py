@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+from unittest.mock import MagicMock, patch
+import boto3
+from moto import mock_aws
+from botocore.config import Config
+from botocore.stub import Stubber
+from code.helpers import (ANY_INSTANCE_PROFILE_ARN, ClientPool, IamCache, S3ClientRouter, InstanceRecord,
+                          describe_instances, describe_instance_records, describe_db_instance_records,
+                          instance_filters)
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGION: str = 'us-west-2'
+AMI: str = 'ami-061392db613a6357b'
+
+
+class TestHelpers(unittest.TestCase):
+    """Unit tests for the shared helper functions."""
+
+    def setUp(self) -> None:
+        """Set up the mock AWS environment."""
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+        self.ec2 = boto3.client('ec2', region_name=REGION)
+
+    def tearDown(self) -> None:
+        """Clean up the mock AWS environment."""
+        self.mock_aws.stop()
+
+    def test_describe_instances_paginates(self) -> None:
+        """Test that instances beyond the first page are yielded."""
+        self.ec2.run_instances(ImageId=AMI, MinCount=12, MaxCount=12)
+
+        instances = list(describe_instances(self.ec2, page_size=5))
+
+        self.assertEqual(len(instances), 12)
+        self.assertEqual(len({instance['InstanceId'] for instance in instances}), 12)
+
+    def test_describe_instances_yields_instances(self) -> None:
+        """Test that describe_instances yields instance descriptions directly."""
+        self.ec2.run_instances(ImageId=AMI, MinCount=1, MaxCount=1)
+
+        instances = describe_instances(self.ec2)
+
+        self.assertEqual(next(instances)['ImageId'], AMI)
+
+    def test_describe_instance_records_projects_fields(self) -> None:
+        """Test that instance records keep only the fields the checkers need, without a __dict__."""
+        self.ec2.run_instances(ImageId=AMI, MinCount=7, MaxCount=7)
+
+        records = list(describe_instance_records(self.ec2, page_size=5))
+
+        self.assertEqual(len(records), 7)
+        self.assertTrue(all(isinstance(record, InstanceRecord) for record in records))
+        self.assertEqual(records[0].state, 'running')
+        self.assertIsNone(records[0].profile_arn)
+        self.assertFalse(hasattr(records[0], '__dict__'))
+        self.assertEqual(InstanceRecord.from_instance({'InstanceId': 'i-1'}), InstanceRecord('i-1'))
+
+    def test_instance_filters_leave_out_terminated_instances(self) -> None:
+        """Test that the state filter is applied by the API, so terminated instances are never returned."""
+        instance_ids = [instance['InstanceId'] for instance in
+                        self.ec2.run_instances(ImageId=AMI, MinCount=3, MaxCount=3)['Instances']]
+        self.ec2.terminate_instances(InstanceIds=instance_ids[:1])
+
+        records = list(describe_instance_records(self.ec2, page_size=5, filters=instance_filters()))
+
+        self.assertEqual(sorted(record.instance_id for record in records), sorted(instance_ids[1:]))
+        self.assertEqual(len(list(describe_instance_records(self.ec2, page_size=5))), 3)
+
+    def test_instance_filters_are_sent_with_every_page(self) -> None:
+        """Test that state and profile filters are pushed to DescribeInstances on every page."""
+        ec2_client = boto3.client('ec2', region_name=REGION)
+        filters = instance_filters(profile_arns=[ANY_INSTANCE_PROFILE_ARN])
+        self.assertEqual([item['Name'] for item in filters], ['instance-state-name', 'iam-instance-profile.arn'])
+        instance = {'InstanceId': 'i-1', 'State': {'Name': 'running'},
+                    'IamInstanceProfile': {'Arn': 'arn:aws:iam::123456789012:instance-profile/web'}}
+        with Stubber(ec2_client) as stubber:
+            stubber.add_response('describe_instances', {'Reservations': [{'Instances': [instance]}], 'NextToken': 't'},
+                                 {'MaxResults': 5, 'Filters': filters})
+            stubber.add_response('describe_instances', {'Reservations': []},
+                                 {'MaxResults': 5, 'Filters': filters, 'NextToken': 't'})
+
+            records = list(describe_instance_records(ec2_client, page_size=5, filters=filters))
+
+        self.assertEqual([record.profile_name for record in records], ['web'])
+
+    def test_describe_db_instance_records_paginates(self) -> None:
+        """Test that RDS instances are described page by page and projected into records."""
+        rds_client = boto3.client('rds', region_name=REGION)
+        for index in range(3):
+            rds_client.create_db_instance(DBInstanceIdentifier=f'db-{index}', AllocatedStorage=20,
+                                          DBInstanceClass='db.t4g.micro', Engine='mysql',
+                                          MasterUsername='admin', MasterUserPassword='password',
+                                          PubliclyAccessible=index == 0)
+
+        records = list(describe_db_instance_records(rds_client, page_size=20))
+
+        self.assertEqual(sorted(record.identifier for record in records), ['db-0', 'db-1', 'db-2'])
+        self.assertEqual([record.identifier for record in records if record.publicly_accessible], ['db-0'])
+
+    def test_iam_cache_hits_and_evicts(self) -> None:
+        """Test that repeat lookups hit the cache and the oldest entry is evicted."""
+        iam_client = MagicMock()
+        iam_client.get_instance_profile.side_effect = lambda InstanceProfileName: {'Name': InstanceProfileName}
+        iam_cache = IamCache(iam_client, max_size=2)
+
+        iam_cache.get_instance_profile('a')
+        iam_cache.get_instance_profile('b')
+        iam_cache.get_instance_profile('a')
+        iam_cache.get_instance_profile('c')
+        iam_cache.get_instance_profile('b')
+
+        self.assertEqual(iam_cache.stats(), {"hits": 1, "misses": 4})
+        self.assertEqual(iam_client.get_instance_profile.call_count, 4)
+
+    def test_iam_cache_detaches_once(self) -> None:
+        """Test that a role's policy is only detached once per run."""
+        iam_client = MagicMock()
+        iam_cache = IamCache(iam_client)
+
+        self.assertTrue(iam_cache.detach_policy('role', 'arn:aws:iam::aws:policy/test'))
+        self.assertFalse(iam_cache.detach_policy('role', 'arn:aws:iam::aws:policy/test'))
+        iam_client.detach_role_policy.assert_called_once()
+
+    def test_s3_client_router_caches_locations(self) -> None:
+        """Test that bucket locations are looked up once and routed to regional clients."""
+        s3 = boto3.client('s3', region_name=REGION)
+        boto3.client('s3', region_name='eu-west-1').create_bucket(
+            Bucket='router-bucket',
+            CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'}
+        )
+        router = S3ClientRouter(s3)
+
+        with patch.object(s3, 'get_bucket_location', wraps=s3.get_bucket_location) as mock_location:
+            first = router.get_client('router-bucket')
+            second = router.get_client('router-bucket')
+
+        self.assertIs(first, second)
+        self.assertEqual(first.meta.region_name, 'eu-west-1')
+        mock_location.assert_called_once()
+
+    def test_client_pool_reuses_clients(self) -> None:
+        """Test that the pool creates each client once per service, region and credentials."""
+        pool = ClientPool(config=Config(max_pool_connections=64, retries={'mode': 'adaptive'}))
+        credentials = {'AccessKeyId': 'AKIA', 'SecretAccessKey': 'secret', 'SessionToken': 'token'}
+
+        client = pool.get_client('ec2', REGION)
+
+        self.assertIs(pool.get_client('ec2', REGION), client)
+        self.assertIsNot(pool.get_client('ec2', 'eu-west-1'), client)
+        self.assertIsNot(pool.get_client('ec2', REGION, credentials), client)
+        self.assertIs(pool.get_client('ec2', REGION, credentials), pool.get_client('ec2', REGION, dict(credentials)))
+        self.assertEqual(client.meta.config.max_pool_connections, 64)
+        self.assertEqual(client.meta.config.retries['mode'], 'adaptive')
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
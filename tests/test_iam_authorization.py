@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+import logging
+import boto3
+from moto import mock_aws
+from code.iam_authorization import AuthorizationDetails, PolicyMatcher
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGION: str = 'us-east-1'
+ROLE_NAME: str = 'app-role'
+
+
+def policy_document(*actions: str, effect: str = 'Allow') -> str:
+    """Build a policy document allowing or denying the given actions."""
+    return json.dumps({'Version': '2012-10-17',
+                       'Statement': [{'Effect': effect, 'Action': list(actions), 'Resource': '*'}]})
+
+
+class TestIamAuthorization(unittest.TestCase):
+    """Unit tests for the account-wide IAM indexes and the policy matcher."""
+
+    def setUp(self) -> None:
+        """Set up the mock AWS environment."""
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+
+    def tearDown(self) -> None:
+        """Clean up the mock AWS environment."""
+        self.mock_aws.stop()
+
+    def test_matcher_by_name_arn_and_action(self) -> None:
+        """Test that policies are matched by name, ARN and allowed actions, including wildcards on both sides."""
+        matcher = PolicyMatcher.from_values(
+            ['AmazonSSMManagedInstanceCore', 'arn:aws:iam::aws:policy/AdministratorAccess'],
+            actions=['ssm:*', 'iam:PassRole']
+        )
+
+        self.assertEqual(matcher.match('AmazonSSMManagedInstanceCore'), "name")
+        self.assertEqual(matcher.match('Admin', 'arn:aws:iam::aws:policy/AdministratorAccess'), "arn")
+        self.assertEqual(matcher.match('inline', None, policy_document('SSM:GetParameter')), "action:SSM:GetParameter")
+        self.assertEqual(matcher.match('inline', None, policy_document('iam:Pass*')), "action:iam:Pass*")
+        self.assertEqual(matcher.match('inline', None, policy_document('*')), "action:*")
+        self.assertIsNone(matcher.match('inline', None, policy_document('s3:GetObject', 'iam:PassRoleX')))
+        self.assertIsNone(matcher.match('inline', None, policy_document('ssm:*', effect='Deny')))
+        self.assertFalse(PolicyMatcher(names=['x']).needs_documents)
+
+    def test_authorization_details_index_roles_and_policies(self) -> None:
+        """Test that one sweep indexes profiles, attached and inline policies and managed policy documents."""
+        iam = boto3.client('iam', region_name=REGION)
+        iam.create_role(RoleName=ROLE_NAME, AssumeRolePolicyDocument='{}')
+        policy_arn = iam.create_policy(PolicyName='ParameterReader',
+                                       PolicyDocument=policy_document('ssm:GetParameters'))['Policy']['Arn']
+        iam.attach_role_policy(RoleName=ROLE_NAME, PolicyArn=policy_arn)
+        iam.put_role_policy(RoleName=ROLE_NAME, PolicyName='bucket-reader', PolicyDocument=policy_document('s3:Get*'))
+        iam.create_instance_profile(InstanceProfileName='app-profile')
+        iam.add_role_to_instance_profile(InstanceProfileName='app-profile', RoleName=ROLE_NAME)
+
+        details = AuthorizationDetails.load(iam, with_documents=True)
+
+        self.assertEqual(details.profile_roles, {'app-profile': [ROLE_NAME]})
+        self.assertEqual(details.pages, 1)
+        forbidden = details.forbidden_policies(ROLE_NAME, PolicyMatcher(actions=['ssm:GetParameter*', 's3:GetObject']))
+        self.assertEqual(forbidden, [
+            {'policy_name': 'ParameterReader', 'policy_arn': policy_arn, 'match': "action:ssm:GetParameters"},
+            {'policy_name': 'bucket-reader', 'match': "action:s3:Get*"},
+        ])
+        self.assertEqual(details.forbidden_policies(ROLE_NAME, PolicyMatcher(names=['Other'])), [])
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
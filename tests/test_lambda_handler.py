@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+import unittest
+import logging
+import boto3
+from moto import mock_aws
+from code.helpers import describe_instance_record_pages
+from code.lambda_handler import Checkpoint, handler
+from code.state_store import VERDICT_COMPLIANT, VERDICT_REMEDIATED
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGION: str = 'us-east-1'
+MARGIN_MS: int = 1000
+
+
+class FakeContext:
+    """Lambda context whose remaining time runs out after a number of checks."""
+
+    def __init__(self, budget: int) -> None:
+        self.budget = budget
+
+    def get_remaining_time_in_millis(self) -> int:
+        self.budget -= 1
+        return MARGIN_MS * 10 if self.budget >= 0 else 0
+
+
+class TestLambdaHandler(unittest.TestCase):
+    """Unit tests for the Lambda handler and its checkpoints."""
+
+    def setUp(self) -> None:
+        """Set up the mock AWS environment and a checkpoint path."""
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+        self.checkpoint_dir = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.checkpoint_dir.name, 'checkpoint.json')
+
+    def tearDown(self) -> None:
+        """Clean up the mock AWS environment and the checkpoint."""
+        self.checkpoint_dir.cleanup()
+        self.mock_aws.stop()
+
+    def _event(self, checks) -> dict:
+        """Build an invocation event for the given checks."""
+        return {'checks': checks, 'region': REGION, 'checkpoint': self.checkpoint, 'safety_margin_ms': MARGIN_MS}
+
+    def test_sweep_resumes_from_checkpoint(self) -> None:
+        """Test that a sweep out of time saves its position and the next invocation finishes it."""
+        rds = boto3.client('rds', region_name=REGION)
+        for index in range(3):
+            rds.create_db_instance(DBInstanceIdentifier=f'db-{index}', AllocatedStorage=20,
+                                   DBInstanceClass='db.t4g.micro', Engine='mysql', MasterUsername='admin',
+                                   MasterUserPassword='password', PubliclyAccessible=True)
+        s3 = boto3.client('s3', region_name=REGION)
+        s3.create_bucket(Bucket='bucket-one')
+
+        first = handler(self._event(['rds', 's3']), FakeContext(2))
+        self.assertFalse(first['complete'])
+        self.assertEqual(first['verdicts'], {'rds': {VERDICT_REMEDIATED: 2}})
+        self.assertTrue(os.path.exists(self.checkpoint))
+
+        second = handler(self._event(['rds', 's3']), FakeContext(10))
+        self.assertTrue(second['complete'])
+        self.assertEqual(second['status'], "Success")
+        self.assertEqual(second['invocations'], 2)
+        self.assertEqual(second['verdicts'], {'rds': {VERDICT_REMEDIATED: 3}, 's3': {VERDICT_COMPLIANT: 1}})
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_margin_above_budget_still_makes_progress(self) -> None:
+        """Test that a safety margin larger than the time left still processes one resource per invocation."""
+        s3 = boto3.client('s3', region_name=REGION)
+        for bucket in ('bucket-one', 'bucket-two'):
+            s3.create_bucket(Bucket=bucket)
+
+        first = handler(self._event(['s3']), FakeContext(0))
+        second = handler(self._event(['s3']), FakeContext(0))
+
+        self.assertFalse(first['complete'])
+        self.assertEqual(first['verdicts'], {'s3': {VERDICT_COMPLIANT: 1}})
+        self.assertTrue(second['complete'])
+        self.assertEqual((second['verdicts'], second['invocations']), ({'s3': {VERDICT_COMPLIANT: 2}}, 2))
+
+    def test_instance_pages_resume_from_token(self) -> None:
+        """Test that a page token fetches its page again, without the pages before it."""
+        ec2 = boto3.client('ec2', region_name=REGION)
+        # Pages hold whole reservations, so launch one instance per reservation
+        for _ in range(7):
+            ec2.run_instances(ImageId='ami-12345678', MinCount=1, MaxCount=1)
+
+        pages = list(describe_instance_record_pages(ec2, page_size=5))
+        self.assertEqual([len(records) for _, records in pages], [5, 2])
+        self.assertIsNone(pages[0][0])
+
+        token, records = pages[1]
+        resumed = list(describe_instance_record_pages(ec2, page_size=5, token=token))
+        self.assertEqual(resumed, [(token, records)])
+
+    def test_s3_checkpoint_round_trip(self) -> None:
+        """Test that checkpoints are saved to, loaded from and removed from S3."""
+        boto3.client('s3', region_name=REGION).create_bucket(Bucket='checkpoint-bucket')
+        checkpoint = Checkpoint('s3://checkpoint-bucket/sweep/state.json', REGION)
+
+        self.assertIsNone(checkpoint.load())
+        checkpoint.save({'check': 'rds', 'token': 'marker', 'index': 1})
+        self.assertEqual(checkpoint.load(), {'check': 'rds', 'token': 'marker', 'index': 1})
+        checkpoint.clear()
+        self.assertIsNone(checkpoint.load())
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import tempfile
+import time
+import unittest
+import logging
+import boto3
+from moto import mock_aws
+from code.metrics import Metrics, get_metrics, timed_phase
+from code.rds_check_remove_public_access import check_remove_public_access
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGION: str = 'us-west-2'
+
+
+class TestMetrics(unittest.TestCase):
+    """Unit tests for API call metrics and phase timings."""
+
+    def setUp(self) -> None:
+        """Set up the mock AWS environment and clear collected metrics."""
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+        get_metrics().reset()
+
+    def tearDown(self) -> None:
+        """Clean up the mock AWS environment."""
+        self.mock_aws.stop()
+
+    def test_checker_result_includes_metrics(self) -> None:
+        """Test that API calls and phases of a checker run are reported in its result."""
+        boto3.client('rds', region_name=REGION).create_db_instance(
+            DBInstanceIdentifier='test-db',
+            AllocatedStorage=20,
+            DBInstanceClass='db.t4g.micro',
+            Engine='mysql',
+            MasterUsername='admin',
+            MasterUserPassword='password',
+            PubliclyAccessible=True
+        )
+
+        result = check_remove_public_access(REGION)
+
+        api = result['metrics']['api']['rds']
+        # One call discovers the instance, one confirms the modification took effect
+        self.assertEqual(api['DescribeDBInstances']['calls'], 2)
+        self.assertEqual(api['ModifyDBInstance']['calls'], 1)
+        self.assertGreater(api['DescribeDBInstances']['bytes_received'], 0)
+        self.assertEqual(api['ModifyDBInstance']['latency_histogram']['+Inf'], 1)
+        self.assertIn('discover', result['metrics']['phases'])
+        self.assertIn('remediate', result['metrics']['phases'])
+
+    def test_checker_result_reports_only_its_run(self) -> None:
+        """Test that a second checker run does not report the API calls of the first."""
+        boto3.client('rds', region_name=REGION).create_db_instance(
+            DBInstanceIdentifier='test-db',
+            AllocatedStorage=20,
+            DBInstanceClass='db.t4g.micro',
+            Engine='mysql',
+            MasterUsername='admin',
+            MasterUserPassword='password',
+            PubliclyAccessible=True
+        )
+
+        check_remove_public_access(REGION)
+        result = check_remove_public_access(REGION)
+
+        api = result['metrics']['api']['rds']
+        self.assertEqual(api['DescribeDBInstances']['calls'], 1)
+        self.assertEqual(api['DescribeDBInstances']['latency_histogram']['+Inf'], 1)
+        self.assertNotIn('ModifyDBInstance', api)
+        self.assertEqual(get_metrics().snapshot()['api']['rds']['DescribeDBInstances']['calls'], 3)
+
+    def test_generator_phase_excludes_consumer_time(self) -> None:
+        """Test that a timed generator only counts the time spent producing items."""
+        metrics = get_metrics()
+
+        @timed_phase('discover')
+        def produce():
+            yield 1
+            yield 2
+
+        for _ in produce():
+            time.sleep(0.05)
+
+        self.assertLess(metrics.snapshot()['phases']['discover'], 0.05)
+
+    def test_write_prometheus_and_json(self) -> None:
+        """Test the Prometheus textfile and JSON outputs."""
+        metrics = Metrics()
+        metrics.record_call('iam', 'GetInstanceProfile', 0.02, bytes_received=100, retries=1)
+        metrics.record_throttle('iam', 'GetInstanceProfile')
+        metrics.record_phase('evaluate', 0.5)
+
+        with tempfile.TemporaryDirectory() as directory:
+            metrics.write(os.path.join(directory, 'metrics.prom'))
+            metrics.write(os.path.join(directory, 'metrics.json'))
+            with open(os.path.join(directory, 'metrics.prom')) as f:
+                prometheus = f.read()
+            with open(os.path.join(directory, 'metrics.json')) as f:
+                snapshot = json.load(f)
+
+        self.assertIn('aws_policy_checker_api_calls_total{service="iam",operation="GetInstanceProfile"} 1', prometheus)
+        self.assertIn('aws_policy_checker_api_latency_seconds_bucket{service="iam",operation="GetInstanceProfile",le="0.025"} 1', prometheus)
+        self.assertIn('aws_policy_checker_phase_seconds_total{phase="evaluate"} 0.5', prometheus)
+        self.assertEqual(snapshot['api']['iam']['GetInstanceProfile']['throttles'], 1)
+        self.assertEqual(snapshot['api']['iam']['GetInstanceProfile']['latency_histogram']['0.01'], 0)
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
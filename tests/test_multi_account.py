@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+import logging
+from typing import Any, Dict
+import boto3
+from moto import mock_aws
+from code.multi_account import CredentialCache, role_arn, scan_accounts
+from code.multi_region import CHECKERS
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGION: str = 'us-east-1'
+ROLE_NAME: str = 'SecurityAudit'
+ACCOUNTS = ['111111111111', '222222222222']
+
+
+class TestMultiAccount(unittest.TestCase):
+    """Unit tests for scanning several accounts through assumed roles."""
+
+    def setUp(self) -> None:
+        """Set up the mock AWS environment."""
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+
+    def tearDown(self) -> None:
+        """Clean up the mock AWS environment."""
+        self.mock_aws.stop()
+
+    def _client(self, service: str, account_id: str):
+        """Create a client acting in the given account through an assumed role."""
+        credentials = boto3.client('sts', region_name=REGION).assume_role(
+            RoleArn=role_arn(account_id, ROLE_NAME), RoleSessionName='test-setup'
+        )['Credentials']
+        return boto3.client(service, region_name=REGION,
+                            aws_access_key_id=credentials['AccessKeyId'],
+                            aws_secret_access_key=credentials['SecretAccessKey'],
+                            aws_session_token=credentials['SessionToken'])
+
+    def test_scan_accounts_aggregates_by_account_and_region(self) -> None:
+        """Test that every account is checked with its own credentials and reported separately."""
+        self._client('rds', ACCOUNTS[0]).create_db_instance(
+            DBInstanceIdentifier='shared-name',
+            AllocatedStorage=20,
+            DBInstanceClass='db.t4g.micro',
+            Engine='mysql',
+            MasterUsername='admin',
+            MasterUserPassword='password',
+            PubliclyAccessible=True
+        )
+        s3 = self._client('s3', ACCOUNTS[1])
+        s3.create_bucket(Bucket='account-bucket')
+        s3.put_bucket_policy(Bucket='account-bucket', Policy=json.dumps({
+            'Version': '2012-10-17',
+            'Statement': [{
+                'Effect': 'Allow',
+                'Principal': '*',
+                'Action': 's3:GetObject',
+                'Resource': 'arn:aws:s3:::account-bucket/*'
+            }]
+        }))
+
+        result = scan_accounts(ACCOUNTS, ROLE_NAME, {'rds': CHECKERS['rds'], 's3': CHECKERS['s3']}, [REGION])
+
+        self.assertEqual(result['status'], "Success")
+        self.assertEqual(result['credentials'], {"hits": 0, "misses": 2})
+        first, second = (result['accounts'][account_id]['regions'][REGION] for account_id in ACCOUNTS)
+        self.assertIn("Disabled public access for 1", first['rds']['reason'])
+        self.assertIn("No public access", second['rds']['reason'])
+        self.assertEqual(first['s3']['buckets'], [])
+        self.assertIn("Removed a policy", second['s3']['buckets'][0]['reason'])
+
+    def test_credential_cache_refreshes_before_expiry(self) -> None:
+        """Test that credentials are reused until the expiry margin is reached."""
+        now: Dict[str, Any] = {'time': 0.0}
+        cache = CredentialCache(ROLE_NAME, duration=900, margin=300, clock=lambda: now['time'])
+
+        credentials = cache.get(ACCOUNTS[0])
+        now['time'] = credentials['Expiration'].timestamp() - 301
+        self.assertIs(cache.get(ACCOUNTS[0]), credentials)
+        now['time'] += 2
+        refreshed = cache.get(ACCOUNTS[0])
+
+        self.assertIsNot(refreshed, credentials)
+        self.assertEqual(refreshed['AccountId'], ACCOUNTS[0])
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 2})
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
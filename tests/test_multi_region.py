@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import boto3
+from moto import mock_aws
+from code.multi_region import CHECKERS, get_enabled_regions, scan_regions
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGIONS = ['us-east-1', 'us-west-2', 'eu-west-1']
+DB_INSTANCE: str = 'db.t4g.micro'
+
+
+class TestMultiRegion(unittest.TestCase):
+    """Unit tests for scanning several regions in parallel."""
+
+    def setUp(self) -> None:
+        """Set up the mock AWS environment."""
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+
+    def tearDown(self) -> None:
+        """Clean up the mock AWS environment."""
+        self.mock_aws.stop()
+
+    def test_scan_regions_aggregates_results(self) -> None:
+        """Test that per-region results and timings are merged into one report."""
+        for region in REGIONS[:2]:
+            boto3.client('rds', region_name=region).create_db_instance(
+                DBInstanceIdentifier=f'db-{region}',
+                AllocatedStorage=20,
+                DBInstanceClass=DB_INSTANCE,
+                Engine='mysql',
+                MasterUsername='admin',
+                MasterUserPassword='password',
+                PubliclyAccessible=True
+            )
+
+        result = scan_regions(CHECKERS['rds'], REGIONS, max_workers=2)
+
+        self.assertEqual(result['status'], "Success")
+        self.assertEqual(sorted(result['regions']), sorted(REGIONS))
+        self.assertIn("Disabled public access for 1", result['regions']['us-west-2']['reason'])
+        self.assertIn("No public access", result['regions']['eu-west-1']['reason'])
+        self.assertIn('duration', result['regions']['us-east-1'])
+
+    def test_scan_regions_reports_failures(self) -> None:
+        """Test that a failing region marks the aggregated report as an error."""
+        def checker(region):
+            if region == 'eu-west-1':
+                raise RuntimeError("boom")
+            return {"status": "Success", "reason": region}
+
+        result = scan_regions(checker, REGIONS)
+
+        self.assertEqual(result['status'], "Error")
+        self.assertIn("eu-west-1", result['reason'])
+        self.assertEqual(result['regions']['us-east-1']['status'], "Success")
+
+    def test_s3_scan_checks_only_buckets_in_region(self) -> None:
+        """Test that each region's S3 scan only covers its own buckets."""
+        for bucket, region in [('west-bucket', 'us-west-2'), ('eu-bucket-1', 'eu-west-1'), ('eu-bucket-2', 'eu-west-1')]:
+            boto3.client('s3', region_name=region).create_bucket(
+                Bucket=bucket,
+                CreateBucketConfiguration={'LocationConstraint': region}
+            )
+
+        result = scan_regions(CHECKERS['s3'], ['us-west-2', 'eu-west-1'])
+
+        self.assertIn("Checked 1 S3", result['regions']['us-west-2']['reason'])
+        self.assertIn("Checked 2 S3", result['regions']['eu-west-1']['reason'])
+
+    def test_get_enabled_regions(self) -> None:
+        """Test that enabled regions are discovered from EC2."""
+        regions = get_enabled_regions()
+
+        self.assertIn('us-east-1', regions)
+        self.assertNotIn('ap-east-1', regions)
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import logging
+from unittest.mock import patch
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_aws
+from code.plan import (RESULT_DONE, RESULT_FAILED, RESULT_UNCHANGED, Plan, PlanExecutor, apply_plan, build_plan,
+                       read_results)
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGION: str = 'us-east-1'
+AMI: str = 'ami-12345678'
+SSM_POLICY_NAME: str = 'AmazonSSMManagedInstanceCore'
+
+
+def _client_error(code: str) -> ClientError:
+    """Build a ClientError with the given error code."""
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'Operation')
+
+
+class TestPlan(unittest.TestCase):
+    """Unit tests for planning remediation actions and applying them."""
+
+    def setUp(self) -> None:
+        """Set up the mock AWS environment and a directory for plan files."""
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.plan_path = os.path.join(self.directory.name, 'plan.json')
+        self.log_path = os.path.join(self.directory.name, 'plan.json.log')
+        self.iam = boto3.client('iam', region_name=REGION)
+
+    def tearDown(self) -> None:
+        """Clean up the mock AWS environment and the plan files."""
+        self.directory.cleanup()
+        self.mock_aws.stop()
+
+    def _create_resources(self) -> str:
+        """Create two instances sharing an SSM role, a public bucket and a public DB instance."""
+        self.iam.create_role(RoleName='ssm-role', AssumeRolePolicyDocument='{}')
+        policy_arn = self.iam.create_policy(PolicyName=SSM_POLICY_NAME, PolicyDocument=json.dumps({
+            'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': 'ssm:*', 'Resource': '*'}]
+        }))['Policy']['Arn']
+        self.iam.attach_role_policy(RoleName='ssm-role', PolicyArn=policy_arn)
+        self.iam.create_instance_profile(InstanceProfileName='ssm-profile')
+        self.iam.add_role_to_instance_profile(InstanceProfileName='ssm-profile', RoleName='ssm-role')
+        ec2 = boto3.client('ec2', region_name=REGION)
+        for _ in range(2):
+            ec2.run_instances(ImageId=AMI, MinCount=1, MaxCount=1, IamInstanceProfile={'Name': 'ssm-profile'})
+        s3 = boto3.client('s3', region_name=REGION)
+        s3.create_bucket(Bucket='public-bucket')
+        s3.put_bucket_policy(Bucket='public-bucket', Policy=json.dumps({
+            'Version': '2012-10-17',
+            'Statement': [{'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject',
+                           'Resource': 'arn:aws:s3:::public-bucket/*'}]
+        }))
+        boto3.client('rds', region_name=REGION).create_db_instance(
+            DBInstanceIdentifier='public-db', AllocatedStorage=20, DBInstanceClass='db.t4g.micro', Engine='mysql',
+            MasterUsername='admin', MasterUserPassword='password', PubliclyAccessible=True
+        )
+        return policy_arn
+
+    def test_plan_merges_duplicates_and_changes_nothing(self) -> None:
+        """Test that the plan holds one entry per distinct action and nothing is remediated while planning."""
+        policy_arn = self._create_resources()
+
+        plan, result = build_plan(region=REGION)
+        plan.save(self.plan_path)
+        loaded = Plan.load(self.plan_path)
+
+        self.assertEqual(result['status'], "Success")
+        self.assertEqual(result['plan'], {'actions': 3, 'merged': 1, 'services': {'iam': 1, 'rds': 1, 's3': 1}})
+        detach = [entry for entry in loaded if entry['service'] == 'iam'][0]
+        self.assertEqual(detach['action']['policy_arn'], policy_arn)
+        self.assertEqual(len(detach['resources']), 2)
+        self.assertEqual([entry['id'] for entry in loaded], [entry['id'] for entry in plan])
+        self.assertEqual(len(self.iam.list_attached_role_policies(RoleName='ssm-role')['AttachedPolicies']), 1)
+
+    def test_plan_covers_every_region(self) -> None:
+        """Test that a plan of several regions holds the regional actions of each and the S3 actions once."""
+        self._create_resources()
+        boto3.client('rds', region_name='eu-west-1').create_db_instance(
+            DBInstanceIdentifier='public-db', AllocatedStorage=20, DBInstanceClass='db.t4g.micro', Engine='mysql',
+            MasterUsername='admin', MasterUserPassword='password', PubliclyAccessible=True
+        )
+
+        plan, result = build_plan(['rds', 's3'], [REGION, 'eu-west-1'])
+
+        self.assertEqual(result['plan']['services'], {'rds': 2, 's3': 1})
+        self.assertEqual(sorted(entry['region'] for entry in plan if entry['service'] == 'rds'),
+                         ['eu-west-1', REGION])
+        self.assertEqual(sum(result['verdicts']['s3'].values()), 1)
+
+    def test_apply_performs_the_plan_once(self) -> None:
+        """Test that applying performs every action, logs it, and a second run skips what is done."""
+        self._create_resources()
+        plan, _ = build_plan(region=REGION)
+
+        result = apply_plan(plan, self.log_path)
+        again = apply_plan(plan, self.log_path)
+
+        self.assertEqual(result['status'], "Success")
+        self.assertEqual(result['outcomes'], {RESULT_DONE: 3})
+        self.assertEqual(self.iam.list_attached_role_policies(RoleName='ssm-role')['AttachedPolicies'], [])
+        self.assertFalse(boto3.client('rds', region_name=REGION).describe_db_instances()
+                         ['DBInstances'][0]['PubliclyAccessible'])
+        self.assertEqual(sorted(read_results(self.log_path)), sorted(entry['id'] for entry in plan))
+        self.assertEqual((again['skipped'], again['outcomes']), (3, {}))
+
+    def test_transient_errors_are_retried_and_permanent_ones_are_not(self) -> None:
+        """Test the retry policy: transient errors are retried with backoff, permanent ones fail at once."""
+        plan = Plan()
+        plan.add('rds', REGION, 'flaky-db', {'action': 'modify_db_instance', 'db_instance_identifier': 'flaky-db'})
+        plan.add('rds', REGION, 'denied-db', {'action': 'modify_db_instance', 'db_instance_identifier': 'denied-db'})
+        plan.add('ec2', REGION, 'i-1', {'action': 'detach_role_policy', 'role_name': 'gone-role',
+                                        'policy_arn': 'arn:aws:iam::123456789012:policy/gone'})
+        outcomes = {'flaky-db': [_client_error('Throttling'), None], 'denied-db': [_client_error('AccessDenied')]}
+        sleeps = []
+
+        def modify(rds_client, identifier):
+            outcome = outcomes[identifier].pop(0)
+            if outcome is not None:
+                raise outcome
+
+        with patch('code.checks.modify_db_instance', side_effect=modify):
+            result = apply_plan(plan, self.log_path, PlanExecutor(max_workers=1, sleep=sleeps.append, backoff=0.5))
+
+        results = {entry['resources'][0]: read_results(self.log_path)[entry['id']] for entry in plan}
+        self.assertEqual(result['status'], "Error")
+        self.assertEqual((results['flaky-db']['status'], results['flaky-db']['attempts']), (RESULT_DONE, 2))
+        self.assertEqual((results['denied-db']['status'], results['denied-db']['attempts']), (RESULT_FAILED, 1))
+        self.assertEqual(results['i-1']['status'], RESULT_UNCHANGED)
+        self.assertEqual(sleeps, [0.5])
+        self.assertEqual(result['failed'], [[entry for entry in plan][1]['id']])
+
+    def test_per_service_limit_bounds_concurrency(self) -> None:
+        """Test that no more actions of a service run at the same time than its limit allows."""
+        plan = Plan()
+        for index in range(6):
+            plan.add('rds', REGION, f'db-{index}', {'action': 'modify_db_instance',
+                                                    'db_instance_identifier': f'db-{index}'})
+        lock = threading.Lock()
+        counts = {'active': 0, 'peak': 0}
+
+        def modify(rds_client, identifier):
+            with lock:
+                counts['active'] += 1
+                counts['peak'] = max(counts['peak'], counts['active'])
+            time.sleep(0.05)
+            with lock:
+                counts['active'] -= 1
+
+        with patch('code.checks.modify_db_instance', side_effect=modify):
+            results = PlanExecutor(max_workers=6, service_limits={'rds': 2}).apply(list(plan))
+
+        self.assertEqual([result['status'] for result in results], [RESULT_DONE] * 6)
+        self.assertEqual(counts['peak'], 2)
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+import logging
+from code.policy_evaluator import PolicyEvaluator, is_public_statement, remove_statements
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+PUBLIC_STATEMENT = {
+    'Effect': 'Allow',
+    'Principal': '*',
+    'Action': 's3:GetObject',
+    'Resource': 'arn:aws:s3:::bucket/*'
+}
+ACCOUNT_STATEMENT = {
+    'Effect': 'Allow',
+    'Principal': {'AWS': 'arn:aws:iam::123456789012:root'},
+    'Action': 's3:GetObject',
+    'Resource': 'arn:aws:s3:::bucket/*'
+}
+
+
+class TestPolicyEvaluator(unittest.TestCase):
+    """Unit tests for the bucket policy evaluator."""
+
+    def test_public_statements(self) -> None:
+        """Test which statements are treated as granting anonymous access."""
+        self.assertTrue(is_public_statement(PUBLIC_STATEMENT))
+        self.assertTrue(is_public_statement({**PUBLIC_STATEMENT, 'Principal': {'AWS': ['*']}}))
+        self.assertTrue(is_public_statement({**ACCOUNT_STATEMENT, 'NotPrincipal': ACCOUNT_STATEMENT['Principal']}))
+        self.assertFalse(is_public_statement(ACCOUNT_STATEMENT))
+        self.assertFalse(is_public_statement({**PUBLIC_STATEMENT, 'Effect': 'Deny'}))
+
+    def test_conditions(self) -> None:
+        """Test that only conditions limiting the callers make a statement private."""
+        restricted = {**PUBLIC_STATEMENT, 'Condition': {'StringEquals': {'aws:SourceVpce': 'vpce-1'}}}
+        self.assertFalse(is_public_statement(restricted))
+        for condition in ({'IpAddress': {'aws:SourceIp': '0.0.0.0/0'}},
+                          {'StringNotEquals': {'aws:SourceVpce': 'vpce-1'}},
+                          {'StringEqualsIfExists': {'aws:PrincipalOrgID': 'o-1'}},
+                          {'Bool': {'aws:SecureTransport': 'true'}}):
+            self.assertTrue(is_public_statement({**PUBLIC_STATEMENT, 'Condition': condition}), condition)
+
+    def test_verdicts_memoized_across_buckets(self) -> None:
+        """Test that template policies differing only in resources are evaluated once."""
+        evaluator = PolicyEvaluator()
+        for bucket in ('bucket-1', 'bucket-2', 'bucket-3'):
+            policy = json.dumps({'Version': '2012-10-17', 'Statement': [
+                {**ACCOUNT_STATEMENT, 'Resource': f'arn:aws:s3:::{bucket}/*'},
+                {**PUBLIC_STATEMENT, 'Resource': f'arn:aws:s3:::{bucket}/*'},
+            ]})
+            self.assertEqual(evaluator.public_statements(policy), (1,))
+
+        self.assertEqual(evaluator.stats(), {"hits": 2, "misses": 1})
+
+    def test_remove_statements(self) -> None:
+        """Test that only the given statements are removed, and None is returned when none are left."""
+        document = {'Version': '2012-10-17', 'Statement': [ACCOUNT_STATEMENT, PUBLIC_STATEMENT]}
+
+        self.assertEqual(remove_statements(document, (1,)), {'Version': '2012-10-17', 'Statement': [ACCOUNT_STATEMENT]})
+        self.assertIsNone(remove_statements({'Statement': PUBLIC_STATEMENT}, (0,)))
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
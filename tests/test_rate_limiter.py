@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+from botocore.awsrequest import AWSResponse
+from botocore.config import Config
+from moto import mock_aws
+from code.helpers import ClientPool
+from code.rate_limiter import RateLimiter, get_rate_limiter, is_throttling_response, set_rate
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGION: str = 'us-west-2'
+THROTTLING_BODY: bytes = (
+    b'<ErrorResponse><Error><Type>Sender</Type><Code>Throttling</Code>'
+    b'<Message>Rate exceeded</Message></Error><RequestId>1</RequestId></ErrorResponse>'
+)
+
+
+class FakeClock:
+    """Clock that only advances when something sleeps."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Unit tests for the adaptive token bucket rate limiter."""
+
+    def test_acquire_waits_for_tokens(self) -> None:
+        """Test that callers beyond the burst wait for the bucket to refill."""
+        clock = FakeClock()
+        limiter = RateLimiter(2.0, clock=clock, sleep=clock.sleep)
+
+        waits = [limiter.acquire() for _ in range(4)]
+
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 0.5)
+        self.assertAlmostEqual(clock.now, 1.0)
+        self.assertEqual(limiter.stats()['calls'], 4)
+
+    def test_throttling_lowers_and_success_restores_rate(self) -> None:
+        """Test the adaptive backoff on throttling and recovery afterwards."""
+        clock = FakeClock()
+        limiter = RateLimiter(8.0, min_rate=1.0, clock=clock, sleep=clock.sleep)
+
+        limiter.on_throttle()
+        limiter.on_throttle()
+        self.assertEqual(limiter.rate, 2.0)
+        self.assertEqual(limiter.stats()['throttles'], 2)
+
+        for _ in range(200):
+            limiter.on_success()
+        self.assertEqual(limiter.rate, 8.0)
+
+    @mock_aws
+    def test_pooled_clients_back_off_on_throttling(self) -> None:
+        """Test that pooled clients share the limiter and survive a throttled attempt."""
+        pool = ClientPool(config=Config(retries={'mode': 'standard', 'max_attempts': 3}))
+        iam = pool.get_client('iam', REGION, {'AccessKeyId': 'AKIA', 'SecretAccessKey': 's', 'AccountId': '111111111111'})
+        limiter = get_rate_limiter('iam', '111111111111')
+        throttled = []
+
+        def throttle_once(request=None, **kwargs):
+            if not throttled:
+                throttled.append(request)
+                return _throttling_response(request.url)
+            return None
+
+        iam.meta.events.register_first('before-send.iam', throttle_once)
+        iam.list_roles()
+
+        self.assertEqual(len(throttled), 1)
+        self.assertEqual(limiter.stats()['throttles'], 1)
+        self.assertEqual(limiter.stats()['calls'], 2)
+
+    @mock_aws
+    def test_set_rate_applies_to_existing_clients(self) -> None:
+        """Test that changing a service's rate reaches clients created before the change."""
+        pool = ClientPool()
+        iam = pool.get_client('iam', REGION, {'AccessKeyId': 'AKIA', 'SecretAccessKey': 's', 'AccountId': '222222222222'})
+
+        set_rate('iam', 1000.0, '222222222222')
+        for _ in range(3):
+            iam.list_roles()
+
+        limiter = get_rate_limiter('iam', '222222222222')
+        self.assertEqual(limiter.stats()['calls'], 3)
+        self.assertEqual(limiter.stats()['rate'], 1000.0)
+
+    def test_is_throttling_response(self) -> None:
+        """Test detection of throttling error codes."""
+        self.assertTrue(is_throttling_response((None, {'Error': {'Code': 'Throttling'}})))
+        self.assertFalse(is_throttling_response((None, {'Error': {'Code': 'AccessDenied'}})))
+        self.assertFalse(is_throttling_response(None))
+
+
+def _throttling_response(url: str) -> AWSResponse:
+    """Build a raw IAM throttling error response."""
+    class Raw:
+        def stream(self, **kwargs):
+            yield THROTTLING_BODY
+    return AWSResponse(url, 400, {}, Raw())
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
@@ -2,10 +2,12 @@
 import unittest
 from moto import mock_aws
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List
+from unittest.mock import patch
 import boto3
 from botocore.exceptions import ClientError
-from code.rds_check_remove_public_access import check_remove_public_access
+from code.helpers import modify_db_instance
+from code.rds_check_remove_public_access import ModificationTracker, check_remove_public_access
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO)
@@ -79,6 +81,86 @@ class TestRdsCheckRemovePublicAccess(unittest.TestCase):
         self.assertEqual(result['status'], "Success")
         self.assertIn("No public access for RDS instance", result['reason'])
 
+    def test_concurrent_modifications_are_tracked(self) -> None:
+        """Test that every public instance, Aurora members included, is modified and confirmed private."""
+        for index in range(3):
+            self.rds.create_db_instance(
+                DBInstanceIdentifier=f'{DB_NAME}-{index}',
+                AllocatedStorage=20,
+                DBInstanceClass=DB_INSTANCE,
+                Engine=DB_ENGINE,
+                MasterUsername=DB_USER,
+                MasterUserPassword=DB_PASS,
+                PubliclyAccessible=index < 2
+            )
+        self.rds.create_db_cluster(DBClusterIdentifier='aurora-cluster', Engine='aurora-mysql',
+                                   MasterUsername=DB_USER, MasterUserPassword=DB_PASS)
+        self.rds.create_db_instance(DBInstanceIdentifier='aurora-member', DBClusterIdentifier='aurora-cluster',
+                                    Engine='aurora-mysql', DBInstanceClass='db.r5.large', PubliclyAccessible=True)
+        findings: List[Dict[str, Any]] = []
+
+        result: Dict[str, Any] = check_remove_public_access(REGION, sink=findings.append, max_workers=4)
+
+        self.assertEqual(result['status'], "Success")
+        self.assertIn("Disabled public access for 3", result['reason'])
+        self.assertEqual(sorted(result['time_to_private']), ['aurora-member', f'{DB_NAME}-0', f'{DB_NAME}-1'])
+        self.assertEqual(result['pending'], [])
+        self.assertEqual(result['polls'], 1)
+        reasons = {finding['resource_id']: finding['reason'] for finding in findings}
+        self.assertEqual(reasons['aurora-member'], "Disabled public access (member of cluster aurora-cluster)")
+        self.assertEqual(reasons[f'{DB_NAME}-2'], "Not publicly accessible")
+        instances = self.rds.describe_db_instances()['DBInstances']
+        self.assertFalse(any(instance['PubliclyAccessible'] for instance in instances))
+
+    def test_partial_failure_keeps_details(self) -> None:
+        """Test that a run where some modifications fail is an error that still reports the other instances."""
+        for index in range(2):
+            self.rds.create_db_instance(
+                DBInstanceIdentifier=f'{DB_NAME}-{index}',
+                AllocatedStorage=20,
+                DBInstanceClass=DB_INSTANCE,
+                Engine=DB_ENGINE,
+                MasterUsername=DB_USER,
+                MasterUserPassword=DB_PASS,
+                PubliclyAccessible=True
+            )
+
+        def modify(rds_client, identifier):
+            if identifier == f'{DB_NAME}-1':
+                raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'denied'}}, 'ModifyDBInstance')
+            modify_db_instance(rds_client, identifier)
+
+        with patch('code.rds_check_remove_public_access.modify_db_instance', side_effect=modify):
+            result: Dict[str, Any] = check_remove_public_access(REGION)
+
+        self.assertEqual(result['status'], "Error")
+        self.assertEqual(result['reason'], f"Failed to disable public access for 1 RDS instance/-s: {DB_NAME}-1")
+        self.assertEqual(list(result['time_to_private']), [f'{DB_NAME}-0'])
+        self.assertIn('metrics', result)
+
+    def test_tracker_polls_until_timeout(self) -> None:
+        """Test that the tracker keeps polling pending instances in batches and measures time to private."""
+        self.rds.create_db_instance(
+            DBInstanceIdentifier=DB_NAME,
+            AllocatedStorage=20,
+            DBInstanceClass=DB_INSTANCE,
+            Engine=DB_ENGINE,
+            MasterUsername=DB_USER,
+            MasterUserPassword=DB_PASS,
+            PubliclyAccessible=True
+        )
+        now = {'time': 0.0}
+        tracker = ModificationTracker(self.rds, clock=lambda: now['time'],
+                                      sleep=lambda seconds: now.update(time=now['time'] + seconds))
+        tracker.add(DB_NAME)
+
+        self.assertEqual(tracker.wait(timeout=30, interval=10), [DB_NAME])
+        self.assertEqual(tracker.polls, 4)
+
+        self.rds.modify_db_instance(DBInstanceIdentifier=DB_NAME, PubliclyAccessible=False, ApplyImmediately=True)
+        self.assertEqual(tracker.poll(), [DB_NAME])
+        self.assertEqual(tracker.time_to_private, {DB_NAME: 30.0})
+
 # Entry point for the test script
 if __name__ == '__main__':
     result = unittest.main()
@@ -2,11 +2,14 @@
 import unittest
 import logging
 import json
+import os
+import tempfile
 from typing import Dict, Any
 from unittest.mock import patch
 from moto import mock_aws
 import boto3
-from code.s3_check_remove_public_access import check_remove_public_access
+from code.s3_check_remove_public_access import REMEDIATION_BLOCK, check_remove_public_access, main
+from code.state_store import StateStore
 
 # Set up logging configuration
 logging.basicConfig(level=logging.INFO)
@@ -15,6 +18,12 @@ logger = logging.getLogger(__name__)
 # Constants for test setup
 BUCKET_NAME: str = 's3-test-bucket'
 REGION: str = 'us-west-2'
+PUBLIC_ACCESS_BLOCK: Dict[str, bool] = {
+    'BlockPublicAcls': True,
+    'IgnorePublicAcls': True,
+    'BlockPublicPolicy': True,
+    'RestrictPublicBuckets': True
+}
 
 class TestCheckRemovePublicAccess(unittest.TestCase):
     """Unit tests for the check_remove_public_access function."""
@@ -73,6 +82,125 @@ class TestCheckRemovePublicAccess(unittest.TestCase):
         self.assertEqual(result['status'], "Success")
         self.assertIn("No bucket policy found", result['reason'])
 
+    def test_check_remove_public_access_keeps_private_statements(self) -> None:
+        """Test that only public statements are removed and private policies are left alone."""
+        account_statement = {
+            'Effect': 'Allow',
+            'Principal': {'AWS': 'arn:aws:iam::123456789012:root'},
+            'Action': ['s3:GetObject'],
+            'Resource': f'arn:aws:s3:::{BUCKET_NAME}/*'
+        }
+        public_statement = {**account_statement, 'Principal': '*'}
+        self.s3.put_bucket_policy(Bucket=BUCKET_NAME, Policy=json.dumps({
+            'Version': '2012-10-17',
+            'Statement': [account_statement, public_statement]
+        }))
+
+        result = check_remove_public_access(self.s3, BUCKET_NAME)
+
+        self.assertEqual(result['status'], "Success")
+        self.assertIn("Removed 1 public statement", result['reason'])
+        policy = json.loads(self.s3.get_bucket_policy(Bucket=BUCKET_NAME)['Policy'])
+        self.assertEqual(policy['Statement'], [account_statement])
+
+        result = check_remove_public_access(self.s3, BUCKET_NAME)
+
+        self.assertIn("does not allow public access", result['reason'])
+        self.assertIn('Policy', self.s3.get_bucket_policy(Bucket=BUCKET_NAME))
+
+    def test_main_routes_buckets_to_home_region(self) -> None:
+        """Test that buckets in several regions are checked in parallel and reported."""
+        other_region = 'eu-west-1'
+        other_s3 = boto3.client('s3', region_name=other_region)
+        other_s3.create_bucket(
+            Bucket='s3-other-bucket',
+            CreateBucketConfiguration={'LocationConstraint': other_region}
+        )
+        other_s3.put_bucket_policy(Bucket='s3-other-bucket', Policy=json.dumps({
+            'Version': '2012-10-17',
+            'Statement': [{
+                'Effect': 'Allow',
+                'Principal': '*',
+                'Action': ['s3:GetObject'],
+                'Resource': 'arn:aws:s3:::s3-other-bucket/*'
+            }]
+        }))
+
+        result = main(REGION, max_workers=4)
+
+        self.assertEqual(result['status'], "Success")
+        buckets = {bucket['bucket']: bucket for bucket in result['buckets']}
+        self.assertEqual(buckets[BUCKET_NAME]['region'], REGION)
+        self.assertIn("No bucket policy found", buckets[BUCKET_NAME]['reason'])
+        self.assertEqual(buckets['s3-other-bucket']['region'], other_region)
+        self.assertIn("Removed a policy", buckets['s3-other-bucket']['reason'])
+        self.assertEqual(result['cache'], {"hits": 0, "misses": 1})
+
+    def _put_public_policy(self) -> None:
+        """Attach a policy allowing anyone to read the test bucket."""
+        self.s3.put_bucket_policy(Bucket=BUCKET_NAME, Policy=json.dumps({
+            'Version': '2012-10-17',
+            'Statement': [{
+                'Effect': 'Allow',
+                'Principal': '*',
+                'Action': ['s3:GetObject'],
+                'Resource': f'arn:aws:s3:::{BUCKET_NAME}/*'
+            }]
+        }))
+
+    def test_main_skips_buckets_behind_account_public_access_block(self) -> None:
+        """Test that no bucket policy is fetched when the account blocks public bucket policies."""
+        self._put_public_policy()
+        account_id = boto3.client('sts', region_name=REGION).get_caller_identity()['Account']
+        boto3.client('s3control', region_name=REGION).put_public_access_block(
+            AccountId=account_id, PublicAccessBlockConfiguration=PUBLIC_ACCESS_BLOCK
+        )
+
+        result = main(REGION, bucket_region=REGION)
+
+        self.assertEqual(result['status'], "Success")
+        self.assertEqual(result['avoided_calls'], 1)
+        self.assertIn("Account Public Access Block", result['buckets'][0]['reason'])
+        self.assertIn('Policy', self.s3.get_bucket_policy(Bucket=BUCKET_NAME))
+
+    def test_main_blocks_public_access_instead_of_deleting_policy(self) -> None:
+        """Test that block remediation enables the bucket Public Access Block and keeps the policy."""
+        self._put_public_policy()
+        self.s3.put_public_access_block(Bucket=BUCKET_NAME, PublicAccessBlockConfiguration={'BlockPublicAcls': True})
+
+        result = main(REGION, remediation=REMEDIATION_BLOCK)
+
+        self.assertEqual(result['status'], "Success")
+        self.assertIn("Enabled Public Access Block", result['buckets'][0]['reason'])
+        self.assertIn('Policy', self.s3.get_bucket_policy(Bucket=BUCKET_NAME))
+        configuration = self.s3.get_public_access_block(Bucket=BUCKET_NAME)['PublicAccessBlockConfiguration']
+        self.assertEqual(configuration, {**PUBLIC_ACCESS_BLOCK, 'IgnorePublicAcls': False})
+
+        result = main(REGION, remediation=REMEDIATION_BLOCK)
+
+        self.assertIn("already restricts", result['buckets'][0]['reason'])
+        self.assertEqual(result['avoided_calls'], 1)
+
+    def test_block_remediation_rechecks_removed_public_access_block(self) -> None:
+        """Test that a bucket whose Public Access Block was removed after remediation is blocked again."""
+        self._put_public_policy()
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        store = StateStore(path)
+
+        first = main(REGION, remediation=REMEDIATION_BLOCK, state_store=store)
+        unchanged = main(REGION, remediation=REMEDIATION_BLOCK, state_store=store)
+        self.s3.delete_public_access_block(Bucket=BUCKET_NAME)
+        removed = main(REGION, remediation=REMEDIATION_BLOCK, state_store=store)
+        store.close()
+
+        self.assertIn("Enabled Public Access Block", first['buckets'][0]['reason'])
+        self.assertTrue(unchanged['buckets'][0]['skipped'])
+        self.assertIn("Enabled Public Access Block", removed['buckets'][0]['reason'])
+        configuration = self.s3.get_public_access_block(Bucket=BUCKET_NAME)['PublicAccessBlockConfiguration']
+        self.assertTrue(configuration['RestrictPublicBuckets'])
+
 # Entry point for the test script
 if __name__ == '__main__':
     result = unittest.main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+import unittest
+import logging
+from typing import Any, Dict, List
+from unittest.mock import patch
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_aws
+from code.findings import VERDICT_ERROR, VERDICT_NON_COMPLIANT
+from code.snapshot import (KIND_BUCKET, KIND_INSTANCE, Snapshot, SnapshotWriter, capture, evaluate)
+from code.state_store import VERDICT_COMPLIANT
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGION: str = 'us-east-1'
+SSM_POLICY_NAME: str = 'AmazonSSMManagedInstanceCore'
+
+
+class TestSnapshot(unittest.TestCase):
+    """Unit tests for capturing snapshots and evaluating them offline."""
+
+    def setUp(self) -> None:
+        """Set up the mock AWS environment and a snapshot path."""
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'inventory.snap')
+
+    def tearDown(self) -> None:
+        """Clean up the mock AWS environment and the snapshot."""
+        self.directory.cleanup()
+        self.mock_aws.stop()
+
+    def test_reader_loads_only_the_blocks_it_needs(self) -> None:
+        """Test that records are found through the index and only their block is decompressed."""
+        with SnapshotWriter(self.path, block_size=10, region=REGION) as writer:
+            for index in range(100):
+                writer.add(KIND_BUCKET, f'bucket-{index:03}', {'policy': None, 'index': index})
+
+        with Snapshot(self.path) as snapshot:
+            self.assertEqual(snapshot.metadata, {'region': REGION})
+            self.assertEqual(len(snapshot.ids(KIND_BUCKET)), 100)
+            self.assertEqual(snapshot.blocks_loaded, 0)
+            self.assertEqual(snapshot.get(KIND_BUCKET, 'bucket-042')['index'], 42)
+            self.assertEqual(snapshot.get(KIND_BUCKET, 'bucket-047')['index'], 47)
+            self.assertIsNone(snapshot.get(KIND_INSTANCE, 'bucket-042'))
+            self.assertEqual(snapshot.blocks_loaded, 1)
+
+    def test_rejects_other_files(self) -> None:
+        """Test that a file without the snapshot markers is rejected."""
+        with open(self.path, 'wb') as f:
+            f.write(b'{"not": "a snapshot"}' * 4)
+        with self.assertRaises(ValueError):
+            Snapshot(self.path)
+
+    def test_capture_then_evaluate_offline(self) -> None:
+        """Test that a captured inventory is evaluated with the checks' logic and no API calls."""
+        iam = boto3.client('iam', region_name=REGION)
+        iam.create_role(RoleName='ssm-role', AssumeRolePolicyDocument='{}')
+        policy_arn = iam.create_policy(PolicyName=SSM_POLICY_NAME, PolicyDocument=json.dumps({
+            'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': 'ssm:*', 'Resource': '*'}]
+        }))['Policy']['Arn']
+        iam.attach_role_policy(RoleName='ssm-role', PolicyArn=policy_arn)
+        iam.create_instance_profile(InstanceProfileName='ssm-profile')
+        iam.add_role_to_instance_profile(InstanceProfileName='ssm-profile', RoleName='ssm-role')
+        ec2 = boto3.client('ec2', region_name=REGION)
+        ec2.run_instances(ImageId='ami-12345678', MinCount=1, MaxCount=1, IamInstanceProfile={'Name': 'ssm-profile'})
+        ec2.run_instances(ImageId='ami-12345678', MinCount=1, MaxCount=1)
+        s3 = boto3.client('s3', region_name=REGION)
+        s3.create_bucket(Bucket='public-bucket')
+        s3.put_bucket_policy(Bucket='public-bucket', Policy=json.dumps({
+            'Version': '2012-10-17',
+            'Statement': [{'Effect': 'Allow', 'Principal': '*', 'Action': 's3:GetObject',
+                           'Resource': 'arn:aws:s3:::public-bucket/*'}]
+        }))
+        s3.create_bucket(Bucket='private-bucket')
+        boto3.client('rds', region_name=REGION).create_db_instance(
+            DBInstanceIdentifier='public-db', AllocatedStorage=20, DBInstanceClass='db.t4g.micro', Engine='mysql',
+            MasterUsername='admin', MasterUserPassword='password', PubliclyAccessible=True
+        )
+
+        captured = capture(self.path, REGION)
+        self.assertEqual(captured['records'], {'instance': 2, 'instance_profile': 1, 'role_policies': 1,
+                                               'bucket': 2, 'db_instance': 1})
+        self.mock_aws.stop()
+
+        findings: List[Dict[str, Any]] = []
+        result = evaluate(self.path, sink=findings.append)
+        self.mock_aws.start()
+
+        self.assertEqual(result['status'], "Success")
+        self.assertEqual(result['verdicts'], {
+            'ec2': {VERDICT_NON_COMPLIANT: 1, VERDICT_COMPLIANT: 1},
+            'rds': {VERDICT_NON_COMPLIANT: 1},
+            's3': {VERDICT_NON_COMPLIANT: 1, VERDICT_COMPLIANT: 1},
+        })
+        actions = [finding['actions'][0]['action'] for finding in findings if finding['actions']]
+        self.assertEqual(actions, ['detach_role_policy', 'modify_db_instance', 'delete_bucket_policy'])
+
+    def test_resources_that_cannot_be_captured_give_errors(self) -> None:
+        """Test that a bucket whose policy cannot be read is recorded as an error and evaluated as one."""
+        s3 = boto3.client('s3', region_name=REGION)
+        for bucket in ('denied-bucket', 'private-bucket'):
+            s3.create_bucket(Bucket=bucket)
+        denied = ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'denied'}}, 'GetBucketPolicy')
+
+        def get_policy(s3_client, bucket_name):
+            if bucket_name == 'denied-bucket':
+                raise denied
+            return s3_client.get_bucket_policy(Bucket=bucket_name)
+
+        with patch('code.snapshot.get_bucket_policy', side_effect=get_policy):
+            captured = capture(self.path, REGION)
+        findings: List[Dict[str, Any]] = []
+        result = evaluate(self.path, ['s3'], sink=findings.append)
+
+        self.assertEqual((captured['status'], captured['errors'], captured['records']['bucket']), ("Error", 1, 2))
+        self.assertEqual(result['verdicts'], {'s3': {VERDICT_ERROR: 1, VERDICT_COMPLIANT: 1}})
+        self.assertEqual([f['resource_id'] for f in findings if f['verdict'] == VERDICT_ERROR], ['denied-bucket'])
+
+    def test_failed_listing_keeps_no_snapshot(self) -> None:
+        """Test that a listing that fails gives an error result and leaves no partial snapshot behind."""
+        denied = ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'denied'}}, 'ListBuckets')
+
+        with patch('code.snapshot.list_buckets', side_effect=denied):
+            captured = capture(self.path, REGION)
+
+        self.assertEqual(captured['status'], "Error")
+        self.assertTrue(captured['reason'].startswith("Error capturing snapshot: "))
+        self.assertFalse(os.path.exists(self.path))
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+import unittest
+import logging
+import boto3
+from moto import mock_aws
+from code.ec2_check_remove_ssm_policy import check_remove_ssm_policy
+from code.rds_check_remove_public_access import check_remove_public_access
+from code.state_store import VERDICT_COMPLIANT, StateStore, fingerprint
+
+# Set up logging configuration
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Constants for test setup
+REGION: str = 'us-west-2'
+AMI: str = 'ami-061392db613a6357b'
+SSM_POLICY_NAME: str = 'AmazonSSMManagedInstanceCore'
+
+
+class TestStateStore(unittest.TestCase):
+    """Unit tests for incremental scanning with the resource fingerprint store."""
+
+    def setUp(self) -> None:
+        """Set up the mock AWS environment and a temporary state database."""
+        self.mock_aws = mock_aws()
+        self.mock_aws.start()
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+
+    def tearDown(self) -> None:
+        """Clean up the mock AWS environment and the state database."""
+        self.mock_aws.stop()
+        os.remove(self.path)
+
+    def test_store_persists_verdicts(self) -> None:
+        """Test that verdicts survive reopening the store and full rescans ignore them."""
+        store = StateStore(self.path)
+        store.record('ec2', 'i-1', fingerprint({'profile': None}), VERDICT_COMPLIANT)
+        store.close()
+
+        store = StateStore(self.path)
+        self.assertEqual(store.get('ec2', 'i-1'), (fingerprint({'profile': None}), VERDICT_COMPLIANT))
+        self.assertTrue(store.is_unchanged('ec2', 'i-1', fingerprint({'profile': None})))
+        self.assertFalse(store.is_unchanged('ec2', 'i-1', fingerprint({'profile': 'arn'})))
+        store.close()
+
+        store = StateStore(self.path, full_rescan=True)
+        self.assertFalse(store.is_unchanged('ec2', 'i-1', fingerprint({'profile': None})))
+        store.close()
+
+    def test_ec2_scan_skips_unchanged_instances(self) -> None:
+        """Test that a second run only checks new instances."""
+        ec2 = boto3.client('ec2', region_name=REGION)
+        ec2.run_instances(ImageId=AMI, MinCount=2, MaxCount=2)
+        store = StateStore(self.path)
+
+        first = check_remove_ssm_policy(REGION, state_store=store)
+        ec2.run_instances(ImageId=AMI, MinCount=1, MaxCount=1)
+        second = check_remove_ssm_policy(REGION, state_store=store)
+        store.close()
+
+        self.assertEqual(first['skipped'], 0)
+        self.assertEqual(second['skipped'], 2)
+
+    def test_ec2_scan_rechecks_reattached_policy(self) -> None:
+        """Test that an SSM policy attached to the role again after remediation is detached on the next run."""
+        iam = boto3.client('iam', region_name=REGION)
+        iam.create_role(RoleName='ssm-role', AssumeRolePolicyDocument='{}')
+        policy_arn = iam.create_policy(PolicyName=SSM_POLICY_NAME, PolicyDocument=json.dumps({
+            'Version': '2012-10-17', 'Statement': [{'Effect': 'Allow', 'Action': 'ssm:*', 'Resource': '*'}]
+        }))['Policy']['Arn']
+        iam.attach_role_policy(RoleName='ssm-role', PolicyArn=policy_arn)
+        iam.create_instance_profile(InstanceProfileName='ssm-profile')
+        iam.add_role_to_instance_profile(InstanceProfileName='ssm-profile', RoleName='ssm-role')
+        boto3.client('ec2', region_name=REGION).run_instances(ImageId=AMI, MinCount=1, MaxCount=1,
+                                                               IamInstanceProfile={'Name': 'ssm-profile'})
+        store = StateStore(self.path)
+
+        first = check_remove_ssm_policy(REGION, state_store=store)
+        unchanged = check_remove_ssm_policy(REGION, state_store=store)
+        iam.attach_role_policy(RoleName='ssm-role', PolicyArn=policy_arn)
+        reattached = check_remove_ssm_policy(REGION, state_store=store)
+        store.close()
+
+        self.assertIn("from the roles of 1 instance/-s", first['reason'])
+        self.assertEqual(unchanged['skipped'], 1)
+        self.assertEqual(reattached['skipped'], 0)
+        self.assertIn("from the roles of 1 instance/-s", reattached['reason'])
+        self.assertEqual(iam.list_attached_role_policies(RoleName='ssm-role')['AttachedPolicies'], [])
+
+    def test_rds_scan_skips_remediated_instances(self) -> None:
+        """Test that an instance made private is not modified again on the next run."""
+        rds = boto3.client('rds', region_name=REGION)
+        rds.create_db_instance(
+            DBInstanceIdentifier='test-db',
+            AllocatedStorage=20,
+            DBInstanceClass='db.t4g.micro',
+            Engine='mysql',
+            MasterUsername='admin',
+            MasterUserPassword='password',
+            PubliclyAccessible=True
+        )
+        store = StateStore(self.path)
+
+        first = check_remove_public_access(REGION, state_store=store)
+        second = check_remove_public_access(REGION, state_store=store)
+        store.close()
+
+        self.assertIn("Disabled public access for 1", first['reason'])
+        self.assertEqual(second['skipped'], 1)
+
+# Entry point for the test script
+if __name__ == '__main__':
+    result = unittest.main()
+    logger.info(result)